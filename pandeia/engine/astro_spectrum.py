@@ -4,7 +4,6 @@ from __future__ import division, absolute_import
 import numpy as np
 import scipy.constants as cs
 import scipy.integrate as ig
-import pyfftw
 from astropy.io import fits
 from astropy.convolution import convolve_fft
 
@@ -12,6 +11,7 @@ from .normalization import NormalizationFactory
 from .extinction import ExtinctionFactory
 from .sed import SEDFactory
 from .coords import Grid
+from . import fft_utils
 from .utils import merge_wavelengths, spectrum_resample
 from .custom_exceptions import EngineInputError, WavesetMismatch, DataError, RangeError, DataConfigurationError
 from .pandeia_warnings import astrospectrum_warning_messages as warning_messages
@@ -19,8 +19,6 @@ from .constants import pandeia_rtol, pandeia_atol
 
 from six.moves import range
 
-# pyfftw.interfaces.cache.enable()
-
 
 class ModelSceneCube(object):
 
@@ -40,6 +38,9 @@ class ModelSceneCube(object):
         Source spectra to add to the model cube
     grid: pandeia.engine.coord.Grid instance
         Grid describing the 2D spatial coordinates for each plane of the cube
+    build_cube: bool
+        If True (default), sample the sources into the full 3D intensity cube, self.int. If False, only
+        the separable components of each source, self.planes and self.fluxes, are kept and self.int is None.
 
     Methods
     -------
@@ -49,7 +50,7 @@ class ModelSceneCube(object):
     _point_source: generate a point source with sub-pixel positioning
     """
 
-    def __init__(self, source_spectra, grid):
+    def __init__(self, source_spectra, grid, build_cube=True):
         self.grid = grid
         self.x = grid.x
         self.y = grid.y
@@ -65,12 +66,19 @@ class ModelSceneCube(object):
             if not np.array_equal(self.wave, s.wave):
                 message = "Model cube input spectra must be sampled at the same wavelengths."
                 raise EngineInputError(value=message)
+        # each source is separable into a normalized spatial plane and a spectrum. keep these around so that
+        # the cube can be convolved per source rather than per wavelength plane.
+        self.planes = []
+        self.fluxes = []
         # stick wavelength as the 3rd index of the cube to enable broadcasting
-        self.int = np.zeros(self.x.shape + (self.wave.size, ), dtype=np.float32)
- 
+        if build_cube:
+            self.int = np.zeros(self.x.shape + (self.wave.size, ), dtype=np.float32)
+        else:
+            self.int = None
+
         for source_spectrum in source_spectra:
             self.add_source(source_spectrum)
-        
+
     def add_source(self, spectrum):
         """
         Add a source to the model cube.
@@ -80,6 +88,37 @@ class ModelSceneCube(object):
         spectrum: pandeia.engine.astro_spectrum.AstroSpectrum instance
             Spectrum object containing spatial and spectral information for the source to be added
         """
+        plane = self._source_plane(spectrum)
+        self.planes.append(plane)
+        self.fluxes.append(spectrum.flux)
+
+        if self.int is None:
+            return
+
+        # This broadcasting step can really spike the memory for large fields (like SOSS).
+        # So we split up the task if there are a lot of wavelength planes at the cost of a few seconds of run time.
+        # Potentially this could be done more elegantly
+        CHUNK = 1000
+        if self.nw>CHUNK:
+            self.int[:,:,0:CHUNK] += plane.reshape(plane.shape + (1,)) * spectrum.flux[0:CHUNK]
+            self.int[:,:,CHUNK:] += plane.reshape(plane.shape + (1,)) * spectrum.flux[CHUNK:]
+        else:
+            self.int += plane.reshape(plane.shape + (1, )) * spectrum.flux
+
+    def _source_plane(self, spectrum):
+        """
+        Sample the spatial distribution of a source onto the grid.
+
+        Parameters
+        ----------
+        spectrum: pandeia.engine.astro_spectrum.AstroSpectrum instance
+            Spectrum object containing spatial and spectral information for the source
+
+        Returns
+        -------
+        plane: 2D numpy.ndarray
+            2D image containing normalized source intensity
+        """
         src = spectrum.src
         if src.shape['geometry'] == "point":
             plane = self._point_source(
@@ -115,17 +154,8 @@ class ModelSceneCube(object):
         else:
             msg = "Unsupported source geometry: %s" % src.shape['geometry']
             raise EngineInputError(value=msg)
-        
-        # This broadcasting step can really spike the memory for large fields (like SOSS). 
-        # So we split up the task if there are a lot of wavelength planes at the cost of a few seconds of run time. 
-        # Potentially this could be done more elegantly 
-        CHUNK = 1000
-        if self.nw>CHUNK:
-            self.int[:,:,0:CHUNK] += plane.reshape(plane.shape + (1,)) * spectrum.flux[0:CHUNK]
-            self.int[:,:,CHUNK+1:] += plane.reshape(plane.shape + (1,)) * spectrum.flux[CHUNK+1:]
-        else:
-            self.int += plane.reshape(plane.shape + (1, )) * spectrum.flux
-        
+        return plane
+
     def export_to_fits(self, fitsfile='ModelSceneCube.fits'):
         """
         Write model cube to a FITS file
@@ -588,6 +618,14 @@ class ConvolvedSceneCube(object):
         A background spectrum.
     PSFLibrary : PSFLibrary
         A library of the PSFs to use.
+    convolution : dict, optional
+        Convolution settings as in CalculationConfig: 'separable' to convolve per library PSF and 'batched' to
+        convolve in batches of planes rather than one plane at a time, and 'max_memory', the memory budget in MB
+        of each batch.
+    build_flux_plus_bg : bool, optional
+        Build the flux cubes including background along with the flux cubes (default). If False, they are
+        only built from flux_cube_list and bg_mask_list when flux_plus_bg_list is accessed, which saves a full-size
+        cube per slice while they are not needed.
 
 
     Attributes
@@ -596,14 +634,22 @@ class ConvolvedSceneCube(object):
     instrument :
     Grid :
     flux_cube :
-    flux_plus_bg :
+    flux_plus_bg_list :
+    bg_mask_list : list of 2D np.ndarray
+        Spatial profile of the background in each slice such that
+        flux_plus_bg = flux_cube + bg_mask[:, :, np.newaxis] * background.mjy_pix
 
     """
 
-    def __init__(self, scene, instrument, background=None, psf_library=None, webapp=False):
+    def __init__(self, scene, instrument, background=None, psf_library=None, webapp=False, convolution=None,
+                 build_flux_plus_bg=True):
         self.warnings = {}
+        self.build_flux_plus_bg = build_flux_plus_bg
         self.scene = scene
         self.psf_library = psf_library
+        self.convolution = {'separable': False, 'batched': False, 'max_memory': fft_utils.default_max_memory}
+        if convolution is not None:
+            self.convolution.update(convolution)
         self.aper_width = instrument.get_aperture_pars()['disp']
         self.aper_height = instrument.get_aperture_pars()['xdisp']
         self.multishutter = instrument.get_aperture_pars()['multishutter']
@@ -739,7 +785,7 @@ class ConvolvedSceneCube(object):
         if self.background is not None:
             self.background.resample(self.wave)
 
-        self.grid, self.aperture_list, self.flux_cube_list, self.flux_plus_bg_list = \
+        self.grid, self.aperture_list, self.flux_cube_list, self._flux_plus_bg_list = \
             self.create_flux_cube(background=self.background)
         
         self.dist = self.grid.dist()
@@ -823,7 +869,8 @@ class ConvolvedSceneCube(object):
             spatial grid used to create cube(s) (coords.Grid instance)
             list of apertures (list)
             list of flux cubes (list; one per aperture)
-            list of flux cuves including background (list; one per aperture)
+            list of flux cuves including background (list; one per aperture), or None if
+            build_flux_plus_bg is False
 
         """
         if self.psf_library is None:
@@ -839,18 +886,6 @@ class ConvolvedSceneCube(object):
             detector_npix += 1
         detector_shape = (detector_npix, detector_npix)
 
-        flux_cube_list = [
-            np.zeros(
-                (detector_shape[0],
-                 detector_shape[1],
-                 self.nw), dtype=np.float32) for ir in range(self.nslice)]
-
-        flux_plus_bg_list = [
-            np.zeros(
-                (detector_shape[0],
-                 detector_shape[1],
-                 self.nw), dtype=np.float32) for ir in range(self.nslice)]
-
         if background is not None:
             self.bg = background.mjy_pix
         else:
@@ -860,12 +895,6 @@ class ConvolvedSceneCube(object):
         psf_associations = self.psf_library.associate_offset_to_source(self.scene.sources, instrument_name, aperture_name)
         unique_offsets = list(set(psf_associations))
 
-        current_scenes = []
-        for unique_offset in unique_offsets:
-            offset_indices = [i for (i, v) in enumerate(psf_associations) if v == unique_offset]
-            current_scene = ModelSceneCube([self.source_spectra[i] for i in offset_indices], scene_grid)
-            current_scenes.append(current_scene)
-            
         # Check whether we have only a single point source near the center 
         # (if we do, the convolution can be faster because we don't have to convolve a field larger
         # than the PSF kernel size, even if the scene is formally larger)
@@ -877,7 +906,54 @@ class ConvolvedSceneCube(object):
                 self.single_point_source = False
             elif src.shape['geometry'] is not 'point':
                 self.single_point_source = False
-        
+
+        """
+        PSFLibrary.get_psf() interpolates linearly between the two library PSFs that bracket a wavelength and
+        convolution is linear. Each plane of the convolved cube is therefore a weighted sum of each source's spatial
+        profile convolved with the library PSFs, which takes one convolution per source and library PSF rather than
+        one per wavelength plane. This is a big win for spectroscopic modes with thousands of planes and is used
+        if convolution['separable'] is True and it needs fewer convolutions. If convolution['batched'] is True,
+        batches of planes are convolved with single many-plane FFTs otherwise. Both round differently from the
+        per-plane convolution and change the results at the 1e-7 level, so neither is used by default. Otherwise
+        each plane is convolved on its own with astropy's convolve_fft() as in earlier versions.
+        """
+        offset_groups = []
+        n_separable = 0
+        for unique_offset in unique_offsets:
+            offset_indices = [i for (i, v) in enumerate(psf_associations) if v == unique_offset]
+            psfs, weights = self.psf_library.get_psf_weights(self.wave, instrument_name, aperture_name,
+                                                             source_offset=unique_offset)
+            offset_groups.append((offset_indices, psfs, weights))
+            n_separable += len(offset_indices) * len(psfs)
+
+        if self.convolution['separable'] and n_separable < self.nw * len(unique_offsets):
+            return self._create_separable_flux_cube(scene_grid, offset_groups, psf_pixsize, psf_upsamp,
+                                                    detector_shape)
+        if self.convolution['batched']:
+            return self._create_batched_flux_cube(scene_grid, offset_groups, psf_pixsize, psf_upsamp, detector_shape)
+
+        # the original method: convolve each wavelength plane with its interpolated PSF
+
+        flux_cube_list = [
+            np.zeros(
+                (detector_shape[0],
+                 detector_shape[1],
+                 self.nw), dtype=np.float32) for ir in range(self.nslice)]
+
+        if self.build_flux_plus_bg:
+            flux_plus_bg_list = [
+                np.zeros(
+                    (detector_shape[0],
+                     detector_shape[1],
+                     self.nw), dtype=np.float32) for ir in range(self.nslice)]
+        else:
+            flux_plus_bg_list = None
+
+        current_scenes = []
+        for offset_indices, psfs, weights in offset_groups:
+            current_scene = ModelSceneCube([self.source_spectra[i] for i in offset_indices], scene_grid)
+            current_scenes.append(current_scene)
+
         for iw in np.arange(self.nw):
             for current_scene, unique_offset, i in zip(current_scenes, unique_offsets, range(len(unique_offsets))):
                 if i == 0:
@@ -916,10 +992,183 @@ class ConvolvedSceneCube(object):
 
             for islice in range(self.nslice):
                 flux_cube_list[islice][:, :, iw] = psf.slice_int_list[islice]
-                flux_plus_bg_list[islice][:, :, iw] = psf.slice_int_plus_bg_list[islice]
+                if flux_plus_bg_list is not None:
+                    flux_plus_bg_list[islice][:, :, iw] = psf.slice_int_plus_bg_list[islice]
+
+        # the slit masks are the same for all wavelengths
+        self.bg_mask_list = [slice_mask / psf_upsamp ** 2 for slice_mask in psf.slice_mask_list]
 
         return psf.grid, psf.aperture_list, flux_cube_list, flux_plus_bg_list
 
+    def _create_separable_flux_cube(self, scene_grid, offset_groups, psf_pixsize, psf_upsamp, detector_shape):
+        """
+        Generate the flux cubes by convolving each source's spatial profile with each of the library PSFs
+        it needs and then combining the results with the source spectra and the PSF interpolation weights.
+        This gives the same cubes as convolving each wavelength plane with an interpolated PSF.
+
+        Parameters
+        ----------
+        scene_grid: coords.Grid instance
+            PSF-sampled grid to create the model scenes on
+        offset_groups: list of tuples (list, list, 2D np.ndarray)
+            For each group of sources that share a PSF offset: the indices of the sources, the library PSFs,
+            and the interpolation weights as returned by PSFLibrary.get_psf_weights()
+        psf_pixsize: float
+            Pixel scale of the PSF library
+        psf_upsamp: int
+            PSF upsampling factor
+        detector_shape: tuple (int, int)
+            Shape of the detector-sampled cube planes
+
+        Returns
+        -------
+        <tuple>:
+            spatial grid used to create cube(s) (coords.Grid instance)
+            list of apertures (list)
+            list of flux cubes (list; one per aperture)
+            list of flux cubes including background (list; one per aperture)
+        """
+        grid = Grid(psf_pixsize * psf_upsamp, psf_pixsize * psf_upsamp, detector_shape[0], detector_shape[1])
+        slice_masks, aperture_list = _slice_masks(grid, scene_grid, aper_width=self.aper_width,
+                                                  aper_height=self.aper_height, multishutter=self.multishutter,
+                                                  nslice=self.nslice)
+
+        flux_cube_list = [np.zeros(detector_shape + (self.nw,), dtype=np.float32) for mask in slice_masks]
+
+        for i, (offset_indices, psfs, weights) in enumerate(offset_groups):
+            current_scene = ModelSceneCube([self.source_spectra[j] for j in offset_indices], scene_grid,
+                                           build_cube=False)
+            nterms = len(current_scene.planes) * len(psfs)
+            terms_list = [np.zeros(detector_shape + (nterms,), dtype=np.float32) for mask in slice_masks]
+            coeffs = np.zeros((nterms, self.nw), dtype=np.float32)
+
+            iterm = 0
+            for plane, flux in zip(current_scene.planes, current_scene.fluxes):
+                for psf, psf_weights in zip(psfs, weights.T):
+                    if psf['int'].shape[0] != psf['int'].shape[1]:
+                        raise ValueError("The PSF must have a square grid shape nx=ny")
+                    # as in the plane-by-plane case, only the first group of sources gets the single point
+                    # source treatment.
+                    intensity = _convolve_plane(plane, psf['int'], single=(i == 0 and self.single_point_source))
+                    for terms, slice_mask in zip(terms_list, slice_masks):
+                        terms[:, :, iterm] = _rebin(intensity * slice_mask, detector_shape)
+                    coeffs[iterm] = flux * psf_weights
+                    iterm += 1
+
+            for flux_cube, terms in zip(flux_cube_list, terms_list):
+                flux_cube += np.dot(terms, coeffs)
+
+        # the background is uniform so it only needs to be sampled through the slice masks
+        self.bg_mask_list = [_rebin(slice_mask, detector_shape) / psf_upsamp ** 2 for slice_mask in slice_masks]
+        flux_plus_bg_list = None
+        if self.build_flux_plus_bg:
+            flux_plus_bg_list = self._add_background(flux_cube_list)
+
+        return grid, aperture_list, flux_cube_list, flux_plus_bg_list
+
+    def _create_batched_flux_cube(self, scene_grid, offset_groups, psf_pixsize, psf_upsamp, detector_shape):
+        """
+        Generate the flux cubes by convolving the model scene cube of each group of sources in batches of
+        wavelength planes with fft_utils.convolve_cube(). This takes far fewer FFTW calls and no per-plane kernel
+        transforms. It is an approximation of convolving each plane with AdvancedPSF: the real single precision
+        transforms and Fourier-space PSF interpolation change the cubes at the 1e-7 level, so it is only used if
+        convolution['batched'] is True.
+
+        Parameters
+        ----------
+        scene_grid: coords.Grid instance
+            PSF-sampled grid to create the model scenes on
+        offset_groups: list of tuples (list, list, 2D np.ndarray)
+            For each group of sources that share a PSF offset: the indices of the sources, the library PSFs,
+            and the interpolation weights as returned by PSFLibrary.get_psf_weights()
+        psf_pixsize: float
+            Pixel scale of the PSF library
+        psf_upsamp: int
+            PSF upsampling factor
+        detector_shape: tuple (int, int)
+            Shape of the detector-sampled cube planes
+
+        Returns
+        -------
+        <tuple>:
+            spatial grid used to create cube(s) (coords.Grid instance)
+            list of apertures (list)
+            list of flux cubes (list; one per aperture)
+            list of flux cubes including background (list; one per aperture)
+        """
+        grid = Grid(psf_pixsize * psf_upsamp, psf_pixsize * psf_upsamp, detector_shape[0], detector_shape[1])
+        slice_masks, aperture_list = _slice_masks(grid, scene_grid, aper_width=self.aper_width,
+                                                  aper_height=self.aper_height, multishutter=self.multishutter,
+                                                  nslice=self.nslice)
+
+        flux_cube_list = [np.zeros(detector_shape + (self.nw,), dtype=np.float32) for mask in slice_masks]
+        max_memory = self.convolution['max_memory']
+
+        for i, (offset_indices, psfs, weights) in enumerate(offset_groups):
+            kernels = [psf['int'] for psf in psfs]
+            if kernels[0].shape[0] != kernels[0].shape[1]:
+                raise ValueError("The PSF must have a square grid shape nx=ny")
+            current_scene = ModelSceneCube([self.source_spectra[j] for j in offset_indices], scene_grid)
+
+            # as in the plane-by-plane case, only the first group of sources gets the single point
+            # source treatment of only convolving the central region the size of the kernel.
+            if i == 0 and self.single_point_source:
+                mini = int((scene_grid.nx - kernels[0].shape[0]) / 2)
+                maxi = int((scene_grid.nx + kernels[0].shape[0]) / 2)
+            else:
+                mini, maxi = 0, scene_grid.nx
+
+            # convolve and rebin in batches of planes so that the full resolution convolved cube is never needed
+            nbatch = fft_utils.chunk_size((maxi - mini, maxi - mini), kernels[0].shape, max_memory=max_memory)
+            for start in range(0, self.nw, nbatch):
+                stop = min(start + nbatch, self.nw)
+                intensity = np.zeros((scene_grid.ny, scene_grid.nx, stop - start), dtype=np.float32)
+                intensity[mini:maxi, mini:maxi] = fft_utils.convolve_cube(
+                    current_scene.int[mini:maxi, mini:maxi, start:stop],
+                    kernels,
+                    weights[start:stop],
+                    max_memory=max_memory,
+                    cache=True
+                )
+                for flux_cube, slice_mask in zip(flux_cube_list, slice_masks):
+                    flux_cube[:, :, start:stop] += _rebin(intensity * slice_mask[:, :, np.newaxis], detector_shape)
+
+        # the background is uniform so it only needs to be sampled through the slice masks
+        self.bg_mask_list = [_rebin(slice_mask, detector_shape) / psf_upsamp ** 2 for slice_mask in slice_masks]
+        flux_plus_bg_list = None
+        if self.build_flux_plus_bg:
+            flux_plus_bg_list = self._add_background(flux_cube_list)
+
+        return grid, aperture_list, flux_cube_list, flux_plus_bg_list
+
+    @property
+    def flux_plus_bg_list(self):
+        """
+        List of flux cubes including background, one per slice. If they were not built along with the flux
+        cubes (see build_flux_plus_bg), they are built from them each time this is accessed.
+        """
+        if self._flux_plus_bg_list is not None:
+            return self._flux_plus_bg_list
+        return self._add_background(self.flux_cube_list)
+
+    def _add_background(self, flux_cube_list):
+        """
+        Add the background, sampled through each slice's mask, to the flux cubes
+
+        Parameters
+        ----------
+        flux_cube_list : list of 3D np.ndarray
+            Flux cube of each slice
+
+        Returns
+        -------
+        flux_plus_bg_list : list of 3D np.ndarray
+        """
+        flux_plus_bg_list = []
+        for flux_cube, bg_mask in zip(flux_cube_list, self.bg_mask_list):
+            flux_plus_bg_list.append(flux_cube + (bg_mask[:, :, np.newaxis] * self.bg).astype(np.float32))
+        return flux_plus_bg_list
+
     def spectral_model_transform(self):
         """
         Create engine API format dict section containing properties of the wavelength coordinates
@@ -1061,25 +1310,27 @@ class AdvancedPSF(object):
             # match the original method
             # self.intensity = convolve_fft(model_scene.int[:, :, windex], kernel[:-1, :-1], normalize_kernel=False)
 
-            # Optimal solution using astropy.convolution plus pyFFTW
-            
+            # Optimal solution using astropy.convolution plus pyFFTW, set up by fft_utils so that the plans are
+            # reused. The faster methods in ConvolvedSceneCube.create_flux_cube() do not go through here.
             if single:
                 kernel_npix = kernel.shape[0]
-                mini = np.int((scene_npix - kernel_npix)/2) # minimum index of the kernel size within the FOV
-                maxi = np.int((scene_npix + kernel_npix)/2) # maximum index of the kernel size within the FOV
-                
-                self.intensity = np.zeros((scene_npix,scene_npix))
+                mini = int((scene_npix - kernel_npix) / 2)  # minimum index of the kernel size within the FOV
+                maxi = int((scene_npix + kernel_npix) / 2)  # maximum index of the kernel size within the FOV
+
+                self.intensity = np.zeros((scene_npix, scene_npix))
                 self.intensity[mini:maxi, mini:maxi] = convolve_fft(model_scene.int[mini:maxi, mini:maxi, windex],
                                                                     kernel, normalize_kernel=False,
-                                              boundary='fill',
-                                              fftn=pyfftw.interfaces.numpy_fft.fftn,
-                                              ifftn=pyfftw.interfaces.numpy_fft.ifftn,complex_dtype=np.complex64)
+                                                                    boundary='fill',
+                                                                    fftn=fft_utils.fftn,
+                                                                    ifftn=fft_utils.ifftn,
+                                                                    complex_dtype=np.complex64)
             else:
                 self.intensity = convolve_fft(model_scene.int[:, :, windex], kernel, normalize_kernel=False,
                                               boundary='fill',
-                                              fftn=pyfftw.interfaces.numpy_fft.fftn,
-                                              ifftn=pyfftw.interfaces.numpy_fft.ifftn,complex_dtype=np.complex64)
-                
+                                              fftn=fft_utils.fftn,
+                                              ifftn=fft_utils.ifftn,
+                                              complex_dtype=np.complex64)
+
         else:
             self.intensity = profile['int']
 
@@ -1087,58 +1338,20 @@ class AdvancedPSF(object):
         # Add the background
         self.intensity_plus_bg = self.intensity + bg_w / psf_upsamp ** 2
 
-        """
-        We can now operate with any number of physical spectral apertures (slices) of the FOV. A single slit
-        mode simply has nslice=1. An imaging mode is also a slice, but with infinite aperture.
-        A multishutter instrument can create a slice aperture mask consisting of a discrete number of mutually
-        offset rectangles. In principle, one could create an IFU with each slice consisting of discrete shutters.
-        This could be used to simulate different IFU designs, such as lenslet or micro-mirror arrays.
-        """
-        if aper_width is not None and aper_height is not None:
-            offsets = [(i - (nslice - 1) / 2.) * aper_width for i in np.arange(nslice)]
-            self.slice_int_list = []
-            self.slice_int_plus_bg_list = []
-            self.slice_mask_list = []
-            self.aperture_list = []
-            self.grid = Grid(psf_pixscl * psf_upsamp, psf_pixscl * psf_upsamp, npix, npix)
-            fine_grid = Grid(psf_pixscl, psf_pixscl, scene_npix, scene_npix)
-            for offset in offsets:
-                slice_mask_fine = np.zeros(self.intensity.shape)
-                # Is this a multishutter instrument?
-                if multishutter:
-                    for shutter in multishutter:
-                        new_mask = fine_grid.rectangular_mask(
-                            width=aper_width,
-                            height=aper_height,
-                            xoff=offset + shutter[0],
-                            yoff=shutter[1]
-                        )
-                        slice_mask_fine = np.maximum(slice_mask_fine, new_mask)
-                else:
-                    slice_mask_fine = fine_grid.rectangular_mask(
-                        width=aper_width,
-                        height=aper_height,
-                        xoff=offset,
-                        yoff=0.0
-                    )
-
-                slice_int, slice_int_plus_bg, slice_mask = self._apply_slit_mask(slice_mask_fine, new_shape)
-                # for this purpose a set of multiple shutters is treated as a single aperture and uses
-                # the properties of the central shutter.
-                aperture = {'width': aper_width, 'height': aper_height, 'offset': (0., offset)}
-                self.slice_int_list.append(slice_int)
-                self.slice_int_plus_bg_list.append(slice_int_plus_bg)
-                self.slice_mask_list.append(slice_mask)
-                self.aperture_list.append(aperture)
-
-        else:
-            slice_mask_fine = np.ones((scene_npix, scene_npix))
+        # slice the FOV into the physical spectral apertures. see _slice_masks() for details.
+        self.grid = Grid(psf_pixscl * psf_upsamp, psf_pixscl * psf_upsamp, npix, npix)
+        fine_grid = Grid(psf_pixscl, psf_pixscl, scene_npix, scene_npix)
+        slice_masks_fine, self.aperture_list = _slice_masks(self.grid, fine_grid, aper_width=aper_width,
+                                                            aper_height=aper_height, multishutter=multishutter,
+                                                            nslice=nslice)
+        self.slice_int_list = []
+        self.slice_int_plus_bg_list = []
+        self.slice_mask_list = []
+        for slice_mask_fine in slice_masks_fine:
             slice_int, slice_int_plus_bg, slice_mask = self._apply_slit_mask(slice_mask_fine, new_shape)
-            self.grid = Grid(psf_pixscl * psf_upsamp, psf_pixscl * psf_upsamp, npix, npix)
-            self.slice_int_list = [slice_int]
-            self.slice_int_plus_bg_list = [slice_int_plus_bg]
-            self.slice_mask_list = [slice_mask]
-            self.aperture_list = [self.grid.get_aperture()]
+            self.slice_int_list.append(slice_int)
+            self.slice_int_plus_bg_list.append(slice_int_plus_bg)
+            self.slice_mask_list.append(slice_mask)
 
     def add_intensity(self, psf):
         """
@@ -1208,9 +1421,7 @@ class AdvancedPSF(object):
         -------
         ndarray
         """
-        sh = int(shape[0]), int(a.shape[0] // shape[0]), int(shape[1]), int(a.shape[1] // shape[1])
-        new = a.reshape(sh).sum(-1).sum(1)
-        return new
+        return _rebin(a, shape)
 
     def _rebin_1d_mean(self, a, shape):
         """
@@ -1230,3 +1441,117 @@ class AdvancedPSF(object):
         sh = shape, a.shape[1] // shape
         new = a.reshape(sh).mean(-1)
         return new
+
+
+def _convolve_plane(plane, kernel, single=False):
+    """
+    Convolve a 2D image with a PSF library kernel using pyFFTW. The same results as
+    astropy.convolution.convolve_fft(), but the kernel FFTs are cached across calls. See fft_utils.convolve().
+
+    Parameters
+    ----------
+    plane: 2D np.ndarray
+        Image to convolve
+    kernel: 2D np.ndarray
+        PSF kernel. This must be a PSF library entry, see fft_utils.KernelFFTCache.
+    single: bool
+        If True, only convolve the central region the size of the kernel and leave the rest at zero.
+        This is valid when there is only a single point source near the center of the field.
+
+    Returns
+    -------
+    intensity: 2D np.ndarray
+        Convolved image
+    """
+    if single:
+        scene_npix = plane.shape[0]
+        kernel_npix = kernel.shape[0]
+        mini = int((scene_npix - kernel_npix) / 2)  # minimum index of the kernel size within the FOV
+        maxi = int((scene_npix + kernel_npix) / 2)  # maximum index of the kernel size within the FOV
+
+        intensity = np.zeros((scene_npix, scene_npix))
+        intensity[mini:maxi, mini:maxi] = fft_utils.convolve(plane[mini:maxi, mini:maxi], kernel, cache=True)
+    else:
+        intensity = fft_utils.convolve(plane, kernel, cache=True)
+    return intensity
+
+
+def _slice_masks(grid, fine_grid, aper_width=None, aper_height=None, multishutter=None, nslice=1):
+    """
+    We can operate with any number of physical spectral apertures (slices) of the FOV. A single slit
+    mode simply has nslice=1. An imaging mode is also a slice, but with infinite aperture.
+    A multishutter instrument can create a slice aperture mask consisting of a discrete number of mutually
+    offset rectangles. In principle, one could create an IFU with each slice consisting of discrete shutters.
+    This could be used to simulate different IFU designs, such as lenslet or micro-mirror arrays.
+
+    Parameters
+    ----------
+    grid: coords.Grid instance
+        Detector-sampled grid
+    fine_grid: coords.Grid instance
+        PSF-sampled grid that the masks are created on
+    aper_width: float
+        Width of the aperture used to slice the PSF
+    aper_height: float
+        Height of the aperture used to slice the PSF
+    multishutter: list of (float, float)
+        List of X and Y offsets of the rectangles that make up a multishutter aperture
+    nslice: int
+        Number of slices
+
+    Returns
+    -------
+    masks, apertures: list of 2D np.ndarray, list of dicts
+        Slice masks on fine_grid and the corresponding aperture specifications
+    """
+    masks = []
+    apertures = []
+    if aper_width is not None and aper_height is not None:
+        offsets = [(i - (nslice - 1) / 2.) * aper_width for i in np.arange(nslice)]
+        for offset in offsets:
+            slice_mask_fine = np.zeros((fine_grid.ny, fine_grid.nx))
+            # Is this a multishutter instrument?
+            if multishutter:
+                for shutter in multishutter:
+                    new_mask = fine_grid.rectangular_mask(
+                        width=aper_width,
+                        height=aper_height,
+                        xoff=offset + shutter[0],
+                        yoff=shutter[1]
+                    )
+                    slice_mask_fine = np.maximum(slice_mask_fine, new_mask)
+            else:
+                slice_mask_fine = fine_grid.rectangular_mask(
+                    width=aper_width,
+                    height=aper_height,
+                    xoff=offset,
+                    yoff=0.0
+                )
+            masks.append(slice_mask_fine)
+            # for this purpose a set of multiple shutters is treated as a single aperture and uses
+            # the properties of the central shutter.
+            apertures.append({'width': aper_width, 'height': aper_height, 'offset': (0., offset)})
+    else:
+        masks.append(np.ones((fine_grid.ny, fine_grid.nx)))
+        apertures.append(grid.get_aperture())
+    return masks, apertures
+
+
+def _rebin(a, shape):
+    """
+    Re-bin a 2D array by summing. Any further axes, e.g. wavelength in a cube, are carried along unchanged.
+
+    Parameters
+    ----------
+    a : ndarray
+        Array to be re-binned
+    shape : list-like
+        New shape of the first two axes after re-binning
+
+    Returns
+    -------
+    ndarray
+    """
+    sh = (int(shape[0]), int(a.shape[0] // shape[0]), int(shape[1]), int(a.shape[1] // shape[1])) + a.shape[2:]
+    new = a.reshape(sh).sum(3).sum(1)
+    return new
@@ -2,27 +2,43 @@
 from __future__ import division, absolute_import
 
 import copy
+import itertools
+import numbers
+import functools
 import numpy as np
+import numpy.ma as ma
 import scipy.integrate as integrate
-import scipy.interpolate as sci_int
-from scipy.ndimage.interpolation import shift
+from scipy.ndimage import shift
 from astropy.convolution import convolve_fft
-import pyfftw
 
 from . import observation
 from . import astro_spectrum as astro
 from . import background as bg
 from . import coords
+from . import fft_utils
 from .config import DefaultConfig
-from .report import Report
+from .report import Report, get_wave_pix, get_reference_index
+from .exposure import ExposureGrid
 from .scene import Scene
 from .calc_utils import build_empty_scene
+from .utils import interpolate_axis
 from .custom_exceptions import EngineInputError, EngineOutputError, RangeError, DataError
+from .pandeia_warnings import etc3d_warning_messages as warning_messages
+from .io_utils import refdata_cache
 from .instrument_factory import InstrumentFactory
 from .strategy import StrategyFactory
 
 from six.moves import zip
-# pyfftw.interfaces.cache.enable()
+from collections import OrderedDict
+
+# detector readout parameters that can be changed without recalculating the detector signal
+EXPOSURE_KEYS = ('ngroup', 'nint', 'nexp')
+
+# IPC kernels with at most this many elements are applied directly rather than via FFTs
+ipc_direct_max_size = 49
+
+# number of saturation products (unsaturated groups and masks) kept per slice by DetectorSignal
+saturation_cache_size = 8
 
 
 class CalculationConfig(DefaultConfig):
@@ -33,6 +49,14 @@ class CalculationConfig(DefaultConfig):
     pass
 
 
+class ReverseConfig(DefaultConfig):
+
+    """
+    Encapsulate reverse calculation configuration parameters (e.g. target S/N, limits of the readout pattern search)
+    """
+    pass
+
+
 class DetectorSignal(astro.ConvolvedSceneCube):
 
     """
@@ -91,7 +115,10 @@ class DetectorSignal(astro.ConvolvedSceneCube):
             self.current_instrument,
             background=self.background,
             psf_library=self.current_instrument.psf_library,
-            webapp=webapp
+            webapp=webapp,
+            convolution=self.calculation_config.convolution,
+            # the background rates are propagated on their own unless configured otherwise
+            build_flux_plus_bg=not self.calculation_config.background_rates['analytic']
         )
 
         self.warnings.update(self.background.warnings)
@@ -105,15 +132,23 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         self.saturation_list = []
         self.pixgrid_list = []
 
+        # unsaturated groups and saturation maps, keyed by rate array and readout pattern. see get_unsaturated_groups().
+        self._saturation_cache = OrderedDict()
+
         # Loop over all slices and calculate the photon and electron rates through the
         # observatory for each one. Note that many modes (imaging, etc.) will have just
         # a single slice.
-        for flux_cube, flux_plus_bg in zip(self.flux_cube_list, self.flux_plus_bg_list):
+        for islice, (flux_cube, bg_mask) in enumerate(zip(self.flux_cube_list, self.bg_mask_list)):
             # Rates for the slice without the background
             slice_rate = self.all_rates(flux_cube, add_extended_background=False)
 
-            # Rates for the slice with the background added
-            slice_rate_plus_bg = self.all_rates(flux_plus_bg, add_extended_background=True)
+            # Rates for the slice with the background added. the background is a uniform spectrum sampled
+            # through the slice mask and every step of the rate calculation is linear, so it can be propagated
+            # on its own, without the source cube, and added to the source rates.
+            if self.calculation_config.background_rates['analytic']:
+                slice_rate_plus_bg = self.add_rates(slice_rate, self.background_rates(bg_mask))
+            else:
+                slice_rate_plus_bg = self.all_rates(self.flux_plus_bg_list[islice], add_extended_background=True)
 
             # Saturation map for the slice
             slice_saturation = self.get_saturation_mask(rate=slice_rate_plus_bg['fp_pix'])
@@ -142,7 +177,13 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         self.rate = self.on_detector(self.rate_list)
         self.rate_plus_bg = self.on_detector(self.rate_plus_bg_list)
 
-        self.detector_pixels = self.current_instrument.get_detector_pixels(self.wave_pix)
+        if self.projection_type in ('spec', 'slitless', 'multiorder'):
+            self.detector_pixels = self.current_instrument.get_pixel_mapping(
+                self.wave.min(),
+                self.wave.max()
+            )['detector_pixels']
+        else:
+            self.detector_pixels = self.current_instrument.get_detector_pixels(self.wave_pix)
 
         # Get the read noise correlation matrix and store it as an attribute.
         if self.det_pars['rn_correlation']:
@@ -379,6 +420,109 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         }
         return products
 
+    def background_rates(self, bg_mask):
+        """
+        Calculate the detector rates due to the background alone, i.e. what all_rates() gives for a cube
+        bg_mask[:, :, np.newaxis] * self.background.mjy_pix, including the extended background of slitless modes.
+        The background is propagated through the system as a 1D spectrum and projected onto the detector along
+        with the profile of the mask, so the cost does not scale with the size of the cube except for slitless
+        projections of masks that vary along the cross-dispersion direction.
+
+        Parameters
+        ----------
+        bg_mask: 2D np.ndarray
+            Spatial profile of the background in the slice
+
+        Returns
+        -------
+        products: dict
+            Dict of products produced by rate calculation.
+                'wave_pix' - Mapping of wavelength to detector pixels
+                'fp_pix' - Background rate per pixel
+                'fp_pix_no_ipc' - Background rate per pixel excluding effects if inter-pixel capacitance
+                'fp_pix_variance' - Variance of the background rate per pixel
+        """
+        # the background rate at the focal plane in interacting photons/s/pixel/micron
+        bg_fp_rate = self.bg_fp_rate[np.newaxis, np.newaxis, :]
+
+        if self.projection_type == 'image':
+            # integrate the spectrum once and scale the mask by it
+            fp_pix_rate, fp_pix_variance = self.image_rate(bg_fp_rate)
+            fp_pix_rate = bg_mask * fp_pix_rate
+            fp_pix_variance = bg_mask * fp_pix_variance
+            # the mask cancels out of the rate-weighted mean wavelength
+            wave_pix = self.wave_eff(bg_fp_rate)
+
+        elif self.projection_type == 'spec':
+            # spec_rate() only needs the mask summed along the dispersion direction
+            if self.dispersion_axis == 'x':
+                profile = bg_mask.sum(axis=1)[:, np.newaxis, np.newaxis]
+            else:
+                profile = bg_mask.sum(axis=0)[np.newaxis, :, np.newaxis]
+            wave_pix, fp_pix_rate, fp_pix_variance = self.spec_rate(profile * bg_fp_rate)
+
+        elif self.projection_type in ('slitless', 'multiorder'):
+            # if the mask doesn't vary along the cross-dispersion direction, shifting the planes by the trace doesn't
+            # change them, so each detector row (or column for dispersion along Y) is the same and only one needs
+            # to be projected.
+            cross_axis = 0 if self.dispersion_axis == 'x' else 1
+            first = np.take(bg_mask, [0], axis=cross_axis)
+            if np.all(bg_mask == first):
+                wave_pix, fp_pix_rate, fp_pix_variance = self.slitless_rate(
+                    first[:, :, np.newaxis] * bg_fp_rate,
+                    add_extended_background=True
+                )
+                fp_pix_rate = np.repeat(fp_pix_rate, bg_mask.shape[cross_axis], axis=cross_axis)
+                fp_pix_variance = np.repeat(fp_pix_variance, bg_mask.shape[cross_axis], axis=cross_axis)
+            else:
+                wave_pix, fp_pix_rate, fp_pix_variance = self.slitless_rate(
+                    bg_mask[:, :, np.newaxis] * bg_fp_rate,
+                    add_extended_background=True
+                )
+
+        else:
+            raise EngineOutputError(value="Unsupported projection_type: %s" % self.projection_type)
+
+        # Include IPC effects, if available and requested
+        if self.det_pars['ipc'] and self.calculation_config.effects['ipc']:
+            kernel = self.current_instrument.get_ipc_kernel()
+            fp_pix_rate_ipc = self.ipc_convolve(fp_pix_rate, kernel)
+        else:
+            fp_pix_rate_ipc = fp_pix_rate
+
+        products = {
+            'wave_pix': wave_pix,
+            'fp_pix': fp_pix_rate_ipc,
+            'fp_pix_no_ipc': fp_pix_rate,
+            'fp_pix_variance': fp_pix_variance
+        }
+        return products
+
+    def add_rates(self, rate, bg_rate):
+        """
+        Combine the source rates from all_rates() with the background rates from background_rates() into the
+        rates including background. The cubes at the telescope aperture and focal plane are not used for
+        the rates including background so they are not built, and the wavelength mapping is that of the
+        source rates.
+
+        Parameters
+        ----------
+        rate: dict
+            Source rates as returned by all_rates()
+        bg_rate: dict
+            Background rates as returned by background_rates()
+
+        Returns
+        -------
+        products: dict
+            Dict of per pixel products including background: 'wave_pix', 'fp_pix', 'fp_pix_no_ipc', and
+            'fp_pix_variance'
+        """
+        products = {'wave_pix': rate['wave_pix']}
+        for key in ('fp_pix', 'fp_pix_no_ipc', 'fp_pix_variance'):
+            products[key] = rate[key] + bg_rate[key]
+        return products
+
     def ote_rate(self, flux):
         """
         Calculate source rate in e-/s/pixel/micron at the telescope entrance aperture given
@@ -386,7 +530,7 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         """
         # spectrum in mJy/pixel, wave in micron, f_lambda in photons/cm^2/s/micron
         f_lambda = 1.5091905 * (flux / self.wave)
-        ote_int = self.current_instrument.telescope.get_ote_eff(self.wave)
+        ote_int = self.current_instrument.get_throughput_curves(self.wave)['ote']
         coll_area = self.current_instrument.telescope.coll_area
         a_lambda = coll_area * ote_int
         # e-/s/pixel/micron
@@ -397,14 +541,12 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         """
         Takes the output from self.ote_rate() and multiplies it by the components
         of efficiency within the system and returns the source rate at the focal plane in
-        e-/s/pixel/micron.
+        e-/s/pixel/micron. The filter, disperser, internal and QE efficiencies are combined into one
+        cached curve by Instrument.get_throughput_curves().
         """
-        filter_eff = self.current_instrument.get_filter_eff(self.wave)
-        disperser_eff = self.current_instrument.get_disperser_eff(self.wave)
-        internal_eff = self.current_instrument.get_internal_eff(self.wave)
-        qe = self.current_instrument.get_detector_qe(self.wave)
+        instrument_eff = self.current_instrument.get_throughput_curves(self.wave)['instrument']
 
-        fp_rate = rate * filter_eff * disperser_eff * internal_eff * qe
+        fp_rate = rate * instrument_eff
         return fp_rate
 
     def spec_rate(self, rate):
@@ -427,16 +569,15 @@ class DetectorSignal(astro.ConvolvedSceneCube):
             third element - variance of electron rate per pixel
         '''
         dispersion = self.current_instrument.get_dispersion(self.wave)
-        wave_pix = self.current_instrument.get_wave_pix()
-        wave_pix_trunc = wave_pix[np.where(np.logical_and(wave_pix >= self.wave.min(),
-                                                          wave_pix <= self.wave.max()))]
+        # the pixels within the wavelength range of the cube. the mapping is cached per configuration.
+        wave_pix_trunc = self.current_instrument.get_pixel_mapping(self.wave.min(), self.wave.max())['wave_pix']
 
         # Check that the source spectrum is actually inside the instrumental wavelength
         # coverage.
         if len(wave_pix_trunc) == 0:
             raise RangeError(value='wave and wave_pix do not overlap')
 
-        # Check the dispersion axis to determine which axis to sum and interpolate over
+        # Check the dispersion axis to determine which spatial axis to sum over
         if self.dispersion_axis == 'x':
             axis = 1
         else:
@@ -449,11 +590,10 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         # from e-/s/micron to e-/s/pixel.
         spec_rate_pix = spec_rate * dispersion
 
-        # but we are still sampled on the internal grid, so we have to interpolate to the pixel grid.
-        # use kind='slinear' since it's ~2x more memory efficient than 'linear'. 'slinear' uses different code path to
-        # calculate the slopes.
-        int_spec_rate = sci_int.interp1d(self.wave, spec_rate_pix, axis=axis, kind='slinear', assume_sorted=True, copy=False)
-        spec_rate_pix_sampled = int_spec_rate(wave_pix_trunc)
+        # but we are still sampled on the internal grid, so we have to interpolate to the pixel grid. the
+        # interpolation matrix between the two grids is cached so it's only built once per pair of grids.
+        # wavelength is the last axis of the summed rate for either dispersion axis.
+        spec_rate_pix_sampled = interpolate_axis(spec_rate_pix, self.wave, wave_pix_trunc, axis=-1)
 
         # Handle a detector gap here by constructing a mask. If the current_instrument implements it,
         # it'll be a real mask array.  Otherwise it will simply be 1.0.
@@ -464,14 +604,15 @@ class DetectorSignal(astro.ConvolvedSceneCube):
 
         # Add effects of non-unity quantum yields. For the spec projection, we assume that the quantum yield does not
         # change over a spectral element. Then we can just multiply the products by the relevant factors.
-        q_yield, fano_factor = self.current_instrument.get_quantum_yield(wave_pix_trunc)
+        curves = self.current_instrument.get_throughput_curves(wave_pix_trunc)
+        q_yield, fano_factor = curves['q_yield'], curves['fano_factor']
 
         # convert the photon rate to electron rate by multiplying by the quantum yield which is a function of wavelength
         spec_electron_rate_pix = spec_rate_pix_sampled * q_yield
 
         # to meet IDT expectations, some instruments require a possibly chromatic fudge factor to be applied
         # to the per-pixel electron rate variance.
-        var_fudge = self.current_instrument.get_variance_fudge(wave_pix_trunc)
+        var_fudge = curves['var_fudge']
 
         # the variance in the electron rate, Ve, is also scaled by the quantum yield plus a fano factor which is
         # analytic in the simple 1 or 2 electron case: Ve = (qy + fano) * Re.  since Re is the photon rate
@@ -497,14 +638,15 @@ class DetectorSignal(astro.ConvolvedSceneCube):
             first element - electron rate per pixel
             second element - variance of electron rate per pixel
         '''
-        q_yield, fano_factor = self.current_instrument.get_quantum_yield(self.wave)
+        curves = self.current_instrument.get_throughput_curves(self.wave)
+        q_yield, fano_factor = curves['q_yield'], curves['fano_factor']
 
         # convert the photon rate to electron rate by multiplying by the quantum yield which is a function of wavelength
         electron_rate_pix = integrate.simps(rate * q_yield, self.wave)
 
         # to meet IDT expectations, some instruments require a possibly chromatic fudge factor to be applied
         # to the per-pixel electron rate variance.
-        var_fudge = self.current_instrument.get_variance_fudge(self.wave)
+        var_fudge = curves['var_fudge']
 
         # the variance in the electron rate, Ve, is also scaled by the quantum yield plus a fano factor which is
         # analytic in the simple 1 or 2 electron case: Ve = (qy + fano) * Re.  since Re is the photon rate
@@ -534,111 +676,93 @@ class DetectorSignal(astro.ConvolvedSceneCube):
             wave_pix: 1D numpy.ndarray containing wavelength to pixel mapping on the detector plane
             spec_rate: 2D numpy.ndarray of detector count rates
         '''
-        wave_pix = self.current_instrument.get_wave_pix()
-        wave_subs = np.where(
-            np.logical_and(
-                wave_pix >= self.wave.min(),
-                wave_pix <= self.wave.max()
-            )
-        )
-        wave_pix_trunc = wave_pix[wave_subs]
+        # the pixels within the wavelength range of the cube and their dispersion and trace. these are cached per
+        # configuration so they're only read once for all of the slices, dithers and passes.
+        pixel_mapping = self.current_instrument.get_pixel_mapping(self.wave.min(), self.wave.max())
+        wave_pix_trunc = pixel_mapping['wave_pix']
 
         if len(wave_pix_trunc) == 0:
             raise RangeError(value='wave and wave_pix do not overlap')
 
-        dispersion = self.current_instrument.get_dispersion(wave_pix_trunc)
-        trace = self.current_instrument.get_trace(wave_pix_trunc)
+        dispersion = pixel_mapping['dispersion']
+        trace = pixel_mapping['trace']
 
-        q_yield, fano_factor = self.current_instrument.get_quantum_yield(wave_pix_trunc)
-        # if we kind='slinear' since it's ~2x more memory efficient than 'linear'. 'slinear' uses different code
-        # path to calculate the slopes. However, slinear is *much* slower, so it is a tradeoff. Also lowering the
-        # rate type to float32 to conserve memory.
-        int_rate_pix = sci_int.interp1d(self.wave, rate.astype(np.float32,casting='same_kind'), 
-                                        kind='linear', axis=2, assume_sorted=True, copy=False)
-        rate_pix = int_rate_pix(wave_pix_trunc)
+        curves = self.current_instrument.get_throughput_curves(wave_pix_trunc)
+        q_yield, fano_factor = curves['q_yield'], curves['fano_factor']
+        # interpolate the cube onto the pixel wavelengths with a sparse interpolation matrix, which is cached per
+        # pair of grids and applied in one pass without any temporaries beyond the working copy. lower the rate
+        # type to float32 to conserve memory.
+        rate_pix = interpolate_axis(rate, self.wave, wave_pix_trunc, axis=2, dtype=np.float32)
 
-        # convert the photon rate to electron rate by multiplying by the quantum yield which is a function of wavelength
-        electron_rate_pix = rate_pix * q_yield
+        # the photon rate is converted to electron rate by multiplying by the quantum yield which is a function
+        # of wavelength. these are per-wavelength factors so they're applied when the planes are projected below.
+        electron_rate_factor = q_yield
 
         # to meet IDT expectations, some instruments require a possibly chromatic fudge factor to be applied
         # to the per-pixel electron rate variance.
-        var_fudge = self.current_instrument.get_variance_fudge(wave_pix_trunc)
+        var_fudge = curves['var_fudge']
 
         # the variance in the electron rate, Ve, is also scaled by the quantum yield plus a fano factor which is
         # analytic in the simple 1 or 2 electron case: Ve = (qy + fano) * Re.  since Re is the photon rate
         # scaled by the quantum yield, Re = qy * Rp, we get: Ve = qy * (qy + fano) * Rp
-        electron_variance_pix = rate_pix * q_yield * (q_yield + fano_factor) * var_fudge
+        electron_variance_factor = q_yield * (q_yield + fano_factor) * var_fudge
 
         # interpolate the background onto the pixel spacing
-        int_bg_fp_rate = sci_int.interp1d(self.wave, self.bg_fp_rate.astype(np.float32,casting='same_kind'), 
-                                          kind='linear', assume_sorted=True, copy=False)
-        bg_fp_rate_pix = int_bg_fp_rate(wave_pix_trunc)
+        bg_fp_rate_pix = interpolate_axis(self.bg_fp_rate, self.wave, wave_pix_trunc, dtype=np.float32)
 
         # calculate electron rate and variance due to background
-        bg_electron_rate = bg_fp_rate_pix * q_yield
-        bg_electron_variance = bg_fp_rate_pix * q_yield * (q_yield + fano_factor) * var_fudge
+        bg_electron_rate = bg_fp_rate_pix * electron_rate_factor
+        bg_electron_variance = bg_fp_rate_pix * electron_variance_factor
 
         # dispersion_axis tells us whether we need to sum the planes of the cube horizontally
-        # or vertically on the detector plane.
+        # or vertically on the detector plane. the projection is done with the spatial axis to shift the
+        # trace along first and the dispersion axis second, so transpose the cube for dispersion along Y.
         if self.dispersion_axis == 'x':
-            spec_shape = (rate_pix.shape[0], rate_pix.shape[2] + rate_pix.shape[1])
-            spec_rate = np.zeros(spec_shape)
-            spec_variance = np.zeros(spec_shape)
-            for i in np.arange(dispersion.shape[0]):
-                # Background not yet completely added. Make sure there is a trace shift to be done so that we
-                # don't make an expensive call to shift() if we don't have to. Use mode='nearest' to fill in new
-                # pixels with background when image is shifted.
-                if trace[i] != 0.0:
-                    spec_rate[:, i:i + rate_pix.shape[1]] += shift(
-                        electron_rate_pix[:, :, i],
-                        shift=(trace[i], 0),
-                        mode='nearest',
-                        order=1
-                    ) * dispersion[i]
-                    spec_variance[:, i:i + rate_pix.shape[1]] += shift(
-                        electron_variance_pix[:, :, i],
-                        shift=(trace[i], 0),
-                        mode='nearest',
-                        order=1
-                    ) * dispersion[i]
-                else:
-                    spec_rate[:, i:i + rate_pix.shape[1]] += electron_rate_pix[:, :, i] * dispersion[i]
-                    spec_variance[:, i:i + rate_pix.shape[1]] += electron_variance_pix[:, :, i] * dispersion[i]
-
-                # Adding background to all other pixels, unless we are asked not to.
-                if add_extended_background:
-                    spec_rate[:, :i] += bg_electron_rate[i] * dispersion[i]
-                    spec_rate[:, i + rate_pix.shape[1]:] += bg_electron_rate[i] * dispersion[i]
-                    spec_variance[:, :i] += bg_electron_variance[i] * dispersion[i]
-                    spec_variance[:, i + rate_pix.shape[1]:] += bg_electron_variance[i] * dispersion[i]
+            cube = rate_pix
         else:
-            spec_shape = (rate_pix.shape[2] + rate_pix.shape[0], rate_pix.shape[1])
-            spec_rate = np.zeros(spec_shape)
-            spec_variance = np.zeros(spec_shape)
-            for i in np.arange(dispersion.shape[0]):
-                # Background not yet completely added. Make sure there is a trace shift to be done so that we
-                # don't make an expensive call to shift() if we don't have to. Use mode='nearest' to fill in new
-                # pixels with background when image is shifted.
-                if trace[i] != 0.0:
-                    spec_rate[i:i + rate_pix.shape[1], :] += shift(
-                        electron_rate_pix[:, :, i],
-                        shift=(0, trace[i]),
-                        mode='nearest'
-                    ) * dispersion[i]
-                    spec_variance[i:i + rate_pix.shape[1], :] += shift(
-                        electron_variance_pix[:, :, i],
-                        shift=(0, trace[i]),
-                        mode='nearest'
-                    ) * dispersion[i]
-                else:
-                    spec_rate[i:i + rate_pix.shape[1], :] += electron_rate_pix[:, :, i] * dispersion[i]
-                    spec_variance[i:i + rate_pix.shape[1], :] += electron_rate_pix[:, :, i] * dispersion[i]
-                # Adding background to all other pixels, unless we are asked not to.
-                if add_extended_background:
-                    spec_rate[:i, :] += bg_electron_rate[i] * dispersion[i]
-                    spec_rate[i + rate_pix.shape[1]:, :] += bg_electron_rate[i] * dispersion[i]
-                    spec_variance[:i, :] += bg_electron_variance[i] * dispersion[i]
-                    spec_variance[i + rate_pix.shape[1]:, :] += bg_electron_variance[i] * dispersion[i]
+            cube = rate_pix.transpose(1, 0, 2)
+
+        # shift each plane by the trace with mode='nearest' to fill in new pixels at the edges. the shift is
+        # linear so the rate and variance, which only differ by per-wavelength factors, can share it. dispersion
+        # along X uses linear interpolation, which is done for all planes at once. dispersion along Y uses
+        # spline interpolation, which has to be done plane by plane.
+        if np.any(trace != 0.0):
+            if self.dispersion_axis == 'x':
+                cube = _shift_planes(cube, trace)
+            else:
+                shifted = np.empty_like(cube)
+                for i in np.arange(trace.shape[0]):
+                    if trace[i] != 0.0:
+                        shifted[:, :, i] = shift(cube[:, :, i], shift=(trace[i], 0), mode='nearest')
+                    else:
+                        shifted[:, :, i] = cube[:, :, i]
+                cube = shifted
+
+        # for dispersion along Y, the planes without a trace shift add the electron rate rather than the
+        # electron variance to the variance.
+        variance_factor = electron_variance_factor
+        if self.dispersion_axis != 'x':
+            variance_factor = np.where(trace != 0.0, electron_variance_factor, electron_rate_factor)
+
+        # co-add the planes along the dispersion axis, each offset by one pixel from the previous one
+        spec_rate = _disperse_planes(cube, electron_rate_factor * dispersion)
+        spec_variance = _disperse_planes(cube, variance_factor * dispersion)
+
+        # add the background to all of the pixels that are outside the footprint of each plane, unless we are
+        # asked not to. columns to the left of plane i's footprint get its background, as do columns to the right.
+        if add_extended_background:
+            ncol = spec_rate.shape[1]
+            nx = cube.shape[1]
+            for spec, bg_rate in ((spec_rate, bg_electron_rate), (spec_variance, bg_electron_variance)):
+                cum_bg = np.concatenate(([0.], np.cumsum(bg_rate * dispersion)))
+                cols = np.arange(ncol)
+                left = cum_bg[-1] - cum_bg[np.minimum(cols + 1, cum_bg.size - 1)]
+                right = cum_bg[np.clip(cols - nx + 1, 0, cum_bg.size - 1)]
+                spec += left + right
+
+        if self.dispersion_axis != 'x':
+            spec_rate = spec_rate.T
+            spec_variance = spec_variance.T
 
         # dispersion_axis determines whether wavelength is the first or second axis
         if self.dispersion_axis == 'x' or self.projection_type == 'multiorder':
@@ -665,15 +789,108 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         return self.projection_type
 
     def ipc_convolve(self, rate, kernel):
-        fp_pix_ipc = convolve_fft(rate, kernel, normalize_kernel=False,
-                                  boundary='wrap',
-                                  fftn=pyfftw.interfaces.numpy_fft.fftn,
-                                  ifftn=pyfftw.interfaces.numpy_fft.ifftn)
+        """
+        Apply inter-pixel capacitance by convolving the rate image with the IPC kernel, wrapping around at the
+        edges. IPC kernels are typically 3x3, so small kernels are applied directly as a sum of shifted copies of
+        the image, which is much faster than padded FFTs. Larger kernels are convolved via FFTs. Both give the same
+        results as convolve_fft(rate, kernel, boundary='wrap', normalize_kernel=False).
+
+        Parameters
+        ----------
+        rate: 2D numpy.ndarray
+            Detector plane rate image
+        kernel: 2D numpy.ndarray
+            IPC kernel
+
+        Returns
+        -------
+        fp_pix_ipc: 2D numpy.ndarray
+            Rate image including IPC
+        """
+        if kernel.size <= ipc_direct_max_size and all(k <= n for k, n in zip(kernel.shape, rate.shape)):
+            fp_pix_ipc = _wrap_convolve(rate, kernel)
+        else:
+            fp_pix_ipc = convolve_fft(rate, kernel, normalize_kernel=False,
+                                      boundary='wrap',
+                                      fftn=fft_utils.fftn,
+                                      ifftn=fft_utils.ifftn)
         return fp_pix_ipc
 
+    def get_unsaturated_groups(self, rate, fullwell, full_saturation=2, exposure_spec=None):
+        """
+        Get the number of unsaturated groups in each pixel via ExposureSpecification.get_unsaturated_groups().
+        The result only depends on the rate, the readout pattern and the detector parameters, but it is needed
+        for every slice, dither, and extraction, so it is cached. Cached entries are keyed by the identity of
+        the rate array, so rates must not be modified in place once used, and are dropped by update_exposure().
+
+        Parameters
+        ----------
+        rate: 2D np.ndarray
+            Detector plane rate image
+        fullwell: float
+            Number of electrons defining a full well
+        full_saturation: int
+            The minimum number of groups allowed to define an unsaturated measurement
+        exposure_spec: ExposureSpecification instance or None
+            Readout pattern. If None, the instrument's current exposure_spec is used.
+
+        Returns
+        -------
+        unsat_ngroups: MaskedArray
+            Number of unsaturated groups. This is shared so must not be modified.
+        """
+        if exposure_spec is None:
+            exposure_spec = self.current_instrument.exposure_spec
+        key = self._saturation_key(rate, exposure_spec, fullwell, full_saturation)
+        unsat_ngroups = self._get_saturation_product(key, rate, exposure_spec)
+        if unsat_ngroups is None:
+            unsat_ngroups = exposure_spec.get_unsaturated_groups(rate, fullwell, full_saturation=full_saturation)
+            unsat_ngroups.flags.writeable = False
+            self._put_saturation_product(key, rate, exposure_spec, unsat_ngroups)
+        return unsat_ngroups
+
+    @staticmethod
+    def _saturation_key(rate, exposure_spec, fullwell, *extra):
+        """
+        Build the cache key of a saturation product from the identity of the rate array and exposure
+        specification and the readout parameters that ExposureSpecification.get_unsaturated_groups() depends on.
+        """
+        key = (
+            id(rate),
+            id(exposure_spec),
+            exposure_spec.ngroup,
+            exposure_spec.saturation_time,
+            fullwell
+        ) + extra
+        return key
+
+    def _get_saturation_product(self, key, rate, exposure_spec):
+        """
+        Look up a cached saturation product. The entry holds references to the rate array and exposure
+        specification it was built from, so a key whose ids have been reused by new objects is a miss.
+        """
+        entry = self._saturation_cache.get(key)
+        if entry is None or entry[0] is not rate or entry[1] is not exposure_spec:
+            return None
+        self._saturation_cache.pop(key)
+        self._saturation_cache[key] = entry
+        return entry[2]
+
+    def _put_saturation_product(self, key, rate, exposure_spec, product):
+        """
+        Cache a saturation product, dropping the least recently used entries once there are more than
+        saturation_cache_size per slice.
+        """
+        self._saturation_cache.pop(key, None)
+        self._saturation_cache[key] = (rate, exposure_spec, product)
+        max_size = saturation_cache_size * max(1, len(self.rate_plus_bg_list))
+        while len(self._saturation_cache) > max_size:
+            self._saturation_cache.popitem(last=False)
+
     def get_saturation_mask(self, rate=None):
         """
         Compute a numpy array indicating pixels with full saturation (2), partial saturation (1) and no saturation (0).
+        Masks are cached alongside the unsaturated groups they are built from, see get_unsaturated_groups().
 
         Parameters
         ----------
@@ -683,24 +900,38 @@ class DetectorSignal(astro.ConvolvedSceneCube):
         Returns
         -------
         mask: 2D np.ndarray
-            Saturation mask image
+            Saturation mask image. This is shared so must not be modified.
         """
         if rate is None:
             rate = self.rate_plus_bg
 
-        saturation_mask = np.zeros(rate.shape)
+        if not self.calculation_config.effects['saturation']:
+            return np.zeros(rate.shape)
 
-        if self.calculation_config.effects['saturation']:
-            fullwell = self.det_pars['fullwell']
-            exp_pars = self.current_instrument.exposure_spec
-            unsat_ngroups = exp_pars.get_unsaturated_groups(rate, fullwell)
+        fullwell = self.det_pars['fullwell']
+        exp_pars = self.current_instrument.exposure_spec
+        key = self._saturation_key(rate, exp_pars, fullwell, 'mask')
+        saturation_mask = self._get_saturation_product(key, rate, exp_pars)
+        if saturation_mask is None:
+            unsat_ngroups = self.get_unsaturated_groups(rate, fullwell, exposure_spec=exp_pars)
             ngroup = exp_pars.ngroup
 
+            saturation_mask = np.zeros(rate.shape)
             saturation_mask[(unsat_ngroups < ngroup)] = 1
             saturation_mask[(unsat_ngroups < 2)] = 2
+            saturation_mask.flags.writeable = False
+            self._put_saturation_product(key, rate, exp_pars, saturation_mask)
 
         return saturation_mask
 
+    def update_exposure(self):
+        """
+        Recompute the products that depend on the detector readout pattern after it has been changed via
+        Instrument.set_exposure_pars(). The rates do not depend on it so only the saturation maps need updating.
+        """
+        self._saturation_cache.clear()
+        self.saturation_list = [self.get_saturation_mask(rate=r['fp_pix']) for r in self.rate_plus_bg_list]
+
 
 class CombinedSignal(object):
 
@@ -725,8 +956,10 @@ class CombinedSignal(object):
         self.warnings = {}
         self.detector_pixel_list = []
         self.wave_pix_list = []
+        self.signal_list = signal_list
         # some things are common to all signals so get them from the first one
         self.parent_signal = signal_list[0]
+        self.observation = self.parent_signal.observation
         self.dispersion_axis = self.parent_signal.dispersion_axis
 
         if len(self.parent_signal.rate_list) > 1:
@@ -764,7 +997,6 @@ class CombinedSignal(object):
         self.bg_fp_rate = self.parent_signal.bg_fp_rate
         self.background = self.parent_signal.background
         self.flux_cube_list = self.parent_signal.flux_cube_list
-        self.flux_plus_bg_list = self.parent_signal.flux_plus_bg_list
 
         self.aperture_list = self.parent_signal.aperture_list
         self.projection_type = self.parent_signal.projection_type
@@ -785,7 +1017,7 @@ class CombinedSignal(object):
             'fp_pix_no_ipc': np.zeros_like(self.dist),
             'fp_pix_variance': np.zeros_like(self.dist)
         }]
-        saturation = np.zeros_like(self.dist)
+        self.pad_list = []
 
         for i, s in enumerate(signal_list):
             ny, nx = s.rate_list[0]['fp_pix'].shape
@@ -811,9 +1043,8 @@ class CombinedSignal(object):
             new_r_bg_noipc = np.pad(s.rate_plus_bg_list[0]['fp_pix_no_ipc'], ([ly, uy], [lx, ux]), mode='edge')
             new_r_var = np.pad(s.rate_list[0]['fp_pix_variance'], ([ly, uy], [lx, ux]), mode='edge')
             new_r_bg_var = np.pad(s.rate_plus_bg_list[0]['fp_pix_variance'], ([ly, uy], [lx, ux]), mode='edge')
-            new_sat = np.pad(s.saturation_list[0], ([ly, uy], [lx, ux]), mode='constant')
 
-            saturation = np.maximum(saturation, new_sat)
+            self.pad_list.append(([ly, uy], [lx, ux]))
             self.rate_list[0]['fp_pix'] += new_r
             self.rate_list[0]['fp_pix_no_ipc'] += new_r_noipc
             self.rate_list[0]['fp_pix_variance'] += new_r_var
@@ -821,11 +1052,35 @@ class CombinedSignal(object):
             self.rate_plus_bg_list[0]['fp_pix_no_ipc'] += new_r_bg_noipc
             self.rate_plus_bg_list[0]['fp_pix_variance'] += new_r_bg_var
 
-        self.saturation_list = [saturation]
+        self.saturation_list = [self._combine_saturation()]
         # SOSS only has one aperture so the on_detector rates are just the fp_pix rates.
         self.rate = self.rate_list[0]['fp_pix']
         self.rate_plus_bg = self.rate_plus_bg_list[0]['fp_pix']
 
+    def _combine_saturation(self):
+        """
+        Combine the saturation maps of each signal onto the combined grid, keeping the most severe saturation.
+
+        Returns
+        -------
+        saturation: 2D np.ndarray
+            Combined saturation map
+        """
+        saturation = np.zeros_like(self.dist)
+        for s, pad in zip(self.signal_list, self.pad_list):
+            new_sat = np.pad(s.saturation_list[0], pad, mode='constant')
+            saturation = np.maximum(saturation, new_sat)
+        return saturation
+
+    def update_exposure(self):
+        """
+        Recompute the saturation maps after the detector readout pattern has been changed via
+        Instrument.set_exposure_pars().
+        """
+        for s in self.signal_list:
+            s.update_exposure()
+        self.saturation_list = [self._combine_saturation()]
+
     def get_saturation_mask(self, rate=None):
         """
         Compute a numpy array indicating pixels with full saturation (2), partial saturation (1) and no saturation (0).
@@ -847,6 +1102,39 @@ class CombinedSignal(object):
         mask = self.parent_signal.get_saturation_mask(rate=rate)
         return mask
 
+    def get_unsaturated_groups(self, rate, fullwell, full_saturation=2, exposure_spec=None):
+        """
+        Get the number of unsaturated groups in each pixel. This version just wraps whats implemented
+        within DetectorSignal.
+
+        Parameters
+        ----------
+        rate: 2D np.ndarray
+            Detector plane rate image
+        fullwell: float
+            Number of electrons defining a full well
+        full_saturation: int
+            The minimum number of groups allowed to define an unsaturated measurement
+        exposure_spec: ExposureSpecification instance or None
+            Readout pattern. If None, the instrument's current exposure_spec is used.
+
+        Returns
+        -------
+        unsat_ngroups: MaskedArray
+            Number of unsaturated groups. This is shared so must not be modified.
+        """
+        unsat_ngroups = self.parent_signal.get_unsaturated_groups(rate, fullwell, full_saturation=full_saturation,
+                                                                  exposure_spec=exposure_spec)
+        return unsat_ngroups
+
+    @property
+    def flux_plus_bg_list(self):
+        """
+        Flux cubes including background of the first signal, see ConvolvedSceneCube.flux_plus_bg_list. These
+        are only built when they are needed.
+        """
+        return self.parent_signal.flux_plus_bg_list
+
     def spectral_detector_transform(self):
         """
         Create engine API format dict section containing properties of wavelength coordinates
@@ -900,6 +1188,7 @@ class DetectorNoise(object):
     def __init__(self, obs_signal, observation):
         self.warnings = {}
         self.observation = observation
+        self.obs_signal = obs_signal
 
         self.grid = obs_signal.grid
         self.dist = obs_signal.dist
@@ -1043,7 +1332,7 @@ class DetectorNoise(object):
         products = var_pix_list, stdev_pix_list, rn_var_pix_list
         return products
 
-    def calc_cr_loss(self, ngroups):
+    def calc_cr_loss(self, ngroups, saturation_time=None):
         """
         Calculate the effective loss of exposure time due to cosmic rays. This uses the cosmic ray (CR) event rate
         that is contained within the telescope configuration to calculate the odds of a cosmic rays
@@ -1060,38 +1349,51 @@ class DetectorNoise(object):
 
         Parameters
         ----------
-        ngroups: int
+        ngroups: float or ndarray
             Number of groups over which to calculate CR losses.  This will usually be number of unsaturated groups.
+            Arrays, including masked arrays, are handled element-wise.
+        saturation_time: float, ndarray, or None
+            Saturation time of the ramps. If None, the current exposure specification's is used. An array must
+            broadcast against ngroups, e.g. to evaluate several readout settings of an ExposureGrid.
 
         Returns
         -------
-        cr_ngroups: float
-            This is the input ngroups scaled by the mean loss of time due to cosmic ray events.
+        cr_ngroups: float or ndarray
+            This is the input ngroups scaled by the mean loss of time due to cosmic ray events. Masked input
+            gives a masked array with the same mask.
         """
         if not self.calculation_config.noise['crs']:
             # if we're not correcting for CRs, just pass ngroups back
             cr_ngroups = ngroups
         else:
-            exp_pars = self.current_instrument.exposure_spec
-
-            # this is the average fraction of the ramp that is lost upon a CR event
-            if ngroups < self.mingroups:
-                # if for some reason (e.g. using single read noise model) ngroup is less than the minimum needed
-                # to get a good ramp fit, then the whole ramp is lost upon a CR event
-                ramp_frac = 1.0
-            else:
-                # the more groups you have per ramp, the less of the ramp you lose to CRs on average.
-                # this formalism takes into account that there's always a fraction that's totally lost.
-                # in the limit of infinite reads this converges on half the ramp since CRs are evenly
-                # distributed.
-                ramp_frac = 1.0 - 0.5 * (ngroups - self.mingroups) / (ngroups - 1.0)
+            if saturation_time is None:
+                saturation_time = self.current_instrument.exposure_spec.saturation_time
+            n = np.array(ma.getdata(ngroups), dtype=float)
+
+            # this is the average fraction of the ramp that is lost upon a CR event.
+            # if for some reason (e.g. using single read noise model) ngroup is less than the minimum needed
+            # to get a good ramp fit, then the whole ramp is lost upon a CR event
+            ramp_frac = np.ones_like(n)
+            # the more groups you have per ramp, the less of the ramp you lose to CRs on average.
+            # this formalism takes into account that there's always a fraction that's totally lost.
+            # in the limit of infinite reads this converges on half the ramp since CRs are evenly
+            # distributed.
+            long_ramps = n >= self.mingroups
+            ramp_frac[long_ramps] = 1.0 - 0.5 * (n[long_ramps] - self.mingroups) / (n[long_ramps] - 1.0)
 
             # the effective ramp exposure/measurement time, t_eff, is t_tot * (1 - ramp_frac * pix_cr_rate * t_ramp). We use the saturation
             # time as an approximation of the time during which a ramp can get damaged by a CR. This was previously more complex to
             # handle the case where a ramp is both saturated and hit by a CR, but that required a recalculation of the exposure time for
             # the unsaturated groups. We now simplify this (the difference is minimal and would add some complex logic now that the time
             # formulae are detector type dependent). This is simple. 
-            cr_ngroups = (1.0 - ramp_frac * self.pix_cr_rate * exp_pars.saturation_time) * ngroups
+            cr_ngroups = (1.0 - ramp_frac * self.pix_cr_rate * saturation_time) * n
+
+            if ma.isMaskedArray(ngroups):
+                # saturation_time may broadcast ngroups to more dimensions, so the mask has to follow
+                mask = np.broadcast_to(ma.getmaskarray(ngroups), cr_ngroups.shape).copy()
+                cr_ngroups = ma.array(cr_ngroups, mask=mask)
+            elif cr_ngroups.ndim == 0:
+                cr_ngroups = float(cr_ngroups)
 
         return cr_ngroups
 
@@ -1124,13 +1426,14 @@ class DetectorNoise(object):
 
         exp_pars = self.current_instrument.exposure_spec
 
-        unsat_ngroups = exp_pars.get_unsaturated_groups(rate['fp_pix_no_ipc'], self.fullwell, full_saturation=self.mingroups)
+        unsat_ngroups = self.obs_signal.get_unsaturated_groups(rate['fp_pix_no_ipc'], self.fullwell,
+                                                              full_saturation=self.mingroups, exposure_spec=exp_pars)
         # scale the unsaturated ngroups by the CR loss.
         #
         # The fact that unsat_ngroups is not an integer is intentional, and is the way the ETC statistically
         # accounts for CR losses.
         if self.calculation_config.noise['crs']:
-            unsat_ngroups = np.vectorize(self.calc_cr_loss)(unsat_ngroups)
+            unsat_ngroups = self.calc_cr_loss(unsat_ngroups)
 
         slope_var, slope_rn_var = exp_pars.slope_variance(rate, dark_current, rn, unsat_ngroups,
                                                           rn_fudge, excessp1, excessp2)
@@ -1157,161 +1460,194 @@ class DetectorNoise(object):
             rn = 0.0
 
         exp_pars = self.current_instrument.exposure_spec
-        unsat_ngroups = exp_pars.get_unsaturated_groups(rate['fp_pix_no_ipc'], self.fullwell, full_saturation=self.mingroups)
+        unsat_ngroups = self.obs_signal.get_unsaturated_groups(rate['fp_pix_no_ipc'], self.fullwell,
+                                                              full_saturation=self.mingroups, exposure_spec=exp_pars)
         # scale the unsaturated ngroups by the CR loss.
         if self.calculation_config.noise['crs']:
-            unsat_ngroups = np.vectorize(self.calc_cr_loss)(unsat_ngroups)
+            unsat_ngroups = self.calc_cr_loss(unsat_ngroups)
 
         var_rn = exp_pars.rn_variance(rn, unsat_ngroups=unsat_ngroups)
 
         return var_rn
 
+    def grid_variance(self, exposure_grid, subscripts):
+        """
+        Calculate the detector plane variances of a set of pixels for every readout setting of an ExposureGrid.
+        This is what basic_source_noise() and on_detector() calculate for the current readout setting, but only
+        the requested pixels are evaluated, so many readout settings can be compared for the cost of one.
 
-def calculate_sn(input, webapp=False):
+        Parameters
+        ----------
+        exposure_grid: exposure.ExposureGrid instance
+            Readout settings to evaluate
+        subscripts: tuple of 1D np.ndarray
+            Detector plane subscripts of the pixels
+
+        Returns
+        -------
+        var_pix: 2D np.ndarray
+            Full variance of each readout setting (first axis) and pixel (second axis)
+        var_rn_pix: 2D np.ndarray
+            Variance strictly due to detector readnoise
+        """
+        dark_current = self.det_pars.get('dark_current', 0.0)
+        rn = self.det_pars.get('rn', 0.0)
+        rn_fudge = self.det_pars.get('rn_fudge', 1.0)
+        excessp1 = self.det_pars.get('excessp1', 0.0)
+        excessp2 = self.det_pars.get('excessp1', 0.0)
+        ff_electrons = self.det_pars['ff_electrons']
+
+        rows, cols = [np.asarray(s, dtype=np.intp) for s in subscripts]
+        var_pix = np.zeros((len(exposure_grid), rows.size))
+        var_rn_pix = np.zeros((len(exposure_grid), rows.size))
+        nramps = exposure_grid.nramps.reshape(-1, 1)
+
+        # the detector plane stacks the apertures along the first axis, see on_detector()
+        aperture_ny = self.var_pix_list[0].shape[0]
+        for i, rate_plus_bg in enumerate(self.obs_signal.rate_plus_bg_list):
+            in_aperture = (rows // aperture_ny) == i
+            if not in_aperture.any():
+                continue
+            pix = (rows[in_aperture] % aperture_ny, cols[in_aperture])
+            rate = dict((key, rate_plus_bg[key][pix]) for key in ('fp_pix', 'fp_pix_no_ipc', 'fp_pix_variance'))
+
+            unsat_ngroups = exposure_grid.get_unsaturated_groups(rate['fp_pix_no_ipc'], self.fullwell,
+                                                                 full_saturation=self.mingroups)
+            if self.calculation_config.noise['crs']:
+                unsat_ngroups = self.calc_cr_loss(unsat_ngroups,
+                                                  saturation_time=exposure_grid.saturation_time.reshape(-1, 1))
+
+            slope_var, slope_rn_var = exposure_grid.slope_variance(rate, dark_current, rn, unsat_ngroups,
+                                                                   rn_fudge, excessp1, excessp2)
+            var = slope_var / nramps
+            if self.calculation_config.noise['ffnoise']:
+                var += rate['fp_pix'] ** 2 / ff_electrons
+
+            var_pix[:, in_aperture] = var
+            var_rn_pix[:, in_aperture] = slope_rn_var / nramps
+
+        det_mask = self.det_mask[rows, cols]
+        products = det_mask * var_pix, det_mask * var_rn_pix
+        return products
+
+
+def _wrap_convolve(image, kernel):
     """
-    This is a function to do the 'forward' exposure time calculation where given a dict
-    in engine API input format we calculate the resulting Signal/Noise and return a Report
-    on the results.
+    Convolve an image with a small kernel directly, wrapping around at the edges. The kernel is centered on
+    pixel (ny // 2, nx // 2) of the kernel as in astropy.convolution.convolve_fft().
 
     Parameters
     ----------
-    input: dict
-        Engine API format dictionary containing the information required to perform the calculation.
-    psf_ibrary : psf_library.PSFLibrary instance
-        Library of PSF files (e.g. produced by webbpsf) to be used in the calculation
+    image: 2D np.ndarray
+        Image to convolve
+    kernel: 2D np.ndarray
+        Convolution kernel, no larger than the image
 
     Returns
     -------
-    report.Report instance
+    result: 2D np.ndarray
+        Convolved image
     """
-    warnings = {}
-    try:
-        scene_configuration = input['scene']
-        background = input['background']
-        instrument_configuration = input['configuration']
-        strategy_configuration = input['strategy']
-    except KeyError as e:
-        message = "Missing information required for the calculation: %s" % str(e)
-        raise EngineInputError(value=message)
-
-    # get the calculation configuration from the input or use the defaults
-    if 'calculation' in input:
-        calc_config = CalculationConfig(config=input['calculation'])
-    else:
-        calc_config = CalculationConfig()
-
-    # #### BEGIN calculation #### #
+    ny, nx = image.shape
+    ky, kx = kernel.shape
+    cy, cx = ky // 2, kx // 2
+    # pad so that every shifted copy of the image is a plain slice of the padded one
+    padded = np.pad(image, ((ky - 1 - cy, cy), (kx - 1 - cx, cx)), mode='wrap')
+    result = np.zeros((ny, nx), dtype=np.result_type(image, kernel, np.float64))
+    for (i, j), k in np.ndenumerate(kernel):
+        if k != 0:
+            result += k * padded[ky - 1 - i:ky - 1 - i + ny, kx - 1 - j:kx - 1 - j + nx]
+    return result
+
+
+def _shift_planes(cube, shifts):
     """
-    This section currently implements the Pandeia engine API.  As the engine's object model
-    is refactored, this section will have to change accordingly.
-    """
-    # check for empty scene configuration and set it up properly if it is empty.
-    if len(scene_configuration) == 0:
-        scene_configuration = build_empty_scene()
-
-    scene = Scene(input=scene_configuration, webapp=webapp)
-    warnings.update(scene.warnings)
-    instrument = InstrumentFactory(config=instrument_configuration, webapp=webapp)
-    warnings.update(instrument.warnings)
-    strategy = StrategyFactory(instrument, config=strategy_configuration, webapp=webapp)
-
-    # strategies can have different figures of interest that need to be calculated.
-    # in most cases, S/N is what is desired.  however, for coronagraphy the figure of interest
-    # is sometimes the contrast that can be achieved.  in this case, strategy.calc_type will be
-    # set to 'contrast' and we need to run calculate_contrast.
-    if hasattr(strategy, "calc_type"):
-        if strategy.calc_type == "contrast":
-            r = calculate_contrast(input, webapp=webapp)
-        else:
-            msg = "Unsupported calculation type: %s" % strategy.calc_type
-            raise EngineInputError(value=msg)
-    else:
-        # set up the observation and then do S/N calculation...
-        obs = observation.Observation(
-            scene=scene,
-            instrument=instrument,
-            strategy=strategy,
-            background=background,
-            webapp=webapp
-        )
+    Shift each plane of a cube along its first axis using linear interpolation, with pixels beyond the edges taking
+    the value of the nearest edge pixel. This is the same as scipy.ndimage.shift(cube[:, :, i], (shifts[i], 0),
+    order=1, mode='nearest') for each plane i, but done for all planes at once.
 
-        # seed the random number generator
-        seed = obs.get_random_seed()
-        np.random.seed(seed=seed)
+    Parameters
+    ----------
+    cube: 3D np.ndarray
+        Cube of planes with shape (ny, nx, nplanes)
+    shifts: 1D np.ndarray
+        Shift of each plane in pixels
 
-        # Sometimes there is more than one exposure involved so implement lists for signal and noise
-        my_detector_signal_list = []
-        my_detector_noise_list = []
-        my_detector_saturation_list = []
+    Returns
+    -------
+    shifted: 3D np.ndarray
+        Shifted cube
+    """
+    ny = cube.shape[0]
+    if ny < 2:
+        return cube.copy()
 
-        if hasattr(strategy, 'dithers'):
-            dither_list = strategy.dithers
-        else:
-            dither_list = [{'x': 0.0, 'y': 0.0}]
-
-        for dither in dither_list:
-            o = copy.deepcopy(obs)
-            o.scene.offset(dither)
-            # Calculate the signal rate in the detector plane. If they're configured, need to loop through
-            # configured orders to include all dispersed signal.
-            if instrument.projection_type == 'multiorder':
-                norders = instrument.disperser_config[instrument.instrument['disperser']]['norders']
-                orders = list(range(1, norders + 1))
-            else:
-                orders = None
+    # input row coordinate that each output row samples
+    coords = np.clip(np.arange(ny)[:, np.newaxis] - shifts[np.newaxis, :], 0, ny - 1)
+    lower = np.minimum(np.floor(coords).astype(int), ny - 2)
+    frac = (coords - lower).astype(cube.dtype)
 
-            if orders is not None:
-                order_signals = []
-                for order in orders:
-                    order_signals.append(DetectorSignal(o, calc_config=calc_config, webapp=webapp, order=order))
-                my_detector_signal = CombinedSignal(order_signals)
-            else:
-                my_detector_signal = DetectorSignal(o, calc_config=calc_config, webapp=webapp, order=None)
+    lower = lower[:, np.newaxis, :]
+    frac = frac[:, np.newaxis, :]
+    shifted = np.take_along_axis(cube, lower, axis=0) * (1 - frac)
+    shifted += np.take_along_axis(cube, lower + 1, axis=0) * frac
+    return shifted
 
-            my_detector_noise = DetectorNoise(my_detector_signal, o)
 
-            # Every dither has a saturation map
-            my_detector_saturation = my_detector_signal.get_saturation_mask()
-
-            my_detector_signal_list.append(my_detector_signal)
-            my_detector_noise_list.append(my_detector_noise)
-            my_detector_saturation_list.append(my_detector_saturation)
+def _disperse_planes(cube, weights):
+    """
+    Project a cube onto a detector by co-adding its planes, each weighted and offset by one pixel along the second
+    axis from the previous one, i.e. detector[:, i:i + nx] += cube[:, :, i] * weights[i].
 
-        # Use the strategy to get the extracted signal/noise products
-        extracted_sn = strategy.extract(my_detector_signal_list, my_detector_noise_list)
-        warnings.update(extracted_sn['warnings'])
-        # #### END calculation #### #
-        r = Report(input, my_detector_signal_list, my_detector_noise_list, my_detector_saturation_list, extracted_sn, warnings)
+    Parameters
+    ----------
+    cube: 3D np.ndarray
+        Cube of planes with shape (ny, nx, nplanes)
+    weights: 1D np.ndarray
+        Weight of each plane
 
-    return r
+    Returns
+    -------
+    detector: 2D np.ndarray
+        Detector image with shape (ny, nx + nplanes)
+    """
+    ny, nx, nplanes = cube.shape
+    detector = np.zeros((ny, nx + nplanes))
+    # loop over the spatial axis, which is much shorter than the wavelength axis for spectra, so that each
+    # step adds a whole slab of planes at once.
+    for i in range(nx):
+        detector[:, i:i + nplanes] += cube[:, i, :] * weights
+    return detector
 
 
-def calculate_contrast(input, webapp=False):
+def _setup_observation(input, webapp=False, contrast=None):
     """
-    This is a function to do the 'forward' exposure time calculation where given a dict
-    in engine API input format we calculate the resulting coronagraphic contrast and return a Report
-    on the results.
-
-    While this method is meant for coronagraphic modes, it will work also for regular imaging modes.
+    Parse an engine API input dict and set up the Observation that a calculation is performed on. This also
+    seeds the random number generator.
 
     Parameters
     ----------
     input: dict
         Engine API format dictionary containing the information required to perform the calculation.
-    psf_ibrary : psf_library.PSFLibrary instance
-        Library of PSF files (e.g. produced by webbpsf) to be used in the calculation
+    webapp: bool
+        Toggle strict engine API checking
+    contrast: bool or None
+        Set up a coronagraphic contrast calculation. If None, this is determined by the strategy's calc_type.
 
     Returns
     -------
-    report.Report instance
+    obs, calc_config, contrast, warnings: tuple
+        observation.Observation instance, CalculationConfig instance, bool, dict
     """
+    # cached products derived from reference data check their files again once in each calculation
+    refdata_cache.new_generation()
+
     warnings = {}
     try:
         scene_configuration = input['scene']
         background = input['background']
         instrument_configuration = input['configuration']
         strategy_configuration = input['strategy']
-        psf_subtraction_configuration = input['strategy']['psf_subtraction_source']
     except KeyError as e:
         message = "Missing information required for the calculation: %s" % str(e)
         raise EngineInputError(value=message)
@@ -1322,9 +1658,9 @@ def calculate_contrast(input, webapp=False):
     else:
         calc_config = CalculationConfig()
 
-    # #### BEGIN calculation #### #
     """
-    This section implements the Pandeia engine API.
+    This section currently implements the Pandeia engine API.  As the engine's object model
+    is refactored, this section will have to change accordingly.
     """
     # check for empty scene configuration and set it up properly if it is empty.
     if len(scene_configuration) == 0:
@@ -1332,37 +1668,60 @@ def calculate_contrast(input, webapp=False):
 
     instrument = InstrumentFactory(config=instrument_configuration, webapp=webapp)
     warnings.update(instrument.warnings)
-    # move the psf_reference to a pre-determined and fixed location outside of the FOV
     strategy = StrategyFactory(instrument, config=strategy_configuration, webapp=webapp)
 
-    # Check for user-specified dithers (the contrast calculation will add an additional 2 fictional dithers).
-    if not hasattr(strategy, 'dithers') or len(strategy.dithers) != 1:
-        message = "Contrast calculations currently require a single dither " \
-                  "to be passed in the strategy, {} was passed".format(strategy.dithers)
-        raise EngineInputError(value=message)
-
-    psf_subtraction_xy = strategy.psf_subtraction_xy
-    pointing_error = strategy.pointing_error
-    psf_subtraction_configuration['position']['x_offset'] = psf_subtraction_xy[0]
-    psf_subtraction_configuration['position']['y_offset'] = psf_subtraction_xy[1]
+    # strategies can have different figures of interest that need to be calculated.
+    # in most cases, S/N is what is desired.  however, for coronagraphy the figure of interest
+    # is sometimes the contrast that can be achieved.  in this case, strategy.calc_type will be
+    # set to 'contrast'.
+    if contrast is None:
+        if hasattr(strategy, "calc_type"):
+            if strategy.calc_type == "contrast":
+                contrast = True
+            else:
+                msg = "Unsupported calculation type: %s" % strategy.calc_type
+                raise EngineInputError(value=msg)
+        else:
+            contrast = False
+
+    if contrast:
+        try:
+            psf_subtraction_configuration = strategy_configuration['psf_subtraction_source']
+        except KeyError as e:
+            message = "Missing information required for the calculation: %s" % str(e)
+            raise EngineInputError(value=message)
+
+        # Check for user-specified dithers (the contrast calculation will add an additional 2 fictional dithers).
+        if not hasattr(strategy, 'dithers') or len(strategy.dithers) != 1:
+            message = "Contrast calculations currently require a single dither " \
+                      "to be passed in the strategy, {} was passed".format(strategy.dithers)
+            raise EngineInputError(value=message)
+
+        # move the psf_reference to a pre-determined and fixed location outside of the FOV
+        psf_subtraction_xy = strategy.psf_subtraction_xy
+        pointing_error = strategy.pointing_error
+        psf_subtraction_configuration['position']['x_offset'] = psf_subtraction_xy[0]
+        psf_subtraction_configuration['position']['y_offset'] = psf_subtraction_xy[1]
+
+        # add the psf_reference to the scene
+        scene_configuration.append(psf_subtraction_configuration)
 
-    # add the psf_reference to the scene
-    scene_configuration.append(psf_subtraction_configuration)
     scene = Scene(input=scene_configuration, webapp=webapp)
-    if hasattr(strategy, "scene_rotation"):
+    if contrast and hasattr(strategy, "scene_rotation"):
         scene.rotate(strategy.scene_rotation)
     warnings.update(scene.warnings)
 
-    # Add the appropriate dithers for the PSF reference star and the unocculted dither
-    psf_subtraction_dither = {
-        'x': -psf_subtraction_xy[0] - pointing_error[0],
-        'y': -psf_subtraction_xy[1] - pointing_error[1]
-    }
-    unocculted_dither = {'x': strategy.unocculted_xy[0], 'y': strategy.unocculted_xy[1]}
+    if contrast:
+        # Add the appropriate dithers for the PSF reference star and the unocculted dither
+        psf_subtraction_dither = {
+            'x': -psf_subtraction_xy[0] - pointing_error[0],
+            'y': -psf_subtraction_xy[1] - pointing_error[1]
+        }
+        unocculted_dither = {'x': strategy.unocculted_xy[0], 'y': strategy.unocculted_xy[1]}
 
-    strategy.dithers.append(psf_subtraction_dither)
-    strategy.dithers.append(unocculted_dither)
-    strategy.on_target = [True, False, False]
+        strategy.dithers.append(psf_subtraction_dither)
+        strategy.dithers.append(unocculted_dither)
+        strategy.on_target = [True, False, False]
 
     # set up the observation...
     obs = observation.Observation(
@@ -1377,32 +1736,219 @@ def calculate_contrast(input, webapp=False):
     seed = obs.get_random_seed()
     np.random.seed(seed=seed)
 
-    # Sometimes there is more than one exposure involved so implement lists for signal and noise
-    my_detector_signal_list = []
-    my_detector_noise_list = []
-    my_detector_saturation_list = []
+    return obs, calc_config, contrast, warnings
+
+
+def _dither_signals(obs, calc_config, webapp=False):
+    """
+    Calculate the detector signal for each dither of an observation.
 
-    for dither in strategy.dithers:
-        # make a new deep copy of the observation for each dither so that each position is offset
+    Parameters
+    ----------
+    obs: observation.Observation instance
+        The observation to calculate signals for
+    calc_config: CalculationConfig instance
+        Contains boolean flags that control which noise components are included in the calculation
+    webapp: bool
+        Toggle strict engine API checking
+
+    Returns
+    -------
+    signal_list: list of DetectorSignal or CombinedSignal instances
+        One signal per dither
+    """
+    instrument = obs.instrument
+    strategy = obs.strategy
+
+    if hasattr(strategy, 'dithers'):
+        dither_list = strategy.dithers
+    else:
+        dither_list = [{'x': 0.0, 'y': 0.0}]
+
+    # Calculate the signal rate in the detector plane. If they're configured, need to loop through
+    # configured orders to include all dispersed signal.
+    if instrument.projection_type == 'multiorder':
+        norders = instrument.disperser_config[instrument.instrument['disperser']]['norders']
+        orders = list(range(1, norders + 1))
+    else:
+        orders = None
+
+    # the signal for each dither, and each order if there are several, is independent of the others. build
+    # the list of all of them so that they can be calculated in parallel if configured.
+    tasks = []
+    for dither in dither_list:
+        # make a new copy of the observation for each dither so that each position is offset
         # from the center position. otherwise the offsets get applied cumulatively via the reference.
-        o = copy.deepcopy(obs)
-        o.scene.offset(dither)
-        # Calculate the signal rate in the detector plane
-        my_detector_signal = DetectorSignal(o, calc_config=calc_config, webapp=webapp)
-        my_detector_noise = DetectorNoise(my_detector_signal, o)
+        # only the scene is really copied, see Observation.offset_copy().
+        o = obs.offset_copy(dither)
+
+        if orders is not None:
+            for order in orders:
+                # each order configures the instrument for itself so needs its own copy of it
+                o_order = copy.copy(o)
+                o_order.instrument = copy.copy(o.instrument)
+                tasks.append((o_order, calc_config, webapp, order))
+        else:
+            tasks.append((o, calc_config, webapp, None))
+
+    signals = _parallel_map(_detector_signal, tasks, executor=calc_config.executor)
+
+    if orders is not None:
+        norders = len(orders)
+        signal_list = [CombinedSignal(signals[i:i + norders]) for i in range(0, len(signals), norders)]
+    else:
+        signal_list = signals
+
+    return signal_list
+
+
+def _detector_signal(task):
+    """
+    Calculate a DetectorSignal from a tuple of its arguments, (observation, calc_config, webapp, order).
+    This is a module-level function so that it can be sent to worker processes.
+    """
+    observation, calc_config, webapp, order = task
+    return DetectorSignal(observation, calc_config=calc_config, webapp=webapp, order=order)
+
+
+def _parallel_map(func, items, executor=None):
+    """
+    Apply a function to each of a list of items, serially or in parallel, and return the results in
+    the order of the items so that the outputs do not depend on how the work was scheduled.
+
+    Parameters
+    ----------
+    func: callable
+        Function to apply. Must be a module-level function to be usable with processes.
+    items: list
+        Arguments to apply func to
+    executor: dict or None
+        Executor configuration as in CalculationConfig.executor: 'type' is one of 'serial' (the default),
+        'threads', or 'processes', and 'max_workers' is the maximum number of workers (None for the
+        concurrent.futures default).
+
+    Returns
+    -------
+    results: list
+        func(item) for each item
+    """
+    if executor is None:
+        executor = {}
+    executor_type = executor.get('type', 'serial')
+    max_workers = executor.get('max_workers', None)
+
+    if executor_type == 'serial' or len(items) < 2:
+        return [func(item) for item in items]
+    if executor_type not in ('threads', 'processes'):
+        msg = "Unsupported executor type: %s. Must be one of 'serial', 'threads', or 'processes'." % executor_type
+        raise EngineInputError(value=msg)
+
+    # concurrent.futures is only in the standard library from python 3.2, so it's only needed if configured
+    try:
+        import concurrent.futures
+    except ImportError:
+        msg = "Executor type %s requires concurrent.futures (python 3.2 or later, or the futures package)." % \
+            executor_type
+        raise EngineInputError(value=msg)
+
+    # the workers already run in parallel, so each one uses a single FFTW thread rather than the configured
+    # fft_utils threads. otherwise every worker would start a thread per CPU and oversubscribe the machine.
+    # the limit is set around each call rather than with a process pool initializer, which needs python 3.7.
+    if executor_type == 'threads':
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    task = functools.partial(_single_fft_thread, func)
+
+    # the workers are not supposed to use the random number generator, but make sure that the state
+    # seeded from Observation.get_random_seed() is the same afterwards as when running serially.
+    random_state = np.random.get_state()
+    with pool:
+        results = list(pool.map(task, items))
+    np.random.set_state(random_state)
+
+    return results
+
+
+def _single_fft_thread(func, item):
+    """
+    Apply a function to an item in a worker of _parallel_map() with FFTW limited to a single thread.
+    This is a module-level function so that it can be sent to worker processes.
+    """
+    with fft_utils.thread_limit(1):
+        return func(item)
+
+
+def _extract_products(strategy, signal_list, contrast=False):
+    """
+    Calculate the noise and saturation for each dither's signal with the instrument's current detector
+    configuration and use the strategy to extract the signal/noise products.
+
+    Parameters
+    ----------
+    strategy: strategy.Strategy instance
+        Strategy used to extract the products
+    signal_list: list of DetectorSignal or CombinedSignal instances
+        One signal per dither
+    contrast: bool
+        If True, also calculate the coronagraphic contrast curve
+
+    Returns
+    -------
+    noise_list, saturation_list, extracted: tuple
+        List of DetectorNoise instances, list of saturation maps, dict of extracted products
+    """
+    noise_list = []
+    saturation_list = []
+    for my_detector_signal in signal_list:
+        my_detector_noise = DetectorNoise(my_detector_signal, my_detector_signal.observation)
 
         # Every dither has a saturation map
         my_detector_saturation = my_detector_signal.get_saturation_mask()
-        my_detector_signal_list.append(my_detector_signal)
-        my_detector_noise_list.append(my_detector_noise)
-        my_detector_saturation_list.append(my_detector_saturation)
 
-    # We need a regular S/N of the target source
-    extracted_sn = strategy.extract(my_detector_signal_list, my_detector_noise_list)
-    warnings.update(extracted_sn['warnings'])
+        noise_list.append(my_detector_noise)
+        saturation_list.append(my_detector_saturation)
+
+    # Use the strategy to get the extracted signal/noise products
+    extracted = strategy.extract(signal_list, noise_list)
+
+    if contrast:
+        extracted['contrast_curve'] = _contrast_curve(strategy, signal_list, noise_list)
+
+        # when a source is offset to unocculted_xy, it can be bright enough to cause saturation
+        # flags to be raised.  however, since this is an "artifactual" offset, those saturation
+        # flags are bogus. the hackish fix is to pop this bogus saturation map off the list
+        # and append a new one filled with zeros.
+        bogus_sat = saturation_list.pop()
+        saturation_list.append(np.zeros(bogus_sat.shape))
+
+    return noise_list, saturation_list, extracted
+
+
+def _contrast_curve(strategy, signal_list, noise_list):
+    """
+    Use the strategy to calculate the coronagraphic contrast as a function of separation from the target.
+    The strategy's extraction configuration is changed while doing this, but is restored afterwards.
+
+    Parameters
+    ----------
+    strategy: strategy.Strategy instance
+        Strategy used to extract the products
+    signal_list: list of DetectorSignal instances
+        One signal per dither
+    noise_list: list of DetectorNoise instances
+        One noise per dither
+
+    Returns
+    -------
+    contrast_curve: list
+        Contrast separations and the contrast at each of them
+    """
+    target_xy = strategy.target_xy
+    dither_weights = strategy.dither_weights
+    on_target = strategy.on_target
 
-    # Use the strategy to get the extracted contrast products
-    grid = my_detector_signal_list[0].grid
+    grid = signal_list[0].grid
 
     aperture = strategy.aperture_size
     annulus = strategy.sky_annulus
@@ -1419,7 +1965,7 @@ def calculate_contrast(input, webapp=False):
     # Calculate contrast at each separation
     for i, contrast_xy in enumerate(contrast_xys):
         strategy.target_xy = contrast_xy
-        extracted = strategy.extract(my_detector_signal_list, my_detector_noise_list)
+        extracted = strategy.extract(signal_list, noise_list)
         contrasts[i] = extracted['extracted_noise']
 
     # What is the flux of the unocculted star.
@@ -1427,43 +1973,522 @@ def calculate_contrast(input, webapp=False):
     strategy.dither_weights = [0, 0, 1]
     strategy.on_target = [False, False, True]
     strategy.target_xy = strategy.unocculted_xy
-    extract_unocculted = strategy.extract(my_detector_signal_list, my_detector_noise_list)
+    extract_unocculted = strategy.extract(signal_list, noise_list)
 
-    # when a source is offset to unocculted_xy, it can be bright enough to cause saturation
-    # flags to be raised.  however, since this is an "artifactual" offset, those saturation
-    # flags are bogus. the hackish fix is to pop this bogus saturation map off the list
-    # and append a new one filled with zeros.
-    bogus_sat = my_detector_saturation_list.pop()
-    my_detector_saturation_list.append(np.zeros(bogus_sat.shape))
+    strategy.target_xy = target_xy
+    strategy.dither_weights = dither_weights
+    strategy.on_target = on_target
 
     # Contrast is relative to the unocculted on-axis star.
     contrasts /= extract_unocculted['extracted_flux']
     contrast_curve = [contrast_separations, contrasts]
+    return contrast_curve
+
+
+def calculate_sn(input, webapp=False):
+    """
+    This is a function to do the 'forward' exposure time calculation where given a dict
+    in engine API input format we calculate the resulting Signal/Noise and return a Report
+    on the results.
+
+    Parameters
+    ----------
+    input: dict
+        Engine API format dictionary containing the information required to perform the calculation.
+    webapp: bool
+        Toggle strict engine API checking
 
+    Returns
+    -------
+    report.Report instance
+    """
+    # #### BEGIN calculation #### #
+    obs, calc_config, contrast, warnings = _setup_observation(input, webapp=webapp)
+
+    # Sometimes there is more than one exposure involved so implement lists for signal and noise
+    my_detector_signal_list = _dither_signals(obs, calc_config, webapp=webapp)
+    my_detector_noise_list, my_detector_saturation_list, extracted_sn = _extract_products(
+        obs.strategy,
+        my_detector_signal_list,
+        contrast=contrast
+    )
+    warnings.update(extracted_sn['warnings'])
     # #### END calculation #### #
 
-    # Add the contrast curve and link relevant saturation maps to the extracted_sn dict for passing
-    extracted_sn['contrast_curve'] = contrast_curve
+    r = Report(input, my_detector_signal_list, my_detector_noise_list, my_detector_saturation_list, extracted_sn, warnings)
+    return r
+
+
+def calculate_contrast(input, webapp=False):
+    """
+    This is a function to do the 'forward' exposure time calculation where given a dict
+    in engine API input format we calculate the resulting coronagraphic contrast and return a Report
+    on the results.
+
+    While this method is meant for coronagraphic modes, it will work also for regular imaging modes.
+
+    Parameters
+    ----------
+    input: dict
+        Engine API format dictionary containing the information required to perform the calculation.
+    webapp: bool
+        Toggle strict engine API checking
+
+    Returns
+    -------
+    report.Report instance
+    """
+    # #### BEGIN calculation #### #
+    obs, calc_config, contrast, warnings = _setup_observation(input, webapp=webapp, contrast=True)
+
+    # Sometimes there is more than one exposure involved so implement lists for signal and noise
+    my_detector_signal_list = _dither_signals(obs, calc_config, webapp=webapp)
+    my_detector_noise_list, my_detector_saturation_list, extracted_sn = _extract_products(
+        obs.strategy,
+        my_detector_signal_list,
+        contrast=True
+    )
+    warnings.update(extracted_sn['warnings'])
+    # #### END calculation #### #
 
     r = Report(input, my_detector_signal_list, my_detector_noise_list, my_detector_saturation_list, extracted_sn, warnings)
     return r
 
 
+def _exposure_list(exposure_grid):
+    """
+    Expand and check a grid of detector readout patterns.
+
+    Parameters
+    ----------
+    exposure_grid: list of dicts or dict of lists
+        Either a list of dicts that each set some of 'ngroup', 'nint', and 'nexp', or a dict that maps
+        each of these to a list of values to use in all combinations.
+
+    Returns
+    -------
+    exposures: list of dicts
+        One dict per readout pattern
+    """
+    if isinstance(exposure_grid, dict):
+        keys = sorted(exposure_grid.keys())
+        values = [np.atleast_1d(exposure_grid[k]).tolist() for k in keys]
+        exposures = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+    else:
+        exposures = [dict(exposure) for exposure in exposure_grid]
+
+    if len(exposures) == 0:
+        msg = "Exposure grid must contain at least one readout pattern."
+        raise EngineInputError(value=msg)
+
+    for exposure in exposures:
+        bad_keys = set(exposure.keys()) - set(EXPOSURE_KEYS)
+        if len(bad_keys) > 0:
+            msg = "Unsupported exposure grid parameter(s) %s. Only %s can be varied." % (
+                ", ".join(sorted(bad_keys)),
+                ", ".join(EXPOSURE_KEYS)
+            )
+            raise EngineInputError(value=msg)
+    return exposures
+
+
+def _set_exposure(obs, signal_list, exposure):
+    """
+    Set the detector readout pattern for an observation whose signals have already been calculated
+    and update the signal products that depend on it.
+
+    Parameters
+    ----------
+    obs: observation.Observation instance
+        The observation the signals were calculated for
+    signal_list: list of DetectorSignal or CombinedSignal instances
+        One signal per dither
+    exposure: dict
+        Readout parameters, 'ngroup', 'nint', and/or 'nexp', to set
+    """
+    # each dither, and each order of a CombinedSignal, has its own shallow copy of the instrument
+    instruments = [obs.instrument]
+    for my_detector_signal in signal_list:
+        for signal in getattr(my_detector_signal, 'signal_list', [my_detector_signal]):
+            if signal.current_instrument not in instruments:
+                instruments.append(signal.current_instrument)
+    for instrument in instruments:
+        instrument.set_exposure_pars(**exposure)
+
+    for my_detector_signal in signal_list:
+        my_detector_signal.update_exposure()
+
+
+def _exposure_input(input, exposure):
+    """
+    Make a copy of the engine API input with the detector configuration updated to a readout pattern.
+    Only the sections that change are copied.
+    """
+    new_input = copy.copy(input)
+    new_input['configuration'] = copy.copy(input['configuration'])
+    new_input['configuration']['detector'] = dict(input['configuration'].get('detector', {}), **exposure)
+    return new_input
+
+
+def calculate_sn_sweep(input, exposure_grid, webapp=False, table=False):
+    """
+    This is a function to do the 'forward' exposure time calculation for many detector readout patterns.
+    Nothing that goes into the detector signal depends on ngroup, nint, or nexp, so the signal is calculated
+    only once. The noise, saturation, and extracted products are then calculated for each readout pattern.
+
+    Parameters
+    ----------
+    input: dict
+        Engine API format dictionary containing the information required to perform the calculation.
+    exposure_grid: list of dicts or dict of lists
+        Readout patterns to calculate. Either a list of dicts that each set some of 'ngroup', 'nint', and 'nexp',
+        or a dict that maps each of these to a list of values to use in all combinations. Parameters that are not
+        set are taken from the input detector configuration.
+    webapp: bool
+        Toggle strict engine API checking
+    table: bool
+        If True, return a table of the scalar results instead of a list of Reports
+
+    Returns
+    -------
+    list of report.Report instances, one per readout pattern, or
+    dict of 1D np.ndarray containing 'ngroup', 'nint', 'nexp' and the numeric entries of Report.as_dict()['scalar']
+    """
+    exposures = _exposure_list(exposure_grid)
+
+    obs, calc_config, contrast, warnings = _setup_observation(input, webapp=webapp)
+    my_detector_signal_list = _dither_signals(obs, calc_config, webapp=webapp)
+
+    # restore the random state for each readout pattern so that the results are the same as calculate_sn()'s
+    random_state = np.random.get_state()
+
+    reports = []
+    for exposure in exposures:
+        _set_exposure(obs, my_detector_signal_list, exposure)
+        np.random.set_state(random_state)
+
+        my_detector_noise_list, my_detector_saturation_list, extracted_sn = _extract_products(
+            obs.strategy,
+            my_detector_signal_list,
+            contrast=contrast
+        )
+        exposure_warnings = dict(warnings)
+        exposure_warnings.update(extracted_sn['warnings'])
+
+        r = Report(
+            _exposure_input(input, exposure),
+            my_detector_signal_list,
+            my_detector_noise_list,
+            my_detector_saturation_list,
+            extracted_sn,
+            exposure_warnings
+        )
+        reports.append(r)
+
+    if not table:
+        return reports
+
+    rows = []
+    for r in reports:
+        exposure_spec = r.exposure_specification
+        row = {'ngroup': exposure_spec.ngroup, 'nint': exposure_spec.nint, 'nexp': exposure_spec.nexp}
+        row.update(r.as_dict()['scalar'])
+        rows.append(row)
+
+    sweep_table = {}
+    for key, value in rows[0].items():
+        if isinstance(value, numbers.Number):
+            sweep_table[key] = np.array([row[key] for row in rows])
+    return sweep_table
+
+
+class ExposureTimeSolver(object):
+
+    """
+    Search the detector readout patterns for the cheapest one that reaches a target S/N. The detector signal and
+    the strategy's extraction weights do not depend on the readout pattern, so they are calculated once. The S/N
+    of a readout pattern then only depends on the variances of the pixels that are extracted for the reference
+    wavelength. DetectorNoise.grid_variance() evaluates these for many readout patterns at once via an
+    ExposureGrid, and a full calculation and Report is only done for the chosen readout pattern.
+
+    Parameters
+    ----------
+    input: dict
+        Engine API format dictionary containing the information required to perform the calculation.
+    webapp: bool
+        Toggle strict engine API checking
+    """
+
+    def __init__(self, input, webapp=False):
+        self.input = input
+        self.obs, calc_config, self.contrast, self.warnings = _setup_observation(input, webapp=webapp)
+        self.signal_list = _dither_signals(self.obs, calc_config, webapp=webapp)
+        # restore the random state for the report so that the results are the same as calculate_sn()'s
+        self.random_state = np.random.get_state()
+        # (ngroup, nint, nexp) -> (S/N, total exposure time)
+        self.evaluated = {}
+        self._setup_noise_model()
+
+    def _setup_noise_model(self):
+        """
+        Set up the extraction of the product at the reference wavelength for each dither: the weights, pixels and
+        flux, and for correlated read noise the pixels whose covariance matrix Strategy.reference_product() uses
+        and their correlation matrix applied to the weights.
+        """
+        strategy = self.obs.strategy
+        # the noise of the configured readout pattern is only needed to set up the extraction weights
+        noise_list = [DetectorNoise(s, s.observation) for s in self.signal_list]
+
+        wave_pix = get_wave_pix(self.signal_list[0], strategy.get_wave_pix(self.signal_list[0]))
+        ref = get_reference_index(self.input['strategy'], wave_pix)
+
+        self.flux = 0.0
+        self.dithers = []
+        for signal, noise, product in zip(self.signal_list, noise_list,
+                                          strategy.reference_product(self.signal_list, noise_list, ref)):
+            weight = product['dither_weight']
+            a = product['weights']
+            subscripts = product['pixels']
+            self.flux += weight * np.dot(a, np.asarray(signal.rate)[subscripts])
+
+            correlation = None
+            if product['correlation'] is not None:
+                correlation = np.dot(product['correlation'], a)
+            self.dithers.append((weight, noise, a, subscripts, product['covariance_pixels'], correlation))
+
+    def evaluate(self, ngroup, nint, nexp):
+        """
+        Calculate the S/N at the reference wavelength of a set of readout patterns. The values are broadcast
+        against each other. Results are cached.
+
+        Parameters
+        ----------
+        ngroup: int or array-like
+            Number of groups per integration
+        nint: int or array-like
+            Number of integrations per exposure
+        nexp: int or array-like
+            Number of exposures
+
+        Returns
+        -------
+        sn: 1D np.ndarray
+        """
+        exposure_grid = ExposureGrid.from_exposure_spec(self.obs.instrument.exposure_spec, ngroup=ngroup, nint=nint,
+                                                        nexp=nexp)
+        variance = np.zeros(len(exposure_grid))
+        for weight, noise, a, subscripts, covariance_pixels, correlation in self.dithers:
+            if correlation is None:
+                var_pix, var_rn_pix = noise.grid_variance(exposure_grid, subscripts)
+                var_product = np.dot(var_pix, a ** 2)
+            else:
+                pixels = tuple(np.concatenate(s) for s in zip(subscripts, covariance_pixels))
+                var_pix, var_rn_pix = noise.grid_variance(exposure_grid, pixels)
+                diagonal = var_pix[:, :a.size]
+                # this is a * C_ij_norm * a.T with C_ij_norm the covariance matrix of covariance_pixels normalized
+                # row-wise by their variance, see Strategy._normalized_covariance()
+                rn_frac = var_rn_pix[:, a.size:] / var_pix[:, a.size:]
+                var_product = np.dot(diagonal, a ** 2) + np.dot(diagonal * rn_frac, a * correlation)
+            # dithers are uncorrelated and added in quadrature, see Strategy._add_exposure_products()
+            with np.errstate(invalid='ignore'):
+                variance += (weight * np.sqrt(var_product)) ** 2
+
+        # if there's a detector gap, the noise is 0 and sn goes to np.inf. fix that here as Report does.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sn = ma.fix_invalid(self.flux / np.sqrt(variance), fill_value=0.0).data
+
+        for exposure_spec, value in zip(exposure_grid, sn):
+            key = (exposure_spec.ngroup, exposure_spec.nint, exposure_spec.nexp)
+            self.evaluated[key] = (float(value), exposure_spec.total_exposure_time)
+        return sn
+
+    def report(self, ngroup, nint, nexp):
+        """
+        Calculate the Report for a readout pattern.
+
+        Parameters
+        ----------
+        ngroup: int
+            Number of groups per integration
+        nint: int
+            Number of integrations per exposure
+        nexp: int
+            Number of exposures
+
+        Returns
+        -------
+        report.Report instance
+        """
+        exposure = {'ngroup': ngroup, 'nint': nint, 'nexp': nexp}
+        _set_exposure(self.obs, self.signal_list, exposure)
+        np.random.set_state(self.random_state)
+
+        noise_list, saturation_list, extracted = _extract_products(
+            self.obs.strategy,
+            self.signal_list,
+            contrast=self.contrast
+        )
+        warnings = dict(self.warnings)
+        warnings.update(extracted['warnings'])
+
+        r = Report(_exposure_input(self.input, exposure), self.signal_list, noise_list, saturation_list, extracted,
+                   warnings)
+        return r
+
+    def sn(self, ngroup, nint, nexp):
+        """
+        Calculate the S/N at the reference wavelength for a readout pattern. Results are cached.
+
+        Parameters
+        ----------
+        ngroup: int
+            Number of groups per integration
+        nint: int
+            Number of integrations per exposure
+        nexp: int
+            Number of exposures
+
+        Returns
+        -------
+        sn: float
+        """
+        key = (ngroup, nint, nexp)
+        if key not in self.evaluated:
+            self.evaluate(*key)
+        return self.evaluated[key][0]
+
+    def solve(self, target_sn, ngroup_min=2, ngroup_max=100, nint_max=100, nexp_max=10):
+        """
+        Find the readout pattern with the shortest total exposure time that reaches target_sn.
+
+        The number of groups is searched first since it is the cheapest way to add exposure time. If a single
+        integration can not reach the target (e.g. because of saturation), the number of integrations is searched
+        at the number of groups that gives the highest S/N, and then the number of exposures. Each search is then
+        repeated downward to trim the readout parameters searched before. Each search scans its whole range (see
+        _search()), so with the default limits at most five scans and about 400 readout patterns are evaluated.
+
+        Parameters
+        ----------
+        target_sn: float
+            S/N to reach
+        ngroup_min, ngroup_max: int
+            Range of the number of groups to search
+        nint_max: int
+            Maximum number of integrations
+        nexp_max: int
+            Maximum number of exposures. The search starts from the configured number of exposures.
+
+        Returns
+        -------
+        (ngroup, nint, nexp), reached: tuple of ints, bool
+            Best readout pattern and whether it reaches target_sn. If no readout pattern reaches target_sn,
+            the one with the highest S/N is returned.
+        """
+        nexp = self.obs.instrument.detector['nexp']
+        nexp_max = max(nexp, nexp_max)
+
+        ngroup, ngroup_best = self._search(lambda g: self.evaluate(g, 1, nexp), ngroup_min, ngroup_max, target_sn)
+        if ngroup is None:
+            nint, nint_best = self._search(lambda i: self.evaluate(ngroup_best, i, nexp), 1, nint_max, target_sn)
+            if nint is None:
+                nexp, nexp_best = self._search(lambda e: self.evaluate(ngroup_best, nint_best, e), nexp, nexp_max,
+                                               target_sn)
+                if nexp is not None:
+                    nint, nint_best = self._search(lambda i: self.evaluate(ngroup_best, i, nexp), 1, nint_max,
+                                                   target_sn)
+            if nint is not None:
+                ngroup, ngroup_best = self._search(lambda g: self.evaluate(g, nint, nexp), ngroup_min, ngroup_best,
+                                                   target_sn)
+
+        # the searches do not cover every combination, so pick the cheapest of everything that was evaluated
+        reached = [key for key, (sn, time) in self.evaluated.items() if sn >= target_sn]
+        if len(reached) > 0:
+            best = min(reached, key=lambda key: (self.evaluated[key][1], key[1] * key[2]))
+        else:
+            best = max(self.evaluated, key=lambda key: self.evaluated[key][0])
+        return best, len(reached) > 0
+
+    def _search(self, sn_func, lo, hi, target_sn):
+        """
+        Find the smallest integer x in [lo, hi] for which sn_func(x) >= target_sn. This is an exhaustive scan
+        rather than a bisection: every value of x is evaluated in a single vectorized call. The S/N generally
+        increases with x, but it can decrease again once saturation sets in, so it is not monotonic and a
+        bracketing search could miss the smallest x that reaches target_sn or the x with the highest S/N.
+        With the default limits of solve() a scan covers at most 99 (ngroup), 100 (nint), or 10 (nexp) readout
+        patterns in one DetectorNoise.grid_variance() call per dither over just the extracted pixels.
+
+        Parameters
+        ----------
+        sn_func: callable
+            Function returning the S/N for an array of values of x
+        lo, hi: int
+            Range of x to search
+        target_sn: float
+            S/N to reach
+
+        Returns
+        -------
+        x_min, x_best: tuple
+            Smallest x that reaches target_sn (None if it is not reached) and the x with the highest S/N found.
+        """
+        x = np.arange(lo, hi + 1)
+        sn = sn_func(x)
+        reached = np.flatnonzero(sn >= target_sn)
+        if len(reached) > 0:
+            x_min = int(x[reached[0]])
+            return x_min, x_min
+        return None, int(x[np.argmax(sn)])
+
+
 def calculate_exposure_time(input, webapp=False, **kwargs):
     """
     This is a function to do the 'reverse' exposure time calculation where given a desired
     signal-to-noise ratio we calculate the optimal exposureSpecification and return a Report
     on the results.
 
+    The target S/N and the limits of the readout pattern search are configured in the 'reverse' section
+    of the input (see ReverseConfig), which can be overridden by keyword arguments.
+
     Parameters
     ----------
     input: dict
         Dictionary containing the information required to perform the calculation.
-    PDFLibrary : psf_library.PSFLibrary instance
-        Library of PSF files (e.g. produced by webbpsf) to be used in the calculation
+    webapp: bool
+        Toggle strict engine API checking
+    **kwargs: list of keyword/value pairs
+        parameter keyword and value pairs to augment the 'reverse' configuration
 
     Returns
     -------
     report.Report instance
     """
-    raise NotImplementedError("Reverse ETC calculations are not yet implemented.")
+    reverse_config = ReverseConfig(config=input.get('reverse', {}), **kwargs)
+    target_sn = reverse_config.sn
+    if target_sn is None or target_sn <= 0.0:
+        msg = "Reverse calculations require a positive target S/N, got %s." % repr(target_sn)
+        raise EngineInputError(value=msg)
+    if reverse_config.ngroup_min < 1 or reverse_config.ngroup_max < reverse_config.ngroup_min:
+        msg = "Invalid ngroup range for reverse calculation: [%s, %s]" % (
+            reverse_config.ngroup_min,
+            reverse_config.ngroup_max
+        )
+        raise EngineInputError(value=msg)
+    if reverse_config.nint_max < 1 or reverse_config.nexp_max < 1:
+        msg = "Reverse calculation nint_max and nexp_max must be at least 1."
+        raise EngineInputError(value=msg)
+
+    solver = ExposureTimeSolver(input, webapp=webapp)
+    solver.warnings.update(reverse_config.warnings)
+    best, reached = solver.solve(
+        target_sn,
+        ngroup_min=reverse_config.ngroup_min,
+        ngroup_max=reverse_config.ngroup_max,
+        nint_max=reverse_config.nint_max,
+        nexp_max=reverse_config.nexp_max
+    )
+    if not reached:
+        key = "target_sn_not_reached"
+        solver.warnings[key] = warning_messages[key] % (target_sn, solver.evaluated[best][0])
+
+    r = solver.report(*best)
+    return r
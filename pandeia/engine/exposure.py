@@ -5,6 +5,127 @@ import numpy as np
 import numpy.ma as ma
 from .custom_exceptions import EngineInputError
 
+# number of elements ExposureGrid processes at a time. keeping the working arrays small enough to stay in
+# the CPU caches is much faster than operating on the full (nexposures, ny, nx) arrays at once.
+default_grid_block_size = 2 ** 17
+
+
+def _fill_saturated(unsat_ngroups):
+    """
+    Convert a masked array of unsaturated groups into a new ndarray with NaN for the masked, i.e. fully
+    saturated, pixels. Plain arrays and scalars are copied.
+    """
+    n = np.where(ma.getmaskarray(unsat_ngroups), np.nan, ma.getdata(unsat_ngroups))
+    return n
+
+
+def _readnoise_variance(n, n2, readnoise, m, tgroup, rn_fudge, excessp1, excessp2, out):
+    """
+    Evaluate the read noise variance of a MULTIACCUM slope into out. n2 must hold n ** 2. See
+    ExposureSpecification.rn_variance() for the formula.
+    """
+    # 12 rn^2 / (m n (n^2 - 1) tgroup^2), evaluated in the same order as the masked array version
+    np.multiply(m, n, out=out)
+    out *= n2 - 1.
+    out *= tgroup ** 2.
+    np.divide(12. * readnoise ** 2., out, out=out)
+
+    # The readnoise on the slope may be worse than the theoretical best value
+    # (see Glasse et al. 2015, PASP 127 686).
+    if rn_fudge != 1:
+        # scale in double precision, as the masked array version did
+        np.multiply(out, rn_fudge, out=out, dtype=np.float64)
+
+    # Include the empirical correction for excess variance for long ramps
+    # (https://github.com/STScI-SSB/pandeia/issues/2091)
+    if excessp1 != 0.0 or excessp2 != 0.0:
+        out += (12.0 * (n - 1) / (n + 1) * excessp1 ** 2 - excessp2 / np.sqrt(m)) / np.power((1 - n) * tgroup, 2)
+
+    # masked array arithmetic masks any non-finite result, so do the same
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def multiaccum_variance(n, variance_per_pix, dark_current, readnoise, m, tgroup, tframe,
+                        rn_fudge=1.0, excessp1=0.0, excessp2=0.0, out=None):
+    """
+    Calculate the variance of MULTIACCUM slopes and of their read noise in a single pass using Robberto's
+    formula (35). This is the kernel of ExposureSpecification.slope_variance(). Fully saturated pixels are
+    NaN in n and come out as NaN, as does any pixel whose variance is not finite.
+
+    All array inputs are broadcast together, so several readout patterns can be evaluated at once by
+    stacking them along a leading axis, e.g. n with shape (npatterns, ny, nx) and m, tgroup and tframe
+    with shape (npatterns, 1, 1).
+
+    Parameters
+    ----------
+    n: float or ndarray
+        Number of usable groups per pixel, NaN where fully saturated
+    variance_per_pix: float or ndarray
+        Variance of the electron rate per pixel
+    dark_current: float
+        Dark current (electrons/s)
+    readnoise: float
+        Readnoise per pixel
+    m: int or ndarray
+        Number of frames (or samples) averaged per group
+    tgroup: float or ndarray
+        Group time
+    tframe: float or ndarray
+        Frame (or sample) time
+    rn_fudge: float
+        Fudge factor to apply to readnoise to match IDT results
+    excessp1: float
+        Empirical correction for excess variance for long ramps
+    excessp2: float
+        Empirical correction for excess variance for long ramps
+    out: tuple of two ndarray or None
+        Preallocated arrays for the slope variance and the read noise variance. They must have the broadcast
+        shape of the inputs.
+
+    Returns
+    -------
+    slope_var, slope_rn_var: ndarray, ndarray
+        Slope variance and the read noise part of it
+    """
+    # It was decided that only one of the fudge factors are allowed to be used, not both.
+    # https://github.com/STScI-SSB/pandeia/pull/2261#issuecomment-260737726
+    if rn_fudge != 1.0 and (excessp1 != 0.0 or excessp2 != 0.0):
+        raise ValueError('Only one of rn_fudge or excessp1/p2 maybe used, not both.')
+
+    shape = np.broadcast(n, variance_per_pix, m, tgroup, tframe).shape
+    dtype = np.result_type(n, variance_per_pix, m, tgroup, tframe, 1.0)
+    if out is None:
+        out = (np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype))
+    slope_var, slope_rn_var = out
+
+    # the only temporaries: n^2 and one scratch array
+    n2 = np.empty(shape, dtype=dtype)
+    tmp = np.empty(shape, dtype=dtype)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.power(n, 2., out=n2)
+        _readnoise_variance(n, n2, readnoise, m, tgroup, rn_fudge, excessp1, excessp2, slope_rn_var)
+
+        # (6/5) (n^2 + 1) / (n (n^2 - 1)) ((variance + dark) / tgroup) (1 - (5/3) (m^2 - 1) / (m (n^2 + 1)) (tframe / tgroup))
+        np.subtract(n2, 1., out=tmp)
+        tmp *= n
+        n2 += 1.
+        np.multiply(6. / 5., n2, out=slope_var)
+        slope_var /= tmp
+        np.add(variance_per_pix, dark_current, out=tmp)
+        tmp /= tgroup
+        slope_var *= tmp
+        np.multiply(m, n2, out=tmp)
+        np.divide((5. / 3.) * (np.power(m, 2.) - 1.), tmp, out=tmp)
+        tmp *= tframe / tgroup
+        np.subtract(1., tmp, out=tmp)
+        slope_var *= tmp
+        slope_var[~np.isfinite(slope_var)] = np.nan
+        slope_var += slope_rn_var
+
+    return slope_var, slope_rn_var
+
 
 class ExposureSpecification:
 
@@ -250,9 +371,9 @@ class ExposureSpecification:
 
         rn = readnoise
 
-        # we discard any saturated groups. Copy unsat_ngroups, because we may modify it for rejected groups before using
-        # it for noise calculations.
-        n = ma.copy(unsat_ngroups)
+        # we discard any saturated groups by setting them to NaN. This is a copy of unsat_ngroups, because we may modify
+        # it for rejected groups before using it for noise calculations.
+        n = _fill_saturated(unsat_ngroups)
 
         # removing with any pre- and post-rejected groups here. This is not stictly directly related to saturation, bu
         # behaves in a similar way (if there is <2 groups available, we cannot define a slope). The very bright regime
@@ -266,35 +387,34 @@ class ExposureSpecification:
             # we do have to reject any post-rejected frames from all pixels
             n -= self.npostrej
 
-        # maybe nsample_sample_total and tsample are defined. If so then use them for the effect frame time and number of reads
-        # https://github.com/STScI-SSB/pandeia/issues/2996
-        # This is similar to two other places in this file
+        m, tgroup, tframe = self.get_multiaccum_pars()
+
+        # Compute the variance of a MULTIACCUM slope using Robberto's formula (35) together with the read noise
+        # variance, which is also calculated using the unsaturated number of groups. Undefined values, e.g. for
+        # saturated pixels, are NaN so that they are interpreted as truly undefined downstream.
+        slope_var, slope_rn_var = multiaccum_variance(n, variance_per_pix, dark_current, rn, m, tgroup, tframe,
+                                                      rn_fudge=rn_fudge, excessp1=excessp1, excessp2=excessp2)
+
+        return slope_var, slope_rn_var
+
+    def get_multiaccum_pars(self):
+        """
+        Get the readout parameters that enter the MULTIACCUM variance formula. If nsample_total and tsample
+        are defined (MIRI), they are used for the number of reads per group and the effective frame time.
+        See https://github.com/STScI-SSB/pandeia/issues/2996
+
+        Returns
+        -------
+        m, tgroup, tframe: int, float, float
+            Number of reads averaged per group, group time, and frame time
+        """
         if hasattr(self, 'nsample_total') and hasattr(self, 'tsample'):
             m = self.nsample_total
             tframe = self.tsample
         else:
             m = self.nframe # This does not include skipped frames!
             tframe = self.tframe
-        
-        tgroup = self.tgroup
-
-        # Compute the variance of a MULTIACCUM slope using Robberto's formula (35). The rn_variance is also
-        # calculated using the unsaturated number of groups.
-        slope_rn_var = self.rn_variance(rn, unsat_ngroups=n, rn_fudge=rn_fudge, excessp1=excessp1, excessp2=excessp2)
-        # The final slope variance slope may also be worse than the theoretical best value.
-        # (also from Glasse et al. 2015, PASP 127 686).
-        slope_var = (6. / 5.) * (n ** 2. + 1.) / (n * (n ** 2. - 1.)) * \
-            ((variance_per_pix + dark_current) / tgroup) * \
-            (1. - (5. / 3.) * (m ** 2. - 1.) / (m * (n ** 2. + 1.)) * (tframe / tgroup)) + \
-            slope_rn_var
-
-        # The default fill value for masked arrays is a finite number, so convert to ndarrays, and fill with NaNs
-        # to make sure missing values are interpreted as truly undefined downstream.
-
-        slope_var = ma.filled(slope_var, fill_value=np.nan)
-        slope_rn_var = ma.filled(slope_rn_var, fill_value=np.nan)
-
-        return slope_var, slope_rn_var
+        return m, self.tgroup, tframe
 
     def rn_variance(self, readnoise, unsat_ngroups=None, rn_fudge=1.0, excessp1=0.0, excessp2=0.0):
         """
@@ -327,14 +447,9 @@ class ExposureSpecification:
         Returns
         -------
         var_rn: ndarray if unsat_ngroups is supplied, float if unsat_ngroups is not supplied.
-           Variance associated with the read noise only.
+           Variance associated with the read noise only. Saturated pixels are NaN.
 
         """
-        if unsat_ngroups is None:
-            n = self.ngroup - (self.nprerej + self.npostrej)
-        else:
-            n = unsat_ngroups
-
         # It was decided that only one of the fudge factors are allowed to be used, not both.
         # https://github.com/STScI-SSB/pandeia/pull/2261#issuecomment-260737726
         if rn_fudge != 1.0 and (excessp1 != 0.0 or excessp2 != 0.0):
@@ -352,6 +467,16 @@ class ExposureSpecification:
 
         tgroup = self.tgroup
 
+        if unsat_ngroups is not None:
+            # saturated pixels are NaN, as in slope_variance()
+            n = _fill_saturated(unsat_ngroups)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                var_rn = _readnoise_variance(n, np.power(n, 2.), rn, m, tgroup, rn_fudge, excessp1, excessp2,
+                                             np.empty(n.shape, dtype=np.result_type(n, 1.0)))
+            return var_rn
+
+        n = self.ngroup - (self.nprerej + self.npostrej)
+
         var_rn = 12. * rn ** 2. / (m * n * (n ** 2. - 1.) * tgroup ** 2.)
 
         # The readnoise on the slope may be worse than the theoretical best value
@@ -540,4 +665,254 @@ class ExposureSpecificationTA(ExposureSpecification):
         slope_rn_var = ma.filled(slope_rn_var, fill_value=np.nan)
         
         return slope_var, slope_rn_var
-        
\ No newline at end of file
+        
+
+class ExposureGrid(object):
+
+    """
+    A set of exposure specifications evaluated together. The readout parameters and derived times of each
+    specification are stacked into arrays along a leading exposure axis, and the saturation and noise methods
+    broadcast over that axis so that one rate map gives the unsaturated groups and slope variances for every
+    readout setting in a single vectorized call.
+
+    Parameters
+    ----------
+    exposure_specs: list of ExposureSpecification instances
+        The readout settings. Target acquisition specifications are not supported since they use a
+        different noise formula.
+
+    Attributes
+    ----------
+    ngroup, nint, nexp, nframe, nskip, nprerej, npostrej: 1D np.ndarray
+        Readout parameters of each exposure specification
+    tframe, tgroup, saturation_time, measurement_time, exposure_time, total_exposure_time, duty_cycle: 1D np.ndarray
+        Times of each exposure specification
+    nramps, total_integrations: 1D np.ndarray
+        Number of ramps of each exposure specification
+    m, tgroup_eff, tframe_eff: 1D np.ndarray
+        Parameters of the MULTIACCUM variance formula, see ExposureSpecification.get_multiaccum_pars()
+    """
+
+    stacked_attributes = (
+        'ngroup', 'nint', 'nexp', 'nframe', 'nskip', 'nprerej', 'npostrej', 'tframe', 'tgroup', 'saturation_time',
+        'measurement_time', 'exposure_time', 'total_exposure_time', 'duty_cycle', 'nramps', 'total_integrations'
+    )
+
+    def __init__(self, exposure_specs):
+        self.exposure_specs = list(exposure_specs)
+        if len(self.exposure_specs) == 0:
+            raise EngineInputError("An exposure grid needs at least one exposure specification.")
+        for spec in self.exposure_specs:
+            if isinstance(spec, ExposureSpecificationTA):
+                raise EngineInputError("Exposure grids do not support target acquisition exposure specifications.")
+
+        for attr in self.stacked_attributes:
+            setattr(self, attr, np.array([getattr(spec, attr) for spec in self.exposure_specs]))
+
+        pars = [spec.get_multiaccum_pars() for spec in self.exposure_specs]
+        self.m, self.tgroup_eff, self.tframe_eff = [np.array(p) for p in zip(*pars)]
+
+    @classmethod
+    def from_exposure_spec(cls, exposure_spec, ngroup=None, nint=None, nexp=None):
+        """
+        Build a grid of readout settings that differ from an existing exposure specification only in ngroup,
+        nint and/or nexp. The given values are broadcast against each other and flattened.
+
+        Parameters
+        ----------
+        exposure_spec: ExposureSpecification instance
+            Exposure specification that provides the other readout parameters
+        ngroup: int, array-like, or None
+            Numbers of groups per integration. If None, exposure_spec.ngroup is used.
+        nint: int, array-like, or None
+            Numbers of integrations per exposure. If None, exposure_spec.nint is used.
+        nexp: int, array-like, or None
+            Numbers of exposures. If None, exposure_spec.nexp is used.
+
+        Returns
+        -------
+        grid: ExposureGrid instance
+        """
+        ngroup = exposure_spec.ngroup if ngroup is None else ngroup
+        nint = exposure_spec.nint if nint is None else nint
+        nexp = exposure_spec.nexp if nexp is None else nexp
+        ngroup, nint, nexp = [a.ravel() for a in np.broadcast_arrays(ngroup, nint, nexp)]
+
+        specs = []
+        for g, i, e in zip(ngroup, nint, nexp):
+            specs.append(ExposureSpecification(
+                exposure_spec.pattern,
+                int(g),
+                int(i),
+                int(e),
+                exposure_spec.tframe,
+                nframe=exposure_spec.nframe,
+                nsample=exposure_spec.nsample,
+                nsample_skip=exposure_spec.nsample_skip,
+                tfffr=exposure_spec.tfffr,
+                subarray=exposure_spec.subarray,
+                nskip=exposure_spec.nskip,
+                nprerej=exposure_spec.nprerej,
+                npostrej=exposure_spec.npostrej,
+                frame0=exposure_spec.frame0,
+                det_type=exposure_spec.det_type
+            ))
+        return cls(specs)
+
+    def __len__(self):
+        return len(self.exposure_specs)
+
+    def __getitem__(self, index):
+        return self.exposure_specs[index]
+
+    def _expand(self, values, ndim):
+        """
+        Reshape per-exposure values so they broadcast against arrays with a leading exposure axis
+        followed by ndim data axes.
+        """
+        return np.reshape(values, (len(self),) + (1,) * ndim)
+
+    def get_unsaturated_groups(self, slope, fullwell, full_saturation=2):
+        """
+        Calculate the number of unsaturated groups in each pixel for every exposure specification.
+        See ExposureSpecification.get_unsaturated_groups().
+
+        Parameters
+        ----------
+        slope: ndarray
+            The measured slope of the ramp (ie, the rate) per pixel
+        fullwell: positive integer
+            The number of electrons defining a full well
+        full_saturation: positive integer
+            The minimum number of groups allowed to define an unsaturated measurement.
+
+        Returns
+        -------
+        unsat_ngroups: MaskedArray
+            The number of unsaturated groups with shape (len(self),) + slope.shape. Pixels with full saturation
+            are masked.
+        """
+        ngroup = self._expand(self.ngroup, slope.ndim)
+        saturation_time = self._expand(self.saturation_time, slope.ndim)
+
+        # the time to saturate only depends on the slope, so it is shared by all exposure specifications
+        time_to_saturate = fullwell / slope.clip(1e-10, np.max(slope))
+
+        max_ngroups = np.empty((len(self),) + time_to_saturate.shape, dtype=time_to_saturate.dtype)
+        for block in self._blocks(time_to_saturate.size):
+            # fraction of the total ramp time that is unsaturated, converted to groups
+            out = max_ngroups[block]
+            np.divide(time_to_saturate, saturation_time[block], out=out)
+            out *= ngroup[block]
+            np.floor(out, out=out)
+            np.clip(out, 0, ngroup[block], out=out)
+
+        unsat_ngroups = ma.masked_less(max_ngroups, full_saturation)
+
+        return unsat_ngroups
+
+    def _blocks(self, size):
+        """
+        Split the exposure axis into slices of about default_grid_block_size elements, given the number of
+        elements per exposure specification.
+        """
+        step = max(1, default_grid_block_size // max(size, 1))
+        return [slice(start, start + step) for start in range(0, len(self), step)]
+
+    def slope_variance(self, rate, dark_current, readnoise, unsat_ngroups,
+                       rn_fudge=1.0, excessp1=0.0, excessp2=0.0):
+        """
+        Calculate the variance of the MULTIACCUM slopes for every exposure specification.
+        See ExposureSpecification.slope_variance().
+
+        Parameters
+        ----------
+        rate: dict
+            Rates with the per-pixel rate variance in 'fp_pix_variance'
+        dark_current: float
+            Dark current (electrons/s).
+        readnoise: float
+            Readnoise per pixel.
+        unsat_ngroups: ndarray
+            Number of unsaturated groups for each exposure specification and pixel, e.g. from
+            get_unsaturated_groups()
+        rn_fudge: float
+            Fudge factor to apply to readnoise to match IDT results
+        excessp1: float
+             empirical correction for excess variance for long ramps
+        excessp2: float
+             empirical correction for excess variance for long ramps
+
+        Returns
+        -------
+        slope_var: ndarray
+            Variance associated with the input slope, with a leading exposure axis. Saturated pixels are NaN.
+        slope_rn_var: ndarray
+            The associated variance of the readnoise only
+        """
+        variance_per_pix = rate['fp_pix_variance']
+        n = _fill_saturated(unsat_ngroups)
+        ndim = n.ndim - 1
+
+        # reject the pre- and post-rejected groups as ExposureSpecification.slope_variance() does, but only
+        # for the exposure specifications outside the very bright regime
+        reject = ((self.nprerej != 0) | (self.npostrej != 0)) & (self.ngroup >= 5)
+        if reject.any():
+            reject = self._expand(reject, ndim)
+            unsat_pixels = reject & ((self._expand(self.ngroup, ndim) - np.ceil(n)) < self._expand(self.npostrej, ndim))
+            n -= np.where(unsat_pixels, self._expand(self.nprerej, ndim), 0)
+            n -= np.where(reject, self._expand(self.npostrej, ndim), 0)
+
+        m = self._expand(self.m, ndim)
+        tgroup = self._expand(self.tgroup_eff, ndim)
+        tframe = self._expand(self.tframe_eff, ndim)
+        shape = np.broadcast(n, variance_per_pix).shape
+        dtype = np.result_type(n, variance_per_pix, 1.0)
+        slope_var = np.empty(shape, dtype=dtype)
+        slope_rn_var = np.empty(shape, dtype=dtype)
+        for block in self._blocks(n[0].size):
+            multiaccum_variance(n[block], variance_per_pix, dark_current, readnoise, m[block], tgroup[block],
+                                tframe[block], rn_fudge=rn_fudge, excessp1=excessp1, excessp2=excessp2,
+                                out=(slope_var[block], slope_rn_var[block]))
+
+        return slope_var, slope_rn_var
+
+    def rn_variance(self, readnoise, unsat_ngroups=None, rn_fudge=1.0, excessp1=0.0, excessp2=0.0):
+        """
+        Calculate the variance due to read noise only for every exposure specification.
+        See ExposureSpecification.rn_variance().
+
+        Parameters
+        ----------
+        readnoise: float
+            Readnoise per pixel.
+        unsat_ngroups: ndarray or None
+            Number of unsaturated groups for each exposure specification and pixel. If None, the full
+            ramps are used.
+        rn_fudge: float
+            fudge factor for readnoise on the slope as it may be worse than the theoretical best value
+        excessp1: float
+             empirical correction for excess variance for long ramps
+        excessp2: float
+             empirical correction for excess variance for long ramps
+
+        Returns
+        -------
+        var_rn: ndarray
+            Variance associated with the read noise only, with a leading exposure axis. Saturated pixels are NaN.
+        """
+        if unsat_ngroups is None:
+            var_rn = np.array([spec.rn_variance(readnoise, rn_fudge=rn_fudge, excessp1=excessp1, excessp2=excessp2)
+                               for spec in self.exposure_specs])
+            return var_rn
+
+        if rn_fudge != 1.0 and (excessp1 != 0.0 or excessp2 != 0.0):
+            raise ValueError('Only one of rn_fudge or excessp1/p2 maybe used, not both.')
+
+        n = _fill_saturated(unsat_ngroups)
+        ndim = n.ndim - 1
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            var_rn = _readnoise_variance(n, np.power(n, 2.), readnoise, self._expand(self.m, ndim),
+                                         self._expand(self.tgroup, ndim), rn_fudge, excessp1, excessp2,
+                                         np.empty(n.shape, dtype=np.result_type(n, 1.0)))
+        return var_rn
@@ -0,0 +1,558 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import os
+import atexit
+import struct
+import weakref
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pyfftw
+import pyfftw.interfaces.cache
+import pyfftw.interfaces.numpy_fft
+
+# maximum total size in MB of the PSF kernel FFTs kept in the process-wide cache
+default_kernel_fft_cache_size = float(os.environ.get("pandeia_kernel_fft_cache_size", 256))
+
+# number of threads FFTW uses for each transform. this is one unless configured, since services often run several
+# engine processes already and more threads would oversubscribe the machine.
+default_fft_threads = int(os.environ.get("pandeia_fft_threads", 1))
+
+# file that FFTW wisdom is imported from before the first transform and exported to when the process exits.
+# this lets new processes skip planning the transform sizes that previous ones have already planned.
+default_wisdom_file = os.environ.get("pandeia_fftw_wisdom")
+
+# how hard FFTW works at planning. measuring gives faster transforms but is only worth it if the
+# plans are reused, i.e. if the wisdom is kept.
+default_planner_effort = os.environ.get(
+    "pandeia_fftw_planner_effort",
+    "FFTW_MEASURE" if default_wisdom_file else "FFTW_ESTIMATE"
+)
+
+# number of seconds unused FFTW plans are kept by the pyfftw.interfaces cache
+default_plan_keepalive = float(os.environ.get("pandeia_fftw_keepalive", 300))
+
+# default memory budget in MB for the working arrays of a batch of transforms in convolve_cube()
+default_max_memory = 256
+
+# wisdom files start with this, followed by the wisdom of each precision as a length-prefixed blob of bytes
+_wisdom_header = b"pandeia fftw wisdom\n"
+
+# default of the configure() arguments, so that arguments that are not given can be told apart from None
+_unchanged = object()
+
+# current backend configuration. see configure().
+fft_config = {
+    'threads': default_fft_threads,
+    'planner_effort': default_planner_effort,
+    'wisdom_file': default_wisdom_file,
+    'plan_keepalive': default_plan_keepalive
+}
+
+# whether pyFFTW has been set up for the transforms. see _initialize().
+_backend = {'initialized': False}
+_backend_lock = threading.Lock()
+
+# per-thread limit on the FFTW threads. see thread_limit().
+_local = threading.local()
+
+
+def configure(threads=_unchanged, planner_effort=_unchanged, wisdom_file=_unchanged, plan_keepalive=_unchanged):
+    """
+    Configure the FFT backend. As for KernelFFTCache.configure(), parameters that are not given are left
+    unchanged, while None restores the default.
+
+    Parameters
+    ----------
+    threads: int or None
+        Number of threads FFTW uses for each transform. None means default_fft_threads.
+    planner_effort: str or None
+        FFTW planner effort, e.g. 'FFTW_ESTIMATE' or 'FFTW_MEASURE'. None means default_planner_effort.
+    wisdom_file: str or None
+        File to import FFTW wisdom from now and to export it to when the process exits. None means no file.
+    plan_keepalive: float or None
+        Number of seconds unused FFTW plans are kept. None means default_plan_keepalive.
+    """
+    if threads is not _unchanged:
+        fft_config['threads'] = default_fft_threads if threads is None else int(threads)
+    if planner_effort is not _unchanged:
+        fft_config['planner_effort'] = default_planner_effort if planner_effort is None else planner_effort
+    if wisdom_file is not _unchanged:
+        fft_config['wisdom_file'] = wisdom_file
+        # before the first transform, _initialize() imports it
+        if wisdom_file is not None and _backend['initialized']:
+            load_wisdom(wisdom_file)
+    if plan_keepalive is not _unchanged:
+        fft_config['plan_keepalive'] = default_plan_keepalive if plan_keepalive is None else plan_keepalive
+        if _backend['initialized']:
+            pyfftw.interfaces.cache.set_keepalive_time(fft_config['plan_keepalive'])
+
+
+def _initialize():
+    """
+    Set up pyFFTW before the first transform rather than when this module is imported, so that importing the
+    engine doesn't change pyFFTW's global state: keep the FFTW plans for repeated transform sizes rather than
+    re-planning each one, and start from and keep any saved wisdom.
+    """
+    if _backend['initialized']:
+        return
+    with _backend_lock:
+        if _backend['initialized']:
+            return
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(fft_config['plan_keepalive'])
+        load_wisdom()
+        atexit.register(save_wisdom)
+        _backend['initialized'] = True
+
+
+def load_wisdom(filename=None):
+    """
+    Import FFTW wisdom from a file written by save_wisdom(). A missing or unreadable file, or one in another
+    format, is ignored since wisdom only affects how long planning takes, not the results. The file only holds
+    the bytes that FFTW exported, so nothing in it is executed.
+
+    Parameters
+    ----------
+    filename: str or None
+        Wisdom file. If None, the configured wisdom file is used.
+
+    Returns
+    -------
+    loaded: bool
+        Whether any wisdom was imported
+    """
+    filename = filename or fft_config['wisdom_file']
+    if not filename or not os.path.exists(filename):
+        return False
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        wisdom = _parse_wisdom(data)
+    except (IOError, OSError):
+        return False
+    if wisdom is None:
+        return False
+    try:
+        return any(pyfftw.import_wisdom(wisdom))
+    except Exception:
+        return False
+
+
+def _parse_wisdom(data):
+    """
+    Split the contents of a wisdom file written by save_wisdom() into the wisdom of each precision
+
+    Parameters
+    ----------
+    data: bytes
+        Contents of the file
+
+    Returns
+    -------
+    wisdom: tuple of bytes or None
+        Wisdom as returned by pyfftw.export_wisdom(), or None if the file is not a wisdom file or is truncated
+    """
+    if not data.startswith(_wisdom_header):
+        return None
+    wisdom = []
+    offset = len(_wisdom_header)
+    while offset < len(data):
+        if offset + 8 > len(data):
+            return None
+        size, = struct.unpack('<Q', data[offset:offset + 8])
+        offset += 8
+        if offset + size > len(data):
+            return None
+        wisdom.append(data[offset:offset + size])
+        offset += size
+    return tuple(wisdom)
+
+
+def save_wisdom(filename=None):
+    """
+    Export the accumulated FFTW wisdom to a file, as the wisdom bytes of each precision prefixed by their length.
+    The file is replaced atomically so that processes sharing it never read a partial file. A file that can't be
+    written is skipped silently since this is also called at exit.
+
+    Parameters
+    ----------
+    filename: str or None
+        Wisdom file. If None, the configured wisdom file is used and nothing is done if there is none.
+    """
+    filename = filename or fft_config['wisdom_file']
+    if not filename:
+        return
+    tmp_file = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(_wisdom_header)
+            for blob in pyfftw.export_wisdom():
+                f.write(struct.pack('<Q', len(blob)))
+                f.write(blob)
+        os.rename(tmp_file, filename)
+    except (IOError, OSError):
+        # as for load_wisdom(), failing to keep the wisdom only means planning again next time
+        try:
+            os.remove(tmp_file)
+        except (IOError, OSError):
+            pass
+
+
+@contextmanager
+def thread_limit(threads):
+    """
+    Context manager that limits the number of threads FFTW uses for the transforms run by the calling thread
+    within it, e.g. in worker threads that already run in parallel with each other.
+
+    Parameters
+    ----------
+    threads: int
+        Maximum number of threads per transform
+    """
+    previous = getattr(_local, 'threads', None)
+    _local.threads = threads
+    try:
+        yield
+    finally:
+        _local.threads = previous
+
+
+def _threads():
+    """
+    Number of threads FFTW uses for a transform run by the calling thread. See configure() and thread_limit().
+    """
+    limit = getattr(_local, 'threads', None)
+    if limit is None:
+        return fft_config['threads']
+    return min(limit, fft_config['threads'])
+
+
+def fftn(a, s=None, axes=None):
+    """
+    numpy.fft.fftn() computed by FFTW with the configured threads and planner effort
+    """
+    _initialize()
+    return pyfftw.interfaces.numpy_fft.fftn(a, s=s, axes=axes, threads=_threads(),
+                                            planner_effort=fft_config['planner_effort'])
+
+
+def ifftn(a, s=None, axes=None):
+    """
+    numpy.fft.ifftn() computed by FFTW with the configured threads and planner effort
+    """
+    _initialize()
+    return pyfftw.interfaces.numpy_fft.ifftn(a, s=s, axes=axes, threads=_threads(),
+                                             planner_effort=fft_config['planner_effort'])
+
+
+def rfftn(a, s=None, axes=None):
+    """
+    numpy.fft.rfftn() computed by FFTW with the configured threads and planner effort
+    """
+    _initialize()
+    return pyfftw.interfaces.numpy_fft.rfftn(a, s=s, axes=axes, threads=_threads(),
+                                             planner_effort=fft_config['planner_effort'])
+
+
+def irfftn(a, s=None, axes=None):
+    """
+    numpy.fft.irfftn() computed by FFTW with the configured threads and planner effort
+    """
+    _initialize()
+    return pyfftw.interfaces.numpy_fft.irfftn(a, s=s, axes=axes, threads=_threads(),
+                                              planner_effort=fft_config['planner_effort'])
+
+
+class KernelFFTCache(object):
+
+    """
+    Thread-safe cache of the FFTs of zero-padded convolution kernels. The kernels are PSF library entries,
+    which do not change between calculations, so their transforms can be reused. Entries are keyed by the
+    identity of the kernel array, the padded shape, and the data type, so kernels that are built per call,
+    e.g. interpolated PSFs, must not be cached. Entries only hold a weak reference to their kernel and are
+    never matched once it is freed. When the cache grows beyond its limits, the least recently used entries
+    are evicted. ConvolvedSceneCube only uses the cache with the separable or batched convolution settings
+    since its default per-plane convolution uses interpolated PSFs.
+
+    Parameters
+    ----------
+    max_size: float or None
+        Maximum total size of the cached FFTs in MB. None means no limit.
+    max_entries: int or None
+        Maximum number of cached FFTs. None means no limit.
+
+    Attributes
+    ----------
+    hits: int
+        Number of requests served from the cache
+    misses: int
+        Number of requests that required computing an FFT
+    evictions: int
+        Number of FFTs evicted from the cache
+    """
+
+    def __init__(self, max_size=None, max_entries=None):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._ffts = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kernel, shape, dtype=np.float32):
+        """
+        Get the real FFT of a kernel zero-padded to a given shape, computing it if it's not already cached.
+
+        Parameters
+        ----------
+        kernel: 2D np.ndarray
+            Convolution kernel. This must be a PSF library entry that is not modified.
+        shape: tuple (int, int)
+            Padded shape of the FFT
+        dtype: np.dtype
+            Real data type of the FFT input
+
+        Returns
+        -------
+        kernel_fft: 2D np.ndarray
+            rfftn() of the padded kernel. This is shared so must not be modified.
+        """
+        dtype = np.dtype(dtype)
+        key = (id(kernel), tuple(shape), dtype.str)
+        with self._lock:
+            entry = self._ffts.pop(key, None)
+            if entry is not None and entry[0]() is kernel:
+                # re-insert to mark as most recently used
+                self._ffts[key] = entry
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # the kernel this entry was made for has been freed and its id reused
+                self._nbytes -= entry[1].nbytes
+            self.misses += 1
+
+        kernel_fft = rfftn(np.asarray(kernel, dtype=dtype), s=shape)
+        kernel_fft.flags.writeable = False
+
+        with self._lock:
+            entry = self._ffts.pop(key, None)
+            if entry is not None:
+                self._nbytes -= entry[1].nbytes
+            self._ffts[key] = (weakref.ref(kernel), kernel_fft)
+            self._nbytes += kernel_fft.nbytes
+            self._evict()
+        return kernel_fft
+
+    def _evict(self):
+        """
+        Remove least recently used FFTs until the cache is within its limits. Must be called with the lock held.
+        """
+        while self._ffts:
+            over_entries = self.max_entries is not None and len(self._ffts) > self.max_entries
+            over_size = self.max_size is not None and self._nbytes > self.max_size * 1024 ** 2
+            if not (over_entries or over_size):
+                break
+            key, (kernel_ref, kernel_fft) = self._ffts.popitem(last=False)
+            self._nbytes -= kernel_fft.nbytes
+            self.evictions += 1
+
+    def configure(self, max_size=_unchanged, max_entries=_unchanged):
+        """
+        Set the cache limits and evict FFTs as needed to meet them. Limits that are not given are left unchanged.
+
+        Parameters
+        ----------
+        max_size: float or None
+            Maximum total size of the cached FFTs in MB. None means no limit.
+        max_entries: int or None
+            Maximum number of cached FFTs. None means no limit.
+        """
+        with self._lock:
+            if max_size is not _unchanged:
+                self.max_size = max_size
+            if max_entries is not _unchanged:
+                self.max_entries = max_entries
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all FFTs from the cache
+        """
+        with self._lock:
+            self._ffts.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns
+        -------
+        stats: dict
+            Number of hits, misses, evictions, and cached FFTs, the total size in MB of the
+            cached FFTs and the configured limits
+        """
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._ffts),
+                'size': self._nbytes / 1024 ** 2,
+                'max_size': self.max_size,
+                'max_entries': self.max_entries
+            }
+        return stats
+
+
+# process-wide cache used by convolve() and convolve_cube()
+kernel_fft_cache = KernelFFTCache(max_size=default_kernel_fft_cache_size)
+
+
+def fft_shape(shape, kernel_shape):
+    """
+    Get the padded shape needed to linearly convolve an image with a kernel via FFTs, rounded
+    up to sizes that FFTW transforms efficiently.
+
+    Parameters
+    ----------
+    shape: tuple (int, int)
+        Shape of the image
+    kernel_shape: tuple (int, int)
+        Shape of the kernel
+
+    Returns
+    -------
+    padded_shape: tuple (int, int)
+    """
+    padded_shape = tuple(pyfftw.next_fast_len(n + k - 1) for n, k in zip(shape, kernel_shape))
+    return padded_shape
+
+
+def convolve(image, kernel, dtype=np.float32, cache=False):
+    """
+    Convolve an image with a kernel using FFTs, filling beyond the edges of the image with zeros. The
+    result is the same as astropy.convolution.convolve_fft(image, kernel, boundary='fill', normalize_kernel=False),
+    i.e. the same size as the image with the kernel centered on pixel (ny // 2, nx // 2) of the kernel.
+    For PSF library entries, the kernel FFT can be taken from kernel_fft_cache so that only the image needs
+    to be transformed.
+
+    Parameters
+    ----------
+    image: 2D np.ndarray
+        Image to convolve
+    kernel: 2D np.ndarray
+        Convolution kernel
+    dtype: np.dtype
+        Real data type in which to do the FFTs (default: float32)
+    cache: bool
+        If True, the kernel is a PSF library entry and its FFT is cached. See KernelFFTCache.
+
+    Returns
+    -------
+    result: 2D np.ndarray
+        Convolved image
+    """
+    shape = fft_shape(image.shape, kernel.shape)
+    kernel_fft = _kernel_fft(kernel, shape, dtype, cache)
+
+    image_fft = rfftn(np.asarray(image, dtype=dtype), s=shape)
+    image_fft *= kernel_fft
+    full = irfftn(image_fft, s=shape)
+
+    y0 = kernel.shape[0] // 2
+    x0 = kernel.shape[1] // 2
+    result = full[y0:y0 + image.shape[0], x0:x0 + image.shape[1]].copy()
+    return result
+
+
+def _kernel_fft(kernel, shape, dtype, cache):
+    """
+    Get the FFT of a kernel zero-padded to shape, from kernel_fft_cache if cache is True
+    """
+    if cache:
+        return kernel_fft_cache.get(kernel, shape, dtype=dtype)
+    return rfftn(np.asarray(kernel, dtype=dtype), s=shape)
+
+
+def chunk_size(shape, kernel_shape, max_memory=default_max_memory, dtype=np.float32):
+    """
+    Get the number of planes that convolve_cube() can transform at once within a memory budget
+
+    Parameters
+    ----------
+    shape: tuple (int, int)
+        Shape of the planes
+    kernel_shape: tuple (int, int)
+        Shape of the kernels
+    max_memory: float
+        Memory budget in MB
+    dtype: np.dtype
+        Real data type in which the FFTs are done
+
+    Returns
+    -------
+    nplanes: int
+        Number of planes per batch, at least 1
+    """
+    padded_shape = fft_shape(shape, kernel_shape)
+    itemsize = np.dtype(dtype).itemsize
+    # the padded input and inverse transform are real, the image and kernel FFTs are complex
+    plane_bytes = 2 * itemsize * padded_shape[0] * padded_shape[1] + \
+        2 * 2 * itemsize * padded_shape[0] * (padded_shape[1] // 2 + 1)
+    nplanes = max(1, int(max_memory * 1024 ** 2 // plane_bytes))
+    return nplanes
+
+
+def convolve_cube(cube, kernels, weights, max_memory=default_max_memory, dtype=np.float32, cache=False):
+    """
+    Convolve each plane of a cube, cube[:, :, i], with the weighted sum of a set of kernels,
+    sum_k(weights[i, k] * kernels[k]), e.g. the interpolated PSFs given by PSFLibrary.get_psf_weights().
+    Convolution is otherwise the same as convolve(). The planes are transformed in batches with single
+    many-plane FFTs. Since the FFT is linear, the FFT of each plane's kernel is the same weighted
+    sum of the FFTs of the kernels, so no kernel needs to be transformed per plane.
+
+    Parameters
+    ----------
+    cube: 3D np.ndarray
+        Cube of images to convolve with shape (ny, nx, nplanes)
+    kernels: list of 2D np.ndarray
+        Convolution kernels, all the same shape
+    weights: 2D np.ndarray
+        Weights of the kernels for each plane with shape (nplanes, len(kernels))
+    max_memory: float
+        Memory budget in MB for the working arrays of each batch of planes
+    dtype: np.dtype
+        Real data type in which to do the FFTs (default: float32)
+    cache: bool
+        If True, the kernels are PSF library entries and their FFTs are cached. See KernelFFTCache.
+
+    Returns
+    -------
+    result: 3D np.ndarray
+        Convolved cube
+    """
+    ny, nx, nplanes = cube.shape
+    kernel_shape = kernels[0].shape
+    shape = fft_shape((ny, nx), kernel_shape)
+    kernel_ffts = np.stack([_kernel_fft(kernel, shape, dtype, cache) for kernel in kernels], axis=-1)
+    weights = np.asarray(weights, dtype=dtype)
+
+    y0 = kernel_shape[0] // 2
+    x0 = kernel_shape[1] // 2
+    nbatch = chunk_size((ny, nx), kernel_shape, max_memory=max_memory, dtype=dtype)
+    result = np.empty(cube.shape, dtype=dtype)
+    for start in range(0, nplanes, nbatch):
+        stop = min(start + nbatch, nplanes)
+        planes = np.asarray(cube[:, :, start:stop], dtype=dtype)
+        planes_fft = rfftn(planes, s=shape, axes=(0, 1))
+        planes_fft *= np.dot(kernel_ffts, weights[start:stop].T)
+        full = irfftn(planes_fft, s=shape, axes=(0, 1))
+        result[:, :, start:stop] = full[y0:y0 + ny, x0:x0 + nx]
+    return result
@@ -2,6 +2,11 @@
 from __future__ import division, absolute_import
 
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import scipy.sparse as sparse
 
@@ -10,14 +15,164 @@ from astropy.convolution import Gaussian1DKernel, convolve
 
 from . import exposure as exp
 from . import config as cf
-from .psf_library import PSFLibrary
-from .io_utils import read_json, ref_data_interp, ref_data_column
+from .psf_library import get_psf_library
+from .io_utils import read_json, ref_data_interp, ref_data_column, refdata_cache
 from .utils import merge_data, spectrum_resample
 from .telescope import TelescopeConfig
 from .custom_exceptions import EngineInputError, DataError, UnsupportedError, InternalError, DataConfigurationError
 
 default_refdata_directory = cf.default_refdata_directory
 
+# number of products derived from reference data (throughput curves, pixel mappings, etc.) kept by
+# Instrument._cached_product(). each product is for one instrument configuration and wavelength grid.
+default_product_cache_size = int(os.environ.get("pandeia_product_cache_size", 64))
+
+# default for arguments that are left unchanged by configure()
+_unchanged = object()
+
+
+class ProductCache(object):
+
+    """
+    Thread-safe cache of products derived from reference data, e.g. throughput curves and pixel mappings.
+    Each entry records the reference files its product was computed from. Whether they have changed is checked
+    the first time the entry is used in each refdata_cache generation, i.e. once per calculation, rather than
+    every time. When the cache grows beyond its limit, the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    max_entries: int or None
+        Maximum number of cached products. None means no limit.
+
+    Attributes
+    ----------
+    hits: int
+        Number of requests served from the cache
+    misses: int
+        Number of requests that required computing a product
+    evictions: int
+        Number of products evicted from the cache
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._products = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a cached product if its reference files are unchanged
+
+        Parameters
+        ----------
+        key: tuple
+            Key of the product
+
+        Returns
+        -------
+        files, product: frozenset, dict
+            The reference files the product was computed from and the product, or None, None if it is not
+            cached or is out of date
+        """
+        generation = refdata_cache.generation
+        with self._lock:
+            entry = self._products.pop(key, None)
+        if entry is not None and entry[2] != generation:
+            # first use in this generation. check the files outside the lock since that means a stat of each.
+            if refdata_cache.unchanged(entry[0]):
+                entry = (entry[0], entry[1], generation)
+            else:
+                entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, None
+            # re-insert to mark as most recently used
+            self._products[key] = entry
+            self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key, files, product):
+        """
+        Add a product to the cache
+
+        Parameters
+        ----------
+        key: tuple
+            Key of the product
+        files: iterable of (str, float)
+            Path and modification time of each reference file the product was computed from
+        product: dict
+            The product. This is shared so must not be modified.
+        """
+        with self._lock:
+            self._products.pop(key, None)
+            self._products[key] = (frozenset(files), product, refdata_cache.generation)
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used products until the cache is within its limit. Must be called with the lock held.
+        """
+        while self.max_entries is not None and len(self._products) > self.max_entries:
+            self._products.popitem(last=False)
+            self.evictions += 1
+
+    def configure(self, max_entries=_unchanged):
+        """
+        Set the cache limit and evict products as needed to meet it. A limit that is not given is left unchanged.
+
+        Parameters
+        ----------
+        max_entries: int or None
+            Maximum number of cached products. None means no limit.
+        """
+        with self._lock:
+            if max_entries is not _unchanged:
+                self.max_entries = max_entries
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all products from the cache. They are recomputed anyway when the reference files they were
+        computed from change.
+        """
+        with self._lock:
+            self._products.clear()
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns
+        -------
+        stats: dict
+            Number of hits, misses, evictions, and cached products, and the configured limit
+        """
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._products),
+                'max_entries': self.max_entries
+            }
+        return stats
+
+
+# process-wide cache used by Instrument._cached_product()
+product_cache = ProductCache(max_entries=default_product_cache_size)
+
+
+def clear_product_cache():
+    """
+    Remove all cached products derived from reference data. See ProductCache.clear().
+    """
+    product_cache.clear()
+
 
 class InstrumentConfig(TelescopeConfig):
 
@@ -143,7 +298,7 @@ class Instrument(InstrumentConfig):
         In some cases (e.g. NIRCam coronagraphy with bar-shaped masks), other configuration parameters come into play.
         """
         psf_path = os.path.join(self.ref_dir, "psfs")
-        self.psf_library = PSFLibrary(path=psf_path, aperture=self.instrument['aperture'])
+        self.psf_library = get_psf_library(psf_path, aperture=self.instrument['aperture'])
 
     @property
     def qe_key(self):
@@ -346,15 +501,172 @@ class Instrument(InstrumentConfig):
         eff: numpy.ndarray or float
             Total system throughput as a function of wave
         """
-        ote_int = self.telescope.get_ote_eff(wave)
-        filter_eff = self.get_filter_eff(wave)
-        disperser_eff = self.get_disperser_eff(wave)
-        internal_eff = self.get_internal_eff(wave)
-        det_qe = self.get_detector_qe(wave)
-
-        eff = ote_int * filter_eff * disperser_eff * internal_eff * det_qe
+        # the cached curve is shared, so give the caller its own copy
+        eff = self.get_throughput_curves(wave)['total'].copy()
         return eff
 
+    def _product_key(self, name, wave=None, extra=()):
+        """
+        Build the key that identifies a cached product: its name, the instrument class and configuration,
+        the order, the reference data, and the wavelength grid if any.
+
+        Parameters
+        ----------
+        name: str
+            Name of the product
+        wave: numpy.ndarray or None
+            Wavelength vector the product is evaluated on
+        extra: tuple
+            Any other parameters the product depends on
+
+        Returns
+        -------
+        key: tuple
+        """
+        detector = {k: self.detector.get(k) for k in ('subarray', 'readmode')}
+        config = json.dumps([self.instrument, detector], sort_keys=True, default=repr)
+        key = (
+            name,
+            self.__class__.__name__,
+            self.ref_dir,
+            self.telescope.ref_dir,
+            self.mode,
+            self.order,
+            config
+        ) + tuple(extra)
+        if wave is not None:
+            wave = np.ascontiguousarray(wave, dtype=np.float64)
+            key += (hashlib.sha1(wave.view(np.uint8)).hexdigest(), wave.size)
+        return key
+
+    def _cached_product(self, name, func, wave=None, extra=()):
+        """
+        Get a product derived from reference data from the process-wide cache. It is computed by func() if it
+        is not cached yet or if any of the reference files it was computed from have changed since. The files are
+        checked once per calculation (see ProductCache).
+
+        Parameters
+        ----------
+        name: str
+            Name of the product
+        func: callable
+            Function that computes the product as a dict of numpy.ndarrays, floats or None
+        wave: numpy.ndarray or None
+            Wavelength vector the product is evaluated on
+        extra: tuple
+            Any other parameters the product depends on
+
+        Returns
+        -------
+        product: dict
+            The product with its arrays made read-only. This is shared so must not be modified.
+        """
+        key = self._product_key(name, wave=wave, extra=extra)
+        files, product = product_cache.get(key)
+        if product is not None:
+            # if this is used to compute another cached product, that one depends on the same files
+            refdata_cache.note_files(files)
+            return product
+
+        with refdata_cache.record() as files:
+            product = func()
+        for k, v in product.items():
+            if isinstance(v, np.ndarray):
+                # copy so that no caller's array is shared
+                v = v.copy()
+                v.flags.writeable = False
+                product[k] = v
+
+        product_cache.put(key, files, product)
+        return product
+
+    def get_throughput_curves(self, wave):
+        """
+        Get the combined throughput curves of the current configuration evaluated on wave. Building them
+        interpolates each component's reference data onto wave, which for some modes (e.g. MIRI MRS with its
+        chain of dichroics) means several files, so the curves are cached per configuration and wavelength grid.
+        The same grids are used for each slice, dither and order, and for propagating the background.
+
+        Parameters
+        ----------
+        wave: numpy.ndarray
+            Wavelength vector to evaluate the curves on
+
+        Returns
+        -------
+        curves: dict
+            Dict of read-only numpy.ndarrays with the same length as wave. These are shared so must not be modified.
+                'ote' - Telescope (OTE) throughput
+                'instrument' - Combined filter, disperser, internal and detector QE throughput
+                'total' - Total system throughput, i.e. 'ote' * 'instrument'
+                'q_yield' - Detector quantum yield
+                'fano_factor' - Fano factor of the quantum yield
+                'var_fudge' - Pixel rate variance fudge factor
+        """
+        return self._cached_product('throughput', lambda: self._throughput_curves(wave), wave=wave)
+
+    def _throughput_curves(self, wave):
+        """
+        Compute the curves returned by get_throughput_curves()
+        """
+        ones = np.ones(len(wave))
+        q_yield, fano_factor = self.get_quantum_yield(wave)
+        curves = {
+            'ote': ones * self.telescope.get_ote_eff(wave),
+            'instrument': ones * self.get_filter_eff(wave) * self.get_disperser_eff(wave) * \
+                self.get_internal_eff(wave) * self.get_detector_qe(wave),
+            'q_yield': ones * q_yield,
+            'fano_factor': ones * fano_factor,
+            'var_fudge': ones * self.get_variance_fudge(wave)
+        }
+        curves['total'] = curves['ote'] * curves['instrument']
+        return curves
+
+    def get_pixel_mapping(self, wmin=None, wmax=None):
+        """
+        Get the mapping of wavelengths to detector pixels and the dispersion, trace, and detector pixel positions
+        at those wavelengths. These only depend on the configuration, but are needed for each slice, dither
+        and order, so they are cached.
+
+        Parameters
+        ----------
+        wmin: float or None
+            If set, only include pixels at wavelengths >= wmin
+        wmax: float or None
+            If set, only include pixels at wavelengths <= wmax
+
+        Returns
+        -------
+        mapping: dict
+            Dict of read-only numpy.ndarrays. These are shared so must not be modified.
+                'wave_pix' - Wavelength of each pixel, see get_wave_pix()
+                'dispersion' - Dispersion at wave_pix, see get_dispersion()
+                'trace' - Trace offset at wave_pix, see get_trace()
+                'detector_pixels' - Detector pixel positions of wave_pix (or None), see get_detector_pixels()
+        """
+        return self._cached_product('pixel_mapping', lambda: self._pixel_mapping(wmin, wmax), extra=(wmin, wmax))
+
+    def _pixel_mapping(self, wmin, wmax):
+        """
+        Compute the mapping returned by get_pixel_mapping()
+        """
+        wave_pix = self.get_wave_pix()
+        in_range = np.ones(wave_pix.shape, dtype=bool)
+        if wmin is not None:
+            in_range &= wave_pix >= wmin
+        if wmax is not None:
+            in_range &= wave_pix <= wmax
+        wave_pix = wave_pix[np.where(in_range)]
+
+        ones = np.ones(len(wave_pix))
+        mapping = {
+            'wave_pix': wave_pix,
+            'dispersion': ones * self.get_dispersion(wave_pix),
+            'trace': ones * self.get_trace(wave_pix),
+            'detector_pixels': self.get_detector_pixels(wave_pix)
+        }
+        return mapping
+
     def get_dispersion(self, wave):
         """
         Read in dispersion
@@ -477,12 +789,18 @@ class Instrument(InstrumentConfig):
 
     def get_wave_pix(self):
         """
-        Get wavelength vector to convert pixel position to wavelength
+        Get wavelength vector to convert pixel position to wavelength. This is cached per configuration.
 
         Returns
         -------
         wavepix: numpy.ndarray
-            Wavelength vector mapping pixels to wavelengths
+            Read-only wavelength vector mapping pixels to wavelengths. This is shared so must not be modified.
+        """
+        return self._cached_product('wave_pix', lambda: {'wave_pix': self._read_wave_pix()})['wave_pix']
+
+    def _read_wave_pix(self):
+        """
+        Read the wavelength vector returned by get_wave_pix() from the reference data
         """
         # usually wavepix is lifted from the dispersion file, but in some cases (e.g. NIRISS SOSS)
         # there is a specific, calibrated mapping of wavelength to pixels. look for that first and then
@@ -510,25 +828,34 @@ class Instrument(InstrumentConfig):
 
     def get_ipc_kernel(self):
         """
-        Get inter-pixel capacitance (IPC) kernel
+        Get inter-pixel capacitance (IPC) kernel. This is cached per configuration.
 
         Returns
         -------
         kernel: numpy.ndarray
-            IPC kernel data
+            Read-only IPC kernel data. This is shared so must not be modified.
+        """
+        return self._cached_product('ipc_kernel', self._read_ipc_kernel)['kernel']
+
+    def _read_ipc_kernel(self):
+        """
+        Read the IPC kernel returned by get_ipc_kernel() from the reference data
         """
         key = "ipc_kernel"
         ipc_file = os.path.join(self.ref_dir, self.paths[key])
         try:
             kernel = fits.getdata(ipc_file)
-        except IOError as e:
+            # the kernel is an image rather than a table so it's not read via refdata_cache. note the file
+            # so that the cached kernel is still replaced if the file changes.
+            refdata_cache.note_files([(os.path.abspath(ipc_file), os.stat(ipc_file).st_mtime)])
+        except (IOError, OSError) as e:
             msg = "Error reading IPC kernel reference file: %s. " % ipc_file
             if self.webapp:
                 msg += "(%s)" % type(e)
             else:
                 msg += repr(e)
             raise DataError(value=msg)
-        return kernel
+        return {'kernel': kernel}
 
     def get_detector_pars(self):
         """
@@ -694,6 +1021,33 @@ class Instrument(InstrumentConfig):
 
         return exposure_spec
 
+    def set_exposure_pars(self, ngroup=None, nint=None, nexp=None):
+        """
+        Change the readout pattern of the detector configuration and rebuild self.exposure_spec to match.
+        Parameters that are not given keep their current values.
+
+        Parameters
+        ----------
+        ngroup: int or None
+            Number of groups per integration
+        nint: int or None
+            Number of integrations per exposure
+        nexp: int or None
+            Number of exposures
+        """
+        for key, value in (('ngroup', ngroup), ('nint', nint), ('nexp', nexp)):
+            if value is None:
+                continue
+            try:
+                valid = int(value) == value and value >= 1
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                msg = "Detector %s must be a positive integer, got %s." % (key, repr(value))
+                raise EngineInputError(value=msg)
+            self.detector[key] = int(value)
+        self.exposure_spec = self.get_exposure_pars()
+
     def get_aperture_pars(self):
         """
         Collect instrument aperture parameters into a dict and return it
@@ -8,6 +8,10 @@ from __future__ import division, absolute_import
 import os
 import json
 import errno
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import numpy as np
 import astropy.io.fits as fits
 import pysynphot as psyn
@@ -15,6 +19,15 @@ import pysynphot as psyn
 from .custom_exceptions import EngineInputError, DataError
 from .constants import pandeia_waveunits, pandeia_fluxunits
 
+# maximum number of reference files whose tables are kept in memory by the process-wide refdata_cache
+default_refdata_cache_size = int(os.environ.get("pandeia_refdata_cache_size", 256))
+
+# memory map the reference files rather than reading them in full
+default_refdata_memmap = os.environ.get("pandeia_refdata_memmap", "false").lower() in ("1", "true", "yes")
+
+# default for arguments that are left unchanged by configure()
+_unchanged = object()
+
 
 class NumPyArangeEncoder(json.JSONEncoder):
 
@@ -214,6 +227,256 @@ def append_json(obj, filename):
     return obj
 
 
+class RefDataCache(object):
+
+    """
+    Thread-safe cache of the tables in reference data FITS files. The same throughput, dispersion, and trace
+    files are read many times per calculation (per slice, dither and order), so each file is parsed once into
+    a dict of column arrays. Entries are keyed by the file's path and modification time so that a changed file
+    is read again. When the cache grows beyond its limit, the least recently used entries are evicted.
+
+    Parameters
+    ----------
+    max_entries: int or None
+        Maximum number of cached files. None means no limit.
+    memmap: bool
+        Memory map the files rather than reading them in full. Otherwise the columns are converted to
+        native byte order when they are read.
+
+    Attributes
+    ----------
+    hits: int
+        Number of requests served from the cache
+    misses: int
+        Number of requests that required reading a file
+    evictions: int
+        Number of files evicted from the cache
+    generation: int
+        Incremented at the start of each calculation by new_generation()
+    """
+
+    def __init__(self, max_entries=None, memmap=False):
+        self.max_entries = max_entries
+        self.memmap = memmap
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    def get(self, filename):
+        """
+        Get the table in a reference file, reading it if it's not already cached.
+
+        Parameters
+        ----------
+        filename: str
+            Filename of reference data
+
+        Returns
+        -------
+        table: dict
+            'columns' - dict of column name in lower case to read-only np.ndarray. These are shared so must not
+            be modified.
+            'wave_error' - None if the wavelength column is increasing, else a message describing why it isn't.
+            'memmap' - whether the columns are memory mapped
+        """
+        try:
+            path = os.path.abspath(filename)
+            key = (path, os.stat(path).st_mtime)
+        except (OSError, TypeError, AttributeError) as e:
+            raise IOError("Error reading reference file: %s" % filename)
+
+        self.note_files([key])
+
+        with self._lock:
+            table = self._tables.pop(key, None)
+            if table is not None:
+                # re-insert to mark as most recently used
+                self._tables[key] = table
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = self._read(path)
+
+        with self._lock:
+            # drop any older version of the same file
+            for old_key in [k for k in self._tables if k[0] == path]:
+                del self._tables[old_key]
+            self._tables[key] = table
+            self._evict()
+        return table
+
+    @contextmanager
+    def record(self):
+        """
+        Context manager that records the reference files used within it by this thread. This lets products
+        derived from reference data be cached and invalidated when any of the files they depend on change.
+        See unchanged().
+
+        Yields
+        ------
+        files: set
+            Set of (path, modification time) of the files used. Filled in as they are used.
+        """
+        if not hasattr(self._local, 'records'):
+            self._local.records = []
+        files = set()
+        self._local.records.append(files)
+        try:
+            yield files
+        finally:
+            # records are nested, so this one is the last
+            self._local.records.pop()
+
+    def note_files(self, files):
+        """
+        Add reference files to the records of this thread that are currently open, e.g. the files a cached
+        product was computed from when it is used to compute another one.
+
+        Parameters
+        ----------
+        files: iterable of (str, float)
+            Path and modification time of each file
+        """
+        for record in getattr(self._local, 'records', []):
+            record.update(files)
+
+    def new_generation(self):
+        """
+        Start a new generation. Products derived from reference data check that the files they were computed
+        from are unchanged once per generation rather than every time they are used (see unchanged()), so a
+        file that changes during a calculation is picked up by the next one.
+
+        Returns
+        -------
+        generation: int
+            The new generation
+        """
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    @staticmethod
+    def unchanged(files):
+        """
+        Check whether reference files are unchanged since they were recorded by record()
+
+        Parameters
+        ----------
+        files: iterable of (str, float)
+            Path and modification time of each file
+
+        Returns
+        -------
+        unchanged: bool
+            True if all files still exist with the same modification time
+        """
+        try:
+            return all(os.stat(path).st_mtime == mtime for path, mtime in files)
+        except OSError as e:
+            return False
+
+    def _read(self, filename):
+        """
+        Read and parse the table in a reference file
+
+        Parameters
+        ----------
+        filename: str
+            Filename of reference data
+
+        Returns
+        -------
+        table: dict
+            See get()
+        """
+        data = fits.getdata(filename, memmap=self.memmap)
+        columns = {}
+        for name in data.columns.names:
+            col = data[name]
+            if not self.memmap:
+                # FITS data are big-endian. convert them once so that lookups don't have to.
+                col = np.array(col, dtype=col.dtype.newbyteorder('='))
+            col.flags.writeable = False
+            columns[name.lower()] = col
+
+        wave_error = None
+        if 'wavelength' in columns and np.any(np.diff(columns['wavelength']) < 0):
+            indices = np.where(np.diff(columns['wavelength']) < 0)[0]
+            wave_error = "Wavelengths must be increasing in reference file: %s\n" % (filename)
+            wave_error += "Out-of-order indices: %s" % repr(indices)
+
+        table = {'columns': columns, 'wave_error': wave_error, 'memmap': self.memmap}
+        return table
+
+    def _evict(self):
+        """
+        Remove least recently used tables until the cache is within its limit. Must be called with the lock held.
+        """
+        while self.max_entries is not None and len(self._tables) > self.max_entries:
+            self._tables.popitem(last=False)
+            self.evictions += 1
+
+    def configure(self, max_entries=_unchanged, memmap=_unchanged):
+        """
+        Set the cache limit and evict tables as needed to meet it. Settings that are not given are left unchanged.
+
+        Parameters
+        ----------
+        max_entries: int or None
+            Maximum number of cached files. None means no limit.
+        memmap: bool
+            Memory map the files read from now on
+        """
+        with self._lock:
+            if max_entries is not _unchanged:
+                self.max_entries = max_entries
+            if memmap is not _unchanged:
+                self.memmap = memmap
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all tables from the cache
+        """
+        with self._lock:
+            self._tables.clear()
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns
+        -------
+        stats: dict
+            Number of hits, misses, evictions, and cached files, the total size in MB of the cached
+            columns that are in memory, and the configured limit
+        """
+        with self._lock:
+            nbytes = sum(
+                col.nbytes for table in self._tables.values() if not table['memmap']
+                for col in table['columns'].values()
+            )
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._tables),
+                'size': nbytes / 1024 ** 2,
+                'max_entries': self.max_entries,
+                'memmap': self.memmap
+            }
+        return stats
+
+
+# process-wide cache used by ref_data_interp() and ref_data_column()
+refdata_cache = RefDataCache(max_entries=default_refdata_cache_size, memmap=default_refdata_memmap)
+
+
 def ref_data_interp(filename, wave, colname=None):
     """
     Read reference data from a FITS file and interpolate it to a provided wavelength array
@@ -235,21 +498,20 @@ def ref_data_interp(filename, wave, colname=None):
     if colname is None:
         raise EngineInputError(value="Must specify name of column to read from reference file.")
     try:
-        data = fits.getdata(filename)
+        table = refdata_cache.get(filename)
     except IOError as e:
         error_msg = "Error reading reference file: " + filename
         raise DataError(value=error_msg)
-    if np.any(np.diff(data['wavelength']) < 0):
-        indices = np.where(np.diff(data['wavelength']) < 0)[0]
-        error_msg = "Wavelengths must be increasing in reference file: %s\n" % (filename)
-        error_msg += "Out-of-order indices: %s" % repr(indices)
-        raise DataError(value=error_msg)
+    columns = table['columns']
+    if 'wavelength' not in columns:
+        raise DataError(value="Column wavelength not found in %s" % filename)
+    if table['wave_error'] is not None:
+        raise DataError(value=table['wave_error'])
     try:
-        columns = set(k.name.lower() for k in data.columns)
         if colname.lower() not in columns:
             msg = "Column %s not found in %s" % (colname, filename)
             raise DataError(value=msg)
-        interp_col = np.interp(wave, data['wavelength'], data[colname])
+        interp_col = np.interp(wave, columns['wavelength'], columns[colname.lower()])
     except Exception as e:
         error_msg = "Error interpolating reference file: %s : %s" % (filename, type(e))
         raise DataError(value=error_msg)
@@ -277,11 +539,12 @@ def ref_data_column(filename, colname=None, error_msg="Error loading reference f
     if colname is None:
         raise EngineInputError(value="Must specify name of column to read from reference file.")
     try:
-        data = fits.getdata(filename)
+        table = refdata_cache.get(filename)
     except IOError as e:
         raise DataError(value="I/O " + error_msg)
     try:
-        col = data[colname]
+        # the cached column is shared, so give the caller its own copy
+        col = np.array(table['columns'][colname.lower()])
     except KeyError as e:
         raise DataError(value="Column not found in reference file: %s" % colname)
     return col
@@ -9,7 +9,7 @@ import numpy.ma as ma
 import numpy as np
 
 from . import exposure as exp
-from .psf_library import PSFLibrary
+from .psf_library import get_psf_library
 from .telescope import Telescope
 from .instrument import Instrument
 from .io_utils import ref_data_interp, read_json, get_json_parameters
@@ -212,7 +212,7 @@ class NIRCam(JWSTInstrument):
             psfs_key = self.instrument['aperture']
 
         psf_path = os.path.join(self.ref_dir, "psfs")
-        self.psf_library = PSFLibrary(path=psf_path, aperture=psfs_key)
+        self.psf_library = get_psf_library(psf_path, aperture=psfs_key)
 
     def get_filter_eff(self, wave):
         """
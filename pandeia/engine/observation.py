@@ -1,6 +1,8 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import division, absolute_import
 
+import copy
+
 from .config import DefaultConfig
 from .custom_exceptions import EngineInputError
 from .scene import Scene
@@ -42,3 +44,25 @@ class Observation(DefaultConfig):
         Return the configured seed for the random number generator.
         """
         return self.random_seed
+
+    def offset_copy(self, dither):
+        """
+        Get a copy of the observation with the scene offset by a dither. The instrument, including its
+        PSF library, and the strategy are not modified by calculating a signal so they are shared rather
+        than deep-copied. The instrument is shallow-copied so that per-signal settings, e.g. the
+        spectral order, stay with each copy.
+
+        Parameters
+        ----------
+        dither : dict - {'x': x, 'y': y}
+            Offset to apply to the scene
+
+        Returns
+        -------
+        obs : Observation instance
+            Copy of the observation with the offset scene
+        """
+        obs = copy.copy(self)
+        obs.scene = self.scene.offset_copy(dither)
+        obs.instrument = copy.copy(self.instrument)
+        return obs
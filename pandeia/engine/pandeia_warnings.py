@@ -64,3 +64,10 @@ astrospectrum_warning_messages = {
     "spectrum_missing_red": "Spectrum [%.2f, %.2f] does not extend to instrument configuration red limit, %.2f."
 }
 astrospectrum_warning_messages.update(standard_warning_messages)
+
+# warning messages specific to the calculation functions in etc3D
+etc3d_warning_messages = {
+    "target_sn_not_reached": "Target S/N of %.2f not reached within the readout pattern limits. "
+                             "Using the readout pattern with the highest S/N, %.2f, instead."
+}
+etc3d_warning_messages.update(standard_warning_messages)
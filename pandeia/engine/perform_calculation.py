@@ -18,7 +18,8 @@ def perform_calculation(calc_input, reverse=False, dict_report=True, webapp=True
         Dictionary containing the information required to perform the calculation.
     reverse: boolean (default: False)
         Specify whether calculation is 'reverse' where a desired signal/noise is specified
-        and the calculation determines an optimal ExposureSpecification to achieve it.
+        and the calculation determines an optimal ExposureSpecification to achieve it. The desired
+        signal/noise is given in the 'reverse' section of the input.
     dict_report: Boolean (default: True)
         If True, return a dict in engine output API format. Otherwise return
         a report.Report instance.
@@ -2,15 +2,67 @@
 from __future__ import division, absolute_import
 
 import os
+import sys
 import copy
+import json
+import argparse
+import threading
+import warnings
+from collections import OrderedDict
 
 import astropy.io.fits as fits
 import numpy as np
 
 from .custom_exceptions import DataError
 
+# maximum total size in MB of the PSF libraries kept in the process-wide cache. can be set
+# via the environment since it needs to be tuned to the memory available to each worker.
+default_psf_cache_size = float(os.environ.get("pandeia_psf_cache_size", 1024))
 
-class PSFLibrary:
+# whether the PSF libraries loaded by the instruments read only the FITS headers up front and
+# memory-map each PSF image when it is first used
+default_psf_lazy = os.environ.get("pandeia_psf_lazy", "false").lower() in ("1", "true", "yes")
+
+# a PSF library directory can be packed into a single store by pack_psf_library(). the store consists of a
+# raw data file holding one contiguous array of PSF images per (instrument, aperture, source offset) group and
+# a JSON index with the wavelengths and metadata of the PSFs, the modification times of the FITS files they
+# came from, and where each group is in the data file.
+psf_store_index = "psf_store.json"
+psf_store_data = "psf_store.dat"
+psf_store_version = 2
+
+# default for arguments that are left unchanged by configure()
+_unchanged = object()
+
+
+class _LazyPSF(dict):
+
+    """
+    PSF library entry whose image, 'int', is only read from its FITS file when it is first accessed.
+    The image is memory-mapped so that only the pages that are actually used become resident.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the PSF FITS file
+    nbytes: int
+        Size in bytes of the PSF image, from its FITS header
+    """
+
+    def __init__(self, filename, nbytes, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.filename = filename
+        self.nbytes = nbytes
+
+    def __missing__(self, key):
+        if key != 'int':
+            raise KeyError(key)
+        psf_int = fits.getdata(self.filename, memmap=True)
+        self['int'] = psf_int
+        return psf_int
+
+
+class PSFLibrary(object):
 
     """
     Class for encapsulating a hard PSF library, typically one generated
@@ -27,20 +79,56 @@ class PSFLibrary:
         Strictly, the reader will look for psf file names with a substring matching the aperture
         string. 'all' reads all psfs in the path. This is the default. The aperture string in the filename
         should match the .fits keyword APERTURE.
+    lazy : bool, optional
+        if True, only the FITS headers are read when the library is loaded. Each PSF image is memory-mapped
+        from its file the first time it is used. Default is False.
+    store : bool, optional
+        if True and the path contains a store packed by pack_psf_library(), memory-map the store instead
+        of reading the FITS files. Default is True.
 
     Methods
     -------
     read_library
+    read_store
     get_values
     get_good_psfs
     get_psf
+    get_psf_weights
 
     """
 
-    def __init__(self, path=None, aperture='all'):
+    def __init__(self, path=None, aperture='all', lazy=False, store=True):
         if path is None:
             path = os.path.join(os.path.dirname(__file__), 'refdata', 'psfs')
-        self.read_library(path, aperture)
+        self.path = path
+        self.aperture = aperture
+        self.lazy = lazy
+        self.store = store
+        if store and os.path.exists(os.path.join(path, psf_store_index)):
+            self.read_store(path, aperture)
+        else:
+            self.read_library(path, aperture)
+
+    def __deepcopy__(self, memo):
+        # the library is never modified once it's read so copies can share it. this keeps deep copies
+        # of instruments and observations from duplicating all of the PSF data.
+        return self
+
+    def __reduce__(self):
+        # pickle by reference to the library files, e.g. to send observations to worker processes. the
+        # library is then read, or taken from the cache, in the receiving process instead of being serialized.
+        if self.store:
+            return (get_psf_library, (self.path, self.aperture, self.lazy))
+        return (PSFLibrary, (self.path, self.aperture, self.lazy, self.store))
+
+    @property
+    def nbytes(self):
+        """
+        Total size in bytes of the PSF images held by the library. The images of lazy libraries are counted
+        at their full size whether or not they have been loaded yet, so that PSFLibraryCache can keep to its
+        limits without checking them every time an image is loaded.
+        """
+        return sum(psf.nbytes if isinstance(psf, _LazyPSF) else psf['int'].nbytes for psf in self._psfs)
 
     def read_library(self, path, aperture, wave_unit='m'):
         """
@@ -59,83 +147,250 @@ class PSFLibrary:
         wave_unit: string
             Wavelength unit used by PSF library (default: m)
         """
-        files = os.listdir(path)
-
-        psf_files = []
-        for file in files:
-            filename, ext = os.path.splitext(file)
-            filename_split = filename.split('_')
-            filename_instrument = filename_split[0]
-            filename_apertures = filename_split[1].split('-')
-            filename_wave = filename_split[2]
-            # If the psf is on-axis, the offset polar coordinates may not exist
-            try:
-                filename_radius = filename_split[3]
-                filename_theta = filename_split[4]
-            except:
-                filename_radius = 0.
-                filename_theta = 0.
-
-            if aperture is 'all':
-                if ext == '.fits':
-                    psf_files.append(file)
-            elif ext == '.fits' and aperture in filename_apertures:
-                    psf_files.append(file)
-            # If the aperture has a string with an underscore in it, try to use only the first part.
-            elif ext == '.fits' and (aperture.split('_'))[0] in filename_apertures:
-                    psf_files.append(file)
-            else:
-                pass
+        psf_files = [file for file in os.listdir(path) if self._match_file(file, aperture)]
 
         self._psfs = []
 
         for psf_file in psf_files:
-            hdulist = fits.open(path + '/' + psf_file, memmap=False)
-
-            psf_int = copy.deepcopy(hdulist[0].data)
-
-            ins = hdulist[0].header['INSTRUME'].lower()
-            nwaves = hdulist[0].header['NWAVES']
-            if nwaves != 1:
-                raise ValueError("Input PSF must be monochromatic (nwaves = #r)" % nwaves)
-
-            wave_scl = self._get_unit_scl(wave_unit)
-            wave = hdulist[0].header['WAVE0'] * wave_scl
-
-            pix_scl = hdulist[0].header['PIXELSCL']
-            diff_limit = hdulist[0].header['DIFFLMT']
-            aperture_name = hdulist[0].header['APERTURE'].lower()
-            # offset_r/offset_t is the offset from the optical center in webbpsf.  however, for NIRCam masklwb
-            # and maskswb, this includes the offset from the optical center to the optimal position along the bar.
-            # what we need for source association is instead the offset from that optimal position. this is stored in the
-            # optoff_r/optoff_t keywords which need to be provided in these cases. aperture_name here will have these
-            # aperture and filter concatenated so do a string compare to look for aperture.
-            if 'masklwb' in aperture_name or 'maskswb' in aperture_name:
-                try:
-                    radius = hdulist[0].header['OPTOFF_R']
-                    theta = hdulist[0].header['OPTOFF_T']
-                except KeyError as e:
-                    msg = "PSFs for bar-shaped masks require offsets from optimal bar position. (%s)" % e
-                    raise DataError(value=msg)
+            filename = path + '/' + psf_file
+            if self.lazy:
+                header = fits.getheader(filename)
+                nbytes = abs(header['BITPIX']) // 8 * header['NAXIS1'] * header['NAXIS2']
+                psf = _LazyPSF(filename, nbytes, self._read_header(header, wave_unit))
             else:
-                radius = hdulist[0].header['OFFSET_R']
-                theta = hdulist[0].header['OFFSET_T']
-
-            upsamp = hdulist[0].header['DET_SAMP']
-
-            psf = {
-                'int': psf_int,
-                'wave': wave,
-                'pix_scl': pix_scl,
-                'diff_limit': diff_limit,
-                'upsamp': upsamp,
-                'instrument': ins,
-                'aperture_name': aperture_name,
-                'source_offset': (radius, theta)
-            }
+                hdulist = fits.open(filename, memmap=False)
+                psf = self._read_header(hdulist[0].header, wave_unit)
+                psf['int'] = copy.deepcopy(hdulist[0].data)
+                hdulist.close()
 
             self._psfs.append(psf)
-            hdulist.close()
+
+        self._build_index()
+
+    def _match_file(self, file, aperture):
+        """
+        Check whether a file in the library is a PSF FITS file to be used for an aperture, based on its filename.
+        See read_library() for the filename format.
+
+        Parameters
+        ----------
+        file: string
+            Filename of the PSF
+        aperture: string
+            Aperture to restrict the PSFs to, or 'all'
+
+        Returns
+        -------
+        match: bool
+        """
+        filename, ext = os.path.splitext(file)
+        if ext != '.fits':
+            return False
+
+        filename_split = filename.split('_')
+        filename_apertures = filename_split[1].split('-')
+
+        if aperture == 'all':
+            match = True
+        elif aperture in filename_apertures:
+            match = True
+        # If the aperture has a string with an underscore in it, try to use only the first part.
+        elif (aperture.split('_'))[0] in filename_apertures:
+            match = True
+        else:
+            match = False
+        return match
+
+    def read_store(self, path, aperture):
+        """
+        Read a PSF library that has been packed into a single store by pack_psf_library(). The store is
+        memory-mapped read-only. The library entries' images are views into it, so no PSF data is copied.
+        Processes that share the store therefore share the same pages. If the PSF FITS files have changed
+        since the store was packed, a warning is issued and the FITS files are read instead.
+
+        Parameters
+        ----------
+        path: string
+            Path containing the PSF store
+        aperture: string
+            Restrict psfs to those whose original filenames match this aperture. See PSFLibrary.
+        """
+        with open(os.path.join(path, psf_store_index)) as f:
+            index = json.load(f)
+        mismatch = _store_mismatch(path, index)
+        if mismatch is not None:
+            psf_files = [file for file in os.listdir(path) if os.path.splitext(file)[1] == '.fits']
+            if len(psf_files) == 0:
+                msg = "PSF store in %s can not be used (%s) and there are no PSF files to read instead." % (
+                    path, mismatch
+                )
+                raise DataError(value=msg)
+            warnings.warn("PSF store in %s is out of date (%s). Reading the PSF files instead. "
+                          "The store needs to be packed again." % (path, mismatch))
+            self.read_library(path, aperture)
+            return
+
+        # plain ndarray view of the map so that arrays derived from the PSFs aren't np.memmap instances
+        data = np.asarray(np.memmap(os.path.join(path, psf_store_data), dtype=index['dtype'], mode='r'))
+
+        self._psfs = []
+        stacks = {}
+        for group in index['groups']:
+            n, ny, nx = group['shape']
+            start = group['offset'] // data.itemsize
+            stack = data[start:start + n * ny * nx].reshape(n, ny, nx)
+            key = (group['instrument'], group['aperture_name'], tuple(group['source_offset']))
+
+            entries = [(i, entry) for i, entry in enumerate(group['entries']) if self._match_file(entry['file'], aperture)]
+            for i, entry in entries:
+                psf = {
+                    'int': stack[i],
+                    'wave': entry['wave'],
+                    'pix_scl': entry['pix_scl'],
+                    'diff_limit': entry['diff_limit'],
+                    'upsamp': entry['upsamp'],
+                    'instrument': key[0],
+                    'aperture_name': key[1],
+                    'source_offset': key[2]
+                }
+                self._psfs.append(psf)
+            if len(entries) == n:
+                stacks[key] = stack
+
+        self._build_index(stacks=stacks)
+
+    def _read_header(self, header, wave_unit='m'):
+        """
+        Get the metadata of a library entry from the header of its PSF FITS file
+
+        Parameters
+        ----------
+        header: astropy.io.fits.Header
+            Primary header of the PSF FITS file
+        wave_unit: string
+            Wavelength unit used by PSF library (default: m)
+
+        Returns
+        -------
+        psf: dict
+            Library entry without the PSF image
+        """
+        ins = header['INSTRUME'].lower()
+        nwaves = header['NWAVES']
+        if nwaves != 1:
+            raise ValueError("Input PSF must be monochromatic (nwaves = #r)" % nwaves)
+
+        wave_scl = self._get_unit_scl(wave_unit)
+        wave = header['WAVE0'] * wave_scl
+
+        pix_scl = header['PIXELSCL']
+        diff_limit = header['DIFFLMT']
+        aperture_name = header['APERTURE'].lower()
+        # offset_r/offset_t is the offset from the optical center in webbpsf.  however, for NIRCam masklwb
+        # and maskswb, this includes the offset from the optical center to the optimal position along the bar.
+        # what we need for source association is instead the offset from that optimal position. this is stored in the
+        # optoff_r/optoff_t keywords which need to be provided in these cases. aperture_name here will have these
+        # aperture and filter concatenated so do a string compare to look for aperture.
+        if 'masklwb' in aperture_name or 'maskswb' in aperture_name:
+            try:
+                radius = header['OPTOFF_R']
+                theta = header['OPTOFF_T']
+            except KeyError as e:
+                msg = "PSFs for bar-shaped masks require offsets from optimal bar position. (%s)" % e
+                raise DataError(value=msg)
+        else:
+            radius = header['OFFSET_R']
+            theta = header['OFFSET_T']
+
+        upsamp = header['DET_SAMP']
+
+        psf = {
+            'wave': wave,
+            'pix_scl': pix_scl,
+            'diff_limit': diff_limit,
+            'upsamp': upsamp,
+            'instrument': ins,
+            'aperture_name': aperture_name,
+            'source_offset': (radius, theta)
+        }
+
+        return psf
+
+    def _build_index(self, stacks=None):
+        """
+        Group the library entries by (instrument, aperture_name, source_offset). Each group holds its library
+        ids and wavelengths sorted by wavelength so that lookups can use np.searchsorted(), and, unless the
+        library is lazy, the PSF images stacked into a single array. The library entries' images are then
+        replaced by views into the stack.
+
+        Parameters
+        ----------
+        stacks: dict or None
+            Stacked images that already exist for some groups, e.g. in a PSF store, sorted by wavelength
+            and keyed by (instrument, aperture_name, source_offset). These are used instead of stacking copies.
+        """
+        if stacks is None:
+            stacks = {}
+
+        groups = {}
+        for i, psf in enumerate(self._psfs):
+            key = (psf['instrument'], psf['aperture_name'], psf['source_offset'])
+            groups.setdefault(key, []).append(i)
+
+        self._index = {}
+        for key, ids in groups.items():
+            ids = np.array(sorted(ids, key=lambda i: self._psfs[i]['wave']), dtype=int)
+            group = {
+                'ids': ids,
+                'wave': np.array([self._psfs[i]['wave'] for i in ids])
+            }
+            if key in stacks:
+                group['int'] = stacks[key]
+            # lazy libraries keep each image in its own memory map until it's used
+            elif not self.lazy and len(set(self._psfs[i]['int'].shape for i in ids)) == 1:
+                group['int'] = np.stack([self._psfs[i]['int'] for i in ids])
+            if 'int' in group:
+                for j, i in enumerate(ids):
+                    self._psfs[i]['int'] = group['int'][j]
+            self._index[key] = group
+
+        # lookups use substring matches on the aperture name so cache how each requested
+        # (instrument, aperture_name, source_offset) maps onto the groups
+        self._lookups = {}
+
+    def _get_group(self, instrument, aperture_name, source_offset=(0, 0)):
+        """
+        Get the index group of library entries for an instrument, aperture, and source offset. As in the
+        original list-based lookup, aperture_name matches any library aperture name that contains it.
+
+        Parameters
+        ----------
+        instrument: str
+            Instrument name
+        aperture_name: str
+            Name of the instrument aperture
+        source_offset: tuple (float, float)
+            Polar coordinates of the PSF offset
+
+        Returns
+        -------
+        group: dict
+            'ids' and 'wave' arrays sorted by wavelength, and 'int' stacked PSF images if available
+        """
+        lookup = (instrument, aperture_name, source_offset)
+        group = self._lookups.get(lookup)
+        if group is None:
+            keys = [key for key in self._index if
+                    instrument == key[0] and aperture_name in key[1] and source_offset == key[2]]
+            if len(keys) == 1:
+                group = self._index[keys[0]]
+            else:
+                ids = np.concatenate([self._index[key]['ids'] for key in keys] + [np.zeros(0, dtype=int)])
+                waves = np.concatenate([self._index[key]['wave'] for key in keys] + [np.zeros(0)])
+                order = np.argsort(waves, kind='mergesort')
+                group = {'ids': ids[order], 'wave': waves[order]}
+            self._lookups[lookup] = group
+        return group
 
     def get_values(self, key, instrument, aperture_name, source_offset=(0, 0)):
         """
@@ -152,14 +407,8 @@ class PSFLibrary:
         result: tuple of format (list, list)
             Lists of index id's and values
         """
-        values = [psf[key] for psf in self._psfs
-                  if (instrument == psf['instrument'] and
-                      aperture_name in psf['aperture_name']) and
-                      source_offset == psf['source_offset']]
-        ids = [i for i, psf in enumerate(self._psfs)
-               if (instrument == psf['instrument'] and
-                   aperture_name in psf['aperture_name']) and
-                   source_offset == psf['source_offset']]
+        ids = list(self._get_group(instrument, aperture_name, source_offset=source_offset)['ids'])
+        values = [self._psfs[i][key] for i in ids]
         result = ids, values
         return result
 
@@ -182,12 +431,12 @@ class PSFLibrary:
         psf: dict
             Dict containing the PSF and associated information
         """
-        wids, psf_waves = self.get_values('wave', instrument, aperture_name, source_offset=source_offset)
-        nids, nearest_waves = self._find_two_nearest(psf_waves, wave)
+        group = self._get_group(instrument, aperture_name, source_offset=source_offset)
+        nids, nearest_waves = self._find_two_nearest(group['wave'], wave)
 
         # if wave is not in psf_waves then the two closest will be returned
         if len(nids) == 2:
-            ids = [wids[nids[0]], wids[nids[1]]]
+            ids = [group['ids'][nids[0]], group['ids'][nids[1]]]
 
             pix_scl0 = self._psfs[ids[0]]['pix_scl']
             pix_scl1 = self._psfs[ids[1]]['pix_scl']
@@ -212,7 +461,7 @@ class PSFLibrary:
         # if wave is one of the values in psf_waves then only it will be returned and
         # no interpolation is necessary
         else:
-            ids = nids
+            ids = [group['ids'][nids[0]]]
 
             psf_int = self._psfs[ids[0]]['int']
             diff_limit =  self._psfs[ids[0]]['diff_limit']
@@ -231,6 +480,58 @@ class PSFLibrary:
         }
         return psf
 
+    def get_psf_weights(self, waves, instrument, aperture_name, source_offset=(0, 0)):
+        """
+        Get the library PSFs and the linear interpolation weights that get_psf() uses to construct the PSF
+        at each of a set of wavelengths, i.e. get_psf(waves[i])['int'] == sum_k(weights[i, k] * psfs[k]['int']).
+        Since convolution is linear, this lets a whole cube be convolved with only the library PSFs.
+
+        Parameters
+        ----------
+        waves: 1D np.ndarray
+            Wavelengths at which the PSF is required
+        instrument: str
+            Instrument name
+        aperture_name: str
+            Name of the instrument aperture
+        source_offset: tuple (float, float)
+            Polar coordinates of the PSF offset
+
+        Returns
+        -------
+        psfs: list of dicts
+            The library entries that contribute to the PSF at any of the given wavelengths
+        weights: 2D np.ndarray
+            Interpolation weights with shape (len(waves), len(psfs))
+        """
+        waves = np.atleast_1d(waves)
+        group = self._get_group(instrument, aperture_name, source_offset=source_offset)
+        psf_waves = group['wave']
+        if len(psf_waves) == 0 or waves.min() < psf_waves[0] or waves.max() > psf_waves[-1]:
+            raise ValueError("Value must be within range of list.")
+
+        # same bracketing as _find_two_nearest(), for all wavelengths at once
+        upper = np.searchsorted(psf_waves, waves, side='left')
+        exact = psf_waves[upper] == waves
+        lower = np.where(exact, upper, upper - 1)
+        frac = np.zeros(waves.size)
+        frac[~exact] = (waves[~exact] - psf_waves[lower[~exact]]) / (psf_waves[upper[~exact]] - psf_waves[lower[~exact]])
+
+        weights = np.zeros((waves.size, len(psf_waves)))
+        rows = np.arange(waves.size)
+        np.add.at(weights, (rows, lower), 1.0 - frac)
+        np.add.at(weights, (rows, upper), frac)
+
+        used = np.flatnonzero(np.any(weights != 0.0, axis=0))
+        psfs = [self._psfs[group['ids'][i]] for i in used]
+
+        if len(set(psf['pix_scl'] for psf in psfs)) > 1:
+            raise ValueError("Pixel scales in the library must be the same for a single instrument aperture.")
+        if len(set(psf['upsamp'] for psf in psfs)) > 1:
+            raise ValueError("Upsampling factors in the library must be the same for a single instrument aperture.")
+
+        return psfs, weights[:, used]
+
     def get_pix_scale(self, instrument, aperture_name):
         """
         Get PSF pixel scale for given instrument/aperture
@@ -310,8 +611,7 @@ class PSFLibrary:
             Polar coordinates of PSF offsets.
 
         """
-        offsets = [psf['source_offset'] for psf in self._psfs if instrument ==
-                   psf['instrument'] and aperture_name in psf['aperture_name']]
+        offsets = [key[2] for key in self._index if instrument == key[0] and aperture_name in key[1]]
         unique_offsets = list(set(offsets))
         return unique_offsets
 
@@ -330,36 +630,32 @@ class PSFLibrary:
 
     def _find_two_nearest(self, values, value):
         """
-        Find the subscripts of the two neighboring values in list relative to
-        an input value.
+        Find the subscripts of the two neighboring values in a sorted array relative to
+        an input value. If the value is in the array, only its subscript is returned.
 
         Parameters
         ----------
-        values: list-like
-            List of values to search
+        values: np.ndarray
+            Sorted array of values to search
         value: float
             Input value to be bracketed
 
         Returns
         -------
         vals: tuple (list, np.ndarray)
-            Bracketing indices in both list and numpy array format
+            Bracketing indices and the values at those indices
         """
-        nplist = np.array(values)
-
         # ensure that value is not outside the range of list
-        if value < nplist.min() or value > nplist.max():
+        if len(values) == 0 or value < values[0] or value > values[-1]:
             raise ValueError("Value must be within range of list.")
 
-        diff = nplist - value
-        diff_sorted = np.sort(diff)
-
-        smaller = np.max(diff_sorted[diff_sorted<=0])
-        larger = np.min(diff_sorted[diff_sorted>=0])
-
-        ids = [i for i, v in enumerate(diff) if diff[i] == smaller or diff[i] == larger]
+        upper = int(np.searchsorted(values, value, side='left'))
+        if values[upper] == value:
+            ids = [upper]
+        else:
+            ids = [upper - 1, upper]
 
-        vals = ids, nplist[ids]
+        vals = ids, values[ids]
 
         return vals
 
@@ -384,3 +680,302 @@ class PSFLibrary:
             return scale
         except KeyError:
             raise KeyError('Unknown wavelength unit')
+
+
+def _store_mismatch(path, index):
+    """
+    Check whether a PSF store still matches the PSF FITS files it was packed from. A store whose FITS
+    files are no longer present is assumed to be current, since the store can be used without them.
+
+    Parameters
+    ----------
+    path: string
+        Path containing the PSF store
+    index: dict
+        Index of the store as written by pack_psf_library()
+
+    Returns
+    -------
+    mismatch: string or None
+        Description of the first difference found, or None if the store is current
+    """
+    if index.get('version') != psf_store_version:
+        return "version %s, expected %s" % (index.get('version'), psf_store_version)
+
+    packed = {}
+    for group in index['groups']:
+        for entry in group['entries']:
+            packed[entry['file']] = entry['mtime']
+
+    psf_files = set(file for file in os.listdir(path) if os.path.splitext(file)[1] == '.fits')
+    if len(psf_files) == 0:
+        return None
+    if psf_files != set(packed):
+        return "PSF files have been added or removed"
+    for file in sorted(psf_files):
+        if os.path.getmtime(os.path.join(path, file)) != packed[file]:
+            return "%s has changed" % file
+    return None
+
+
+class PSFLibraryCache(object):
+
+    """
+    Thread-safe cache of PSFLibrary instances keyed by library path and aperture. When the cache
+    grows beyond its limits, the least recently used libraries are evicted.
+
+    Parameters
+    ----------
+    max_size: float or None
+        Maximum total size of the cached PSF images in MB. None means no limit.
+    max_entries: int or None
+        Maximum number of cached libraries. None means no limit.
+
+    Attributes
+    ----------
+    hits: int
+        Number of requests served from the cache
+    misses: int
+        Number of requests that required reading a library
+    evictions: int
+        Number of libraries evicted from the cache
+    """
+
+    def __init__(self, max_size=None, max_entries=None):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._libraries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, aperture='all', lazy=False):
+        """
+        Get the PSFLibrary for a path and aperture, reading it if it's not already cached.
+
+        Parameters
+        ----------
+        path: string
+            Path to the PSF library
+        aperture: string
+            Aperture to restrict the PSFs to. See PSFLibrary.
+        lazy: bool
+            Whether to only read the PSF images when they're used. See PSFLibrary.
+
+        Returns
+        -------
+        library: PSFLibrary instance
+        """
+        key = (os.path.abspath(path), aperture, lazy)
+        with self._lock:
+            library = self._libraries.pop(key, None)
+            if library is not None:
+                # re-insert to mark as most recently used
+                self._libraries[key] = library
+                self.hits += 1
+                return library
+            self.misses += 1
+
+        # read outside of the lock so that other libraries can be served in the meantime
+        library = PSFLibrary(path=path, aperture=aperture, lazy=lazy)
+
+        with self._lock:
+            # another thread may have read the same library in the meantime. if so, use that one.
+            library = self._libraries.pop(key, library)
+            self._libraries[key] = library
+            self._evict()
+        return library
+
+    def _evict(self):
+        """
+        Remove least recently used libraries until the cache is within its limits. The most
+        recently used library is always kept. Must be called with the lock held.
+        """
+        while len(self._libraries) > 1:
+            over_entries = self.max_entries is not None and len(self._libraries) > self.max_entries
+            over_size = self.max_size is not None and self._nbytes() > self.max_size * 1024 ** 2
+            if not (over_entries or over_size):
+                break
+            self._libraries.popitem(last=False)
+            self.evictions += 1
+
+    def _nbytes(self):
+        return sum(library.nbytes for library in self._libraries.values())
+
+    def configure(self, max_size=_unchanged, max_entries=_unchanged):
+        """
+        Set the cache limits and evict libraries as needed to meet them. Limits that are not given are left
+        unchanged.
+
+        Parameters
+        ----------
+        max_size: float or None
+            Maximum total size of the cached PSF images in MB. None means no limit.
+        max_entries: int or None
+            Maximum number of cached libraries. None means no limit.
+        """
+        with self._lock:
+            if max_size is not _unchanged:
+                self.max_size = max_size
+            if max_entries is not _unchanged:
+                self.max_entries = max_entries
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all libraries from the cache, e.g. if the PSF reference data has changed.
+        """
+        with self._lock:
+            self._libraries.clear()
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns
+        -------
+        stats: dict
+            Number of hits, misses, evictions, and cached libraries, the total size in MB of the
+            cached libraries and the configured limits
+        """
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._libraries),
+                'size': self._nbytes() / 1024 ** 2,
+                'max_size': self.max_size,
+                'max_entries': self.max_entries
+            }
+        return stats
+
+
+# process-wide cache used when instruments load their PSF libraries
+psf_library_cache = PSFLibraryCache(max_size=default_psf_cache_size)
+
+
+def get_psf_library(path, aperture='all', lazy=None):
+    """
+    Get a PSFLibrary from the process-wide cache, reading it if needed. Repeated calculations
+    for the same aperture then do not need to read any PSF files.
+
+    Parameters
+    ----------
+    path: string
+        Path to the PSF library
+    aperture: string
+        Aperture to restrict the PSFs to. See PSFLibrary.
+    lazy: bool or None
+        Whether to only read the PSF images when they're used. See PSFLibrary. If None,
+        default_psf_lazy is used.
+
+    Returns
+    -------
+    library: PSFLibrary instance
+    """
+    if lazy is None:
+        lazy = default_psf_lazy
+    return psf_library_cache.get(path, aperture=aperture, lazy=lazy)
+
+
+def pack_psf_library(path, dtype=None, wave_unit='m'):
+    """
+    Pack a directory of PSF FITS files into a single store that PSFLibrary memory-maps instead of
+    reading the FITS files. The store is written into the same directory and replaces any existing one.
+    The PSF FITS files are left in place. They are still used if the store is removed, and instead of
+    the store if they are changed afterwards. The PSFs of each instrument aperture and source offset are
+    stored as one stack of images, so a DataError is raised if they are not all the same shape.
+
+    Parameters
+    ----------
+    path: string
+        Path to the PSF library
+    dtype: string or None
+        Data type in which to store the PSF images. If None, the data type of the PSF FITS images is used.
+    wave_unit: string
+        Wavelength unit used by PSF library (default: m)
+
+    Returns
+    -------
+    index: dict
+        Index of the store as written to psf_store_index
+    """
+    library = PSFLibrary(path=path, lazy=True, store=False)
+    if dtype is None:
+        dtypes = [psf['int'].dtype for psf in library._psfs]
+        dtype = np.result_type(*dtypes) if len(dtypes) > 0 else np.float32
+    dtype = np.dtype(dtype).newbyteorder('<')
+
+    index = {
+        'version': psf_store_version,
+        'dtype': dtype.str,
+        'groups': []
+    }
+
+    # each group is stored as a single stack of images, which needs them to be the same shape
+    for key in sorted(library._index):
+        shapes = set(library._psfs[i]['int'].shape for i in library._index[key]['ids'])
+        if len(shapes) > 1:
+            msg = "PSFs for %s aperture %s at offset %s differ in shape %s and can not be packed." % (
+                key[0], key[1], key[2], sorted(shapes)
+            )
+            raise DataError(value=msg)
+
+    # write to temporary files first so that a library being read in the meantime is never inconsistent
+    data_file = os.path.join(path, psf_store_data)
+    index_file = os.path.join(path, psf_store_index)
+    with open(data_file + '.tmp', 'wb') as f:
+        offset = 0
+        for key in sorted(library._index):
+            ids = library._index[key]['ids']
+            stack = np.stack([library._psfs[i]['int'] for i in ids]).astype(dtype)
+            stack.tofile(f)
+            group = {
+                'instrument': key[0],
+                'aperture_name': key[1],
+                'source_offset': list(key[2]),
+                'offset': offset,
+                'shape': list(stack.shape),
+                'entries': [
+                    {
+                        'file': os.path.basename(library._psfs[i].filename),
+                        'mtime': os.path.getmtime(library._psfs[i].filename),
+                        'wave': library._psfs[i]['wave'],
+                        'pix_scl': library._psfs[i]['pix_scl'],
+                        'diff_limit': library._psfs[i]['diff_limit'],
+                        'upsamp': library._psfs[i]['upsamp']
+                    } for i in ids
+                ]
+            }
+            index['groups'].append(group)
+            offset += stack.nbytes
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+
+    os.rename(data_file + '.tmp', data_file)
+    os.rename(index_file + '.tmp', index_file)
+
+    return index
+
+
+def main(argv=None):
+    """
+    Command-line interface to pack_psf_library(), e.g.:
+        python -m pandeia.engine.psf_library $pandeia_refdata/jwst/*/psfs
+    """
+    parser = argparse.ArgumentParser(description="Pack PSF library directories into memory-mappable stores")
+    parser.add_argument('paths', nargs='+', help="PSF library directories, e.g. $pandeia_refdata/jwst/nircam/psfs")
+    parser.add_argument('--dtype', default=None,
+                        help="data type of the stored PSF images (default: that of the PSF files)")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        index = pack_psf_library(path, dtype=args.dtype)
+        npsfs = sum(len(group['entries']) for group in index['groups'])
+        sys.stdout.write("%s: packed %d PSFs in %d groups\n" % (path, npsfs, len(index['groups'])))
+
+
+if __name__ == "__main__":
+    main()
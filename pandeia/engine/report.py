@@ -12,6 +12,82 @@ from six.moves import range
 from six.moves import zip
 
 
+def get_wave_pix(signal, wavelength):
+    """
+    Get the wavelength sampling of the report products, i.e. the wavelengths that go with the S/N curve.
+
+    Parameters
+    ----------
+    signal: etc3D.DetectorSignal or etc3D.CombinedSignal instance
+        Signal of the reported calculation
+    wavelength: np.ndarray
+        Wavelengths of the products extracted by the strategy
+
+    Returns
+    -------
+    wave_pix: np.ndarray
+        Wavelength of each product
+    """
+    if signal.projection_type == 'image':
+        # this is the wavelength sampling on the detector. in imaging mode this is
+        # the effective wavelength of the filter + detector + optics
+        wave_pix = signal.wave_pix  # convert to real np.array of len = 1
+    else:
+        # this is the wavelength sampling on the detector.
+        wave_pix = wavelength  # this is already a 1D np.array
+        if signal.projection_type == 'slitless' and signal.dispersion_axis == 'y':
+            # the products are rotated to our normal axis orientation, see Report.
+            wave_pix = wave_pix[::-1]
+    return wave_pix
+
+
+def get_reference_index(strategy_input, wave_pix, warnings=None):
+    """
+    Get the index into wave_pix of the reference wavelength at which the scalar products are reported.
+
+    Parameters
+    ----------
+    strategy_input: dict
+        Engine API format strategy configuration
+    wave_pix: np.ndarray
+        Wavelength of each product, see get_wave_pix()
+    warnings: dict or None
+        If given, a warning is added when the configured reference wavelength is out of range
+
+    Returns
+    -------
+    wave_index: int
+        Index of the reference wavelength
+    """
+    if strategy_input['method'] in [
+        'soss',
+        'specapphot',
+        'msafullapphot',
+        'ifuapphot',
+        'ifunodinscene',
+        'ifunodoffscene'
+    ]:
+        wave_index = int(len(wave_pix) / 2.0)
+        if 'reference_wavelength' in strategy_input:
+            wref = strategy_input['reference_wavelength']
+            if wref is not None:
+                if wref >= wave_pix.min() and wref <= wave_pix.max():
+                    wave_index = (np.abs(wave_pix - wref)).argmin()
+                elif warnings is not None:
+                    warnings['bad_waveref'] = "Specified wavelength, %f, out of range [%f, %f]. " % (
+                        wref,
+                        wave_pix.min(),
+                        wave_pix.max()
+                    )
+                    warnings['bad_waveref'] += "Using %f to select diagnostic planes instead." % (
+                        float(wave_pix[wave_index])
+                    )
+
+    if strategy_input['method'] in ['imagingapphot', 'coronagraphy', 'tacentroid', 'taphot']:
+        wave_index = 0
+    return wave_index
+
+
 class Report(object):
 
     """
@@ -145,17 +221,11 @@ class Report(object):
 
         # Values calculated by the strategy
         sn = extracted['extracted_flux'] / extracted['extracted_noise']
-        if self.signal.projection_type == 'image':
-            # this is the wavelength sampling on the detector. in imaging mode this is
-            # the effective wavelength of the filter + detector + optics
-            self.wave_pix = self.signal.wave_pix  # convert to real np.array of len = 1
-        elif self.signal.projection_type == 'spec':
-            # this is the wavelength sampling on the detector.
-            self.wave_pix = extracted['wavelength']  # this is already a 1D np.array
+        self.wave_pix = get_wave_pix(self.signal, extracted['wavelength'])
+        if self.signal.projection_type == 'spec':
             self.cube_signal, self.cube_noise, self.cube_saturation, self.cube_plane_grid = extracted['reconstructed']
             self.cube_sim = self.cube_signal + self.cube_noise * np.random.randn(*self.cube_noise.shape)
         elif self.signal.projection_type == 'slitless':
-            self.wave_pix = extracted['wavelength']
             self.detector_sn_unrot = self.detector_sn
             self.detector_signal_unrot = self.detector_signal
             self.saturation_unrot = self.saturation
@@ -163,19 +233,17 @@ class Report(object):
                 # need to rotate these 90 deg clockwise to match our normal axis orientation. np.rot90 only works CCW
                 # so need to flip, rotate, and then flip back. note that currently this case implies that dispersion
                 # axis is 90 degrees.
-                self.wave_pix = self.wave_pix[::-1]
                 self.detector_sn = np.flipud(np.rot90(np.flipud(self.detector_sn)))
                 self.detector_signal = np.flipud(np.rot90(np.flipud(self.detector_signal)))
                 self.saturation = np.flipud(np.rot90(np.flipud(self.saturation)))
         elif self.signal.projection_type == 'multiorder':
-            self.wave_pix = extracted['wavelength']
             self.detector_sn_unrot = self.detector_sn
             self.detector_signal_unrot = self.detector_signal
             self.saturation_unrot = self.saturation
             self.detector_sn = np.rot90(self.detector_sn)
             self.detector_signal = np.rot90(self.detector_signal)
             self.saturation = np.rot90(self.saturation)
-        else:
+        elif self.signal.projection_type != 'image':
             raise EngineOutputError(value="Unsupported projection_type: %s" % self.signal.projection_type)
 
         sn_curve = [self.wave_pix, sn]
@@ -206,6 +274,30 @@ class Report(object):
 
         self.warnings = warnings
 
+    def get_reference_index(self):
+        """
+        Get the index into self.wave_pix of the reference wavelength at which the scalar products are reported.
+
+        Returns
+        -------
+        wave_index: int
+            Index of the reference wavelength
+        """
+        return get_reference_index(self.input['strategy'], self.wave_pix, warnings=self.warnings)
+
+    def get_reference_sn(self):
+        """
+        Get the S/N at the reference wavelength. This is the value reported as as_dict()['scalar']['sn'].
+
+        Returns
+        -------
+        sn: float
+            S/N at the reference wavelength
+        """
+        # if there's a detector gap, the noise is 0 and sn goes to np.inf. fix that here.
+        sn = ma.fix_invalid(self.curves['sn'][1], fill_value=0.0).data
+        return float(sn[self.get_reference_index()])
+
     def as_dict(self):
         """
         Produce report in dictionary format conformant with the engine API.
@@ -258,32 +350,7 @@ class Report(object):
         # may still contain a NaN.
         sn = ma.fix_invalid(self.curves['sn'][1], fill_value=0.0).data
 
-        if self.input['strategy']['method'] in [
-            'soss',
-            'specapphot',
-            'msafullapphot',
-            'ifuapphot',
-            'ifunodinscene',
-            'ifunodoffscene'
-        ]:
-            wave_index = int(len(self.wave_pix) / 2.0)
-            if 'reference_wavelength' in self.input['strategy']:
-                wref = self.input['strategy']['reference_wavelength']
-                if wref is not None:
-                    if wref >= self.wave_pix.min() and wref <= self.wave_pix.max():
-                        wave_index = (np.abs(self.wave_pix - wref)).argmin()
-                    else:
-                        self.warnings['bad_waveref'] = "Specified wavelength, %f, out of range [%f, %f]. " % (
-                            wref,
-                            self.wave_pix.min(),
-                            self.wave_pix.max()
-                        )
-                        self.warnings['bad_waveref'] += "Using %f to select diagnostic planes instead." % (
-                            float(self.wave_pix[wave_index])
-                        )
-
-        if self.input['strategy']['method'] in ['imagingapphot', 'coronagraphy', 'tacentroid', 'taphot']:
-            wave_index = 0
+        wave_index = self.get_reference_index()
 
         # the 3D data products
         r['3d'] = {}
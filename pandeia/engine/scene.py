@@ -2,6 +2,8 @@
 
 from __future__ import division, absolute_import
 
+import copy
+
 import numpy as np
 
 from . import source as src
@@ -31,6 +33,8 @@ class Scene(object):
     -------
     offset(x=<float, default 0.0>, y=<float, default 0.0>) :
         Apply x and/or y offset to all sources in scene
+    offset_copy(dither) :
+        Get a copy of the scene with an offset applied to all sources
     get_size():
         Get the full extent of the scene.
     """
@@ -129,6 +133,30 @@ class Scene(object):
                 }
             )
 
+    def offset_copy(self, dither):
+        """
+        Get a copy of the Scene with an offset applied to all of its sources. Only the Scene, its
+        sources, and their positions are copied; the rest of the source configurations are shared.
+
+        Parameters
+        ----------
+        dither : dict - {'x': x, 'y': y}
+            Offset to apply. See offset().
+
+        Returns
+        -------
+        scene : Scene instance
+            Offset copy of the Scene
+        """
+        scene = copy.copy(self)
+        scene.sources = []
+        for s in self.sources:
+            new_source = copy.copy(s)
+            new_source.position = dict(s.position)
+            scene.sources.append(new_source)
+        scene.offset(dither)
+        return scene
+
     def rotate(self, angle=0.0):
         """
         Apply a rotation to the Scene
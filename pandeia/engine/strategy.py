@@ -170,58 +170,53 @@ class Strategy(DefaultConfig):
         config = merge_data(strat_config, inst_config)
         return config
 
-    def _create_covariance_matrix(self, my_detector_signal, my_detector_noise, subscripts=None):
+    def _read_noise_correlation(self, my_detector_signal, subscripts):
         """
-        The covariance matrix. It no longer uses scipy sparse matrix functionality because it was found
-        to be highly inefficient for the sizes of matrices encountered. Future strategies can overload
-        this if they do require that functionality. Correlated noise can be passed as a correlation matrix
-        that can be rearranged into off-diagonals.
+        Arrange the read noise correlation matrix into a pixel-to-pixel matrix for a set of pixels.
+        Row i holds the correlation of every pixel with pixel i. The diagonal is left at 0 since it
+        is replaced by the total variance in the covariance matrix.
 
         Parameters
         ----------
         my_detector_signal : DetectorSignal class
-        my_detector_noise : DetectorNoise class
-        subscripts : list of subscript tuples
-                     Oftentimes, only a small number of pixels are considered for a single product
-                     calculation. In this case, the caller can pass a list of subscripts so that the
-                     eventual matrix product does not have to sum over a large amount of 0s.
+        subscripts : subscript tuple
+                     The pixels to correlate
 
         Returns
         -------
-        c_ij : numpy.ndarray
-               The pixel-to-pixel correlation matrix.
+        r_ij : numpy.ndarray
+               The pixel-to-pixel read noise correlation matrix.
         """
+        nn = len(subscripts[0])
+        r_ij = np.zeros((nn, nn))
 
-        if subscripts is None:
-            subscripts = np.indices(my_detector_noise.var_pix.shape)
+        # Half of the correlation matrix size
+        ncorr = int((my_detector_signal.read_noise_correlation_matrix.shape[0] - 1) / 2)
 
-        diagonal = my_detector_noise.var_pix[subscripts].ravel()
-        diagonal_rn = my_detector_noise.var_rn_pix[subscripts].ravel()
+        for i in range(nn):
+            correlation_subscripts = (subscripts[0] - subscripts[0][i] + ncorr,
+                                      subscripts[1] - subscripts[1][i] + ncorr)
+            r_ij[i, :] = my_detector_signal.read_noise_correlation_matrix[correlation_subscripts]
+            r_ij[i, i] = 0.0
 
-        nn = diagonal.shape[0]
+        return r_ij
 
-        if my_detector_signal.calculation_config.noise['rn_correlation'] and my_detector_signal.det_pars['rn_correlation']:
-            c_ij = np.zeros((nn, nn))
-            # handle correlated readnoise by arranging the correlation matrix into the
-            # off-diagonals of the covariance matrix
-
-            # Half of the correlation matrix size
-            ncorr = int((my_detector_signal.read_noise_correlation_matrix.shape[0] - 1) / 2)
-
-            for i in range(nn):
-                correlation_subscripts = (subscripts[0] - subscripts[0][i] + ncorr,
-                                          subscripts[1] - subscripts[1][i] + ncorr)
-                # Correlated read noise is only ...emm... correlated with the read noise
-                c_ij[i, :] = my_detector_signal.read_noise_correlation_matrix[correlation_subscripts] * diagonal_rn[i]
-
-                # Then replace diagonal with the total variance
-                c_ij[i, i] = diagonal[i]
+    def _correlated_noise(self, my_detector_signal):
+        """
+        Check whether the pixel noise is correlated, i.e. whether the covariance matrix has off-diagonal terms.
+        This is the case if correlated read noise is enabled and the detector has it.
 
-        else:
-            # no correlated read noise
-            c_ij = np.diagflat(diagonal)
+        Parameters
+        ----------
+        my_detector_signal : DetectorSignal class
 
-        return c_ij
+        Returns
+        -------
+        correlated : bool
+        """
+        correlated = bool(my_detector_signal.calculation_config.noise['rn_correlation'] and
+                          my_detector_signal.det_pars['rn_correlation'])
+        return correlated
 
     def extract(self, my_detector_signal_list, my_detector_noise_list):
         """
@@ -314,81 +309,78 @@ class Strategy(DefaultConfig):
         exposure_products : A single product dictionary
         """
 
-        flux_products = []
-        flux_plus_bg_products = []
-        sigma_products = []
-        bg_only_products = []
-        bg_plus_contamination_products = []
-        full_saturation_products = []
-        partial_saturation_products = []
+        nproducts = len(product_subscripts)
+        flux_products = np.zeros(nproducts)
+        flux_plus_bg_products = np.zeros(nproducts)
+        sigma_products = np.zeros(nproducts)
+        bg_only_products = np.zeros(nproducts)
+        bg_plus_contamination_products = np.zeros(nproducts)
+        full_saturation_products = np.zeros(nproducts, dtype=int)
+        partial_saturation_products = np.zeros(nproducts, dtype=int)
 
         # get the saturation mask
         saturation_mask = my_detector_signal.get_saturation_mask()
-        
-        # the covariance matrix is the same row-wise at every step, but scaled by the variance along
-        # the diagonal. utilize this to initialize the matrix once and then simply scale it from there.
-        init_var = my_detector_noise.var_pix[product_subscripts[0]].ravel()
-        c_ij_init = self._create_covariance_matrix(
-            my_detector_signal,
-            my_detector_noise,
-            subscripts=product_subscripts[0]
-        )
-        # create normalized covariance matrix
-        c_ij_norm = c_ij_init / init_var.reshape(len(init_var), 1)
-        for product_subscript in product_subscripts:
-            a_ij_raveled = a_ij[product_subscript]
-
-            # make weight map of only the background region for measuring background+contamination.
-            # if self.background_subtraction is False, this will be all zeroes.
-            a_ij_bg_raveled = a_ij[product_subscript]
-            a_ij_bg_raveled[a_ij_bg_raveled > 0] = 0
-            a_ij_bg_raveled *= -1.0
 
-            # scale the covariance matrix by the current variance
-            diagonal = my_detector_noise.var_pix[product_subscript].ravel()
+        rate = np.asarray(my_detector_signal.rate)
+        rate_plus_bg = np.asarray(my_detector_signal.rate_plus_bg)
 
-            # reshape diagonal to do row-wise scaling
-            c_ij = c_ij_norm * diagonal.reshape(len(diagonal), 1)
+        # the products are evaluated together, one row per product, in batches of products that have the
+        # same number of pixels. normally that is all of them.
+        for noise_batch in self._noise_batches(a_ij, product_subscripts, my_detector_signal):
+            batch = noise_batch['products']
+            rows, cols = noise_batch['pixels']
+            a = noise_batch['weights']
 
-            # this is equivalent to the matrix operation A_ij * C_ij * A_ij.T
-            var_product = np.dot(np.dot(a_ij_raveled, c_ij), a_ij_raveled.transpose())
+            # make weight map of only the background region for measuring background+contamination.
+            # if self.background_subtraction is False, this will be all zeroes.
+            a_bg = np.where(a < 0, -a, 0.0)
+
+            # this is equivalent to the matrix operation A_ij * C_ij * A_ij.T for each product, with C_ij the
+            # normalized covariance matrix scaled row-wise by the current variance
+            diagonal = my_detector_noise.var_pix[rows, cols]
+            if noise_batch['correlation'] is not None:
+                covariance_pixels = noise_batch['covariance_pixels']
+                c_ij_norm = self._normalized_covariance(
+                    noise_batch['correlation'],
+                    my_detector_noise.var_pix[covariance_pixels],
+                    my_detector_noise.var_rn_pix[covariance_pixels]
+                )
+                var_product = np.einsum('ki,ki->k', np.dot(a * diagonal, c_ij_norm), a)
+            else:
+                # without correlated noise the covariance matrix is diagonal, so A_ij * C_ij * A_ij.T is just the
+                # variance-weighted sum of the squared weights and no matrix is needed.
+                var_product = np.einsum('ki,ki,ki->k', a, a, diagonal)
 
             # extract flux with and without sky background included
-            flux_product = a_ij_raveled.dot(np.matrix(my_detector_signal.rate[product_subscript]).transpose())
-            flux_plus_bg_product = a_ij_raveled.dot(np.matrix(my_detector_signal.rate_plus_bg[product_subscript]).transpose())
+            src_rate = rate[rows, cols]
+            src_rate_plus_bg = rate_plus_bg[rows, cols]
+            flux_product = np.einsum('ki,ki->k', a, src_rate)
+            flux_plus_bg_product = np.einsum('ki,ki->k', a, src_rate_plus_bg)
 
             # calculate the sky background rate for measuring contamination
-            bg_rate = np.matrix(my_detector_signal.rate_plus_bg[product_subscript] - my_detector_signal.rate[product_subscript])
+            bg_rate = src_rate_plus_bg - src_rate
 
             # if self.background_subtraction is True, we need to use the background-only weight map otherwise
             # we'll subtract background from itself. if self.background_subtraction is False, then we use the normal
             # weight map to get the sky background flux within the extraction aperture. in that case, sky subtraction
             # is treated as ideal and noiseless.
             if self.background_subtraction:
-                bg_only = a_ij_bg_raveled.dot(bg_rate.transpose())
-                bg_plus_contamination = a_ij_bg_raveled.dot(
-                    np.matrix(
-                        my_detector_signal.rate_plus_bg[product_subscript]
-                    ).transpose()
-                )
+                bg_only = np.einsum('ki,ki->k', a_bg, bg_rate)
+                bg_plus_contamination = np.einsum('ki,ki->k', a_bg, src_rate_plus_bg)
             else:
-                bg_only = a_ij_raveled.dot(bg_rate.transpose())
+                bg_only = np.einsum('ki,ki->k', a, bg_rate)
                 bg_plus_contamination = bg_only
 
             # count how many pixels have full and partial saturation
-            nsaturated_full = np.sum(saturation_mask[product_subscript] == 2)
-            nsaturated_partial = np.sum(saturation_mask[product_subscript] == 1)
-            nsaturated = {'partial':nsaturated_partial,'full':nsaturated_full}
-
-            sigma_products.append(np.sqrt(var_product.item()))
-            flux_products.append(flux_product.item())
-            flux_plus_bg_products.append(flux_plus_bg_product.item())
-            bg_only_products.append(bg_only.item())
-            bg_plus_contamination_products.append(bg_plus_contamination.item())
-            full_saturation_products.append(nsaturated_full)
-            partial_saturation_products.append(nsaturated_partial)
-            
-        
+            saturation = saturation_mask[rows, cols]
+
+            sigma_products[batch] = np.sqrt(var_product)
+            flux_products[batch] = flux_product
+            flux_plus_bg_products[batch] = flux_plus_bg_product
+            bg_only_products[batch] = bg_only
+            bg_plus_contamination_products[batch] = bg_plus_contamination
+            full_saturation_products[batch] = np.sum(saturation == 2, axis=1)
+            partial_saturation_products[batch] = np.sum(saturation == 1, axis=1)
 
         # Image mode:
         if len(product_subscripts) == 1:
@@ -404,35 +396,171 @@ class Strategy(DefaultConfig):
                 flux_tots = my_detector_signal.rate.sum(axis=1)
                 flux_plus_bg_tots = my_detector_signal.rate_plus_bg.sum(axis=1)
 
-        # if projection_type is multiorder, then we need to use the configured order for the strategy
-        # to get the right wavelength solution.
-        if my_detector_signal.projection_type == 'multiorder':
-            wave_pix = my_detector_signal.wave_pix_list[self.order-1]
-        else:
-            wave_pix = my_detector_signal.wave_pix
-
         exposure_products = {
             'detector_signal': my_detector_signal.rate_plus_bg,
             'detector_noise': my_detector_noise.stdev_pix,
-            'wavelength': wave_pix,
-            'extracted_flux_plus_bg': np.array(flux_plus_bg_products),
-            'extracted_flux': np.array(flux_products),
-            'extracted_bg_total': np.array(bg_plus_contamination_products),
-            'extracted_bg_only': np.array(bg_only_products),
+            'wavelength': self.get_wave_pix(my_detector_signal),
+            'extracted_flux_plus_bg': flux_plus_bg_products,
+            'extracted_flux': flux_products,
+            'extracted_bg_total': bg_plus_contamination_products,
+            'extracted_bg_only': bg_only_products,
             'source_flux_in_fov': flux_tots,
             'source_flux_in_fov_plus_bg': flux_plus_bg_tots,
-            'extracted_noise': np.array(sigma_products),
+            'extracted_noise': sigma_products,
             'reconstructed': self.reconstruct_cube(my_detector_signal, my_detector_noise),
             'plane_grid': self.get_plane_grid(my_detector_signal),
             'extraction_area': self.extraction_area,
             'background_area': self.background_area,
             'saturation_products': {
-                'full':np.array(full_saturation_products),
-                'partial':np.array(partial_saturation_products)
+                'full':full_saturation_products,
+                'partial':partial_saturation_products
             }
         }
         return exposure_products
 
+    def reference_product(self, my_detector_signal_list, my_detector_noise_list, index):
+        """
+        Get how one product is extracted from each dither, e.g. for the exposure time solver to calculate its
+        noise for other readout patterns. This is the same as in extract() and _error_sum(), see _noise_batches().
+
+        Parameters
+        ----------
+        my_detector_signal_list : List of DetectorSignal instances
+        my_detector_noise_list : List of DetectorNoise instances
+        index : int
+            Index of the product
+
+        Returns
+        -------
+        products : list of dict, one per dither
+            dither_weight - weight of the dither when the exposures are added, see _add_exposure_products()
+            weights - 1D numpy.ndarray of the weights of the product's pixels
+            pixels - subscript tuple of the product's pixels
+            covariance_pixels - subscript tuple of the pixels whose covariance matrix, normalized row-wise by
+                                their variance, is used for the product (see _normalized_covariance()), or None
+                                if the read noise is not correlated
+            correlation - read noise correlation matrix of covariance_pixels, or None if the read noise is not
+                          correlated
+        """
+        a_ij_list, product_subscripts_list = self._create_weight_matrix(my_detector_signal_list, my_detector_noise_list)
+        if isinstance(a_ij_list, list):
+            dither_weights = self.dither_weights
+        else:
+            a_ij_list = [a_ij_list]
+            product_subscripts_list = [product_subscripts_list]
+            dither_weights = [1.0]
+
+        products = []
+        for dither_weight, my_detector_signal, a_ij, product_subscripts in zip(
+                dither_weights, my_detector_signal_list, a_ij_list, product_subscripts_list):
+            for noise_batch in self._noise_batches(a_ij, product_subscripts, my_detector_signal):
+                k = np.flatnonzero(noise_batch['products'] == index)
+                if len(k) > 0:
+                    break
+            k = k[0]
+            products.append({
+                'dither_weight': dither_weight,
+                'weights': noise_batch['weights'][k],
+                'pixels': tuple(p[k] for p in noise_batch['pixels']),
+                'covariance_pixels': noise_batch['covariance_pixels'],
+                'correlation': noise_batch['correlation']
+            })
+        return products
+
+    def _noise_batches(self, a_ij, product_subscripts, my_detector_signal):
+        """
+        Set up how the noise of the products is extracted. The products are extracted in batches of products
+        that have the same number of pixels, one row per product. With correlated read noise, the covariance
+        matrix is the same row-wise for every product in a batch, but scaled by the variance along the diagonal.
+        Each batch therefore uses the covariance matrix of its first product normalized row-wise by its variance,
+        see _normalized_covariance().
+
+        Parameters
+        ----------
+        a_ij : numpy matrix
+        product_subscripts : list of subscript tuples
+        my_detector_signal : DetectorSignal instance
+
+        Returns
+        -------
+        batches : list of dict
+            products - indices of the products in the batch
+            weights - 2D numpy.ndarray of the weights of each product's pixels
+            pixels - (rows, cols) tuple of 2D subscript arrays of each product's pixels
+            covariance_pixels - subscript tuple of the pixels whose covariance matrix the batch uses, or None
+                                if the read noise is not correlated
+            correlation - read noise correlation matrix of covariance_pixels (see _read_noise_correlation()),
+                          or None if the read noise is not correlated
+        """
+        correlated = self._correlated_noise(my_detector_signal)
+        a_ij = np.asarray(a_ij)
+
+        batches = []
+        for batch, (rows, cols) in self._stack_subscripts(product_subscripts):
+            covariance_pixels = None
+            correlation = None
+            if correlated:
+                covariance_pixels = (rows[0], cols[0])
+                correlation = self._read_noise_correlation(my_detector_signal, covariance_pixels)
+            batches.append({
+                'products': batch,
+                'weights': a_ij[rows, cols],
+                'pixels': (rows, cols),
+                'covariance_pixels': covariance_pixels,
+                'correlation': correlation
+            })
+        return batches
+
+    def _normalized_covariance(self, correlation, var, var_rn):
+        """
+        The covariance matrix of a set of pixels divided row-wise by the variance of each pixel. Correlated read
+        noise is only correlated with the read noise, so the off-diagonals are the read noise correlation matrix
+        scaled row-wise by the read noise variance. The diagonal is the total variance.
+
+        Parameters
+        ----------
+        correlation : numpy.ndarray
+            Read noise correlation matrix of the pixels, see _read_noise_correlation()
+        var : 1D numpy.ndarray
+            Total variance of the pixels
+        var_rn : 1D numpy.ndarray
+            Read noise variance of the pixels
+
+        Returns
+        -------
+        c_ij_norm : numpy.ndarray
+               The normalized pixel-to-pixel covariance matrix.
+        """
+        c_ij_init = correlation * var_rn.reshape(-1, 1)
+        np.fill_diagonal(c_ij_init, var)
+        c_ij_norm = c_ij_init / var.reshape(len(var), 1)
+        return c_ij_norm
+
+    def _stack_subscripts(self, product_subscripts):
+        """
+        Group the product subscripts by number of pixels and stack each group into 2D subscript arrays
+        with one row per product, so that the products in a group can be extracted together.
+
+        Parameters
+        ----------
+        product_subscripts : list of subscript tuples
+
+        Returns
+        -------
+        batches : list of (batch, (rows, cols)) tuples
+            batch holds the indices of the products in the group, rows and cols the stacked subscripts
+        """
+        groups = {}
+        for i, subscript in enumerate(product_subscripts):
+            groups.setdefault(len(subscript[0]), []).append(i)
+
+        batches = []
+        for batch in groups.values():
+            rows = np.array([product_subscripts[i][0] for i in batch], dtype=np.intp)
+            cols = np.array([product_subscripts[i][1] for i in batch], dtype=np.intp)
+            batches.append((np.array(batch), (rows, cols)))
+        return batches
+
     def _add_exposure_products(self, exposure_products_list):
         """
         This private method adds products from multiple exposures/dithers in a sensible manner. The key
@@ -623,6 +751,27 @@ class Strategy(DefaultConfig):
 
         return cube_signal, cube_noise, cube_saturation, plane_grid
 
+    def get_wave_pix(self, my_detector_signal):
+        """
+        Get the wavelength of each extracted product.
+
+        Parameters
+        ----------
+        my_detector_signal : DetectorSignal instance
+
+        Returns
+        -------
+        wave_pix : numpy.ndarray
+            The wavelengths.
+        """
+        # if projection_type is multiorder, then we need to use the configured order for the strategy
+        # to get the right wavelength solution.
+        if my_detector_signal.projection_type == 'multiorder':
+            wave_pix = my_detector_signal.wave_pix_list[self.order-1]
+        else:
+            wave_pix = my_detector_signal.wave_pix
+        return wave_pix
+
     def get_plane_grid(self, my_detector_signal):
         """
         Create the spatial grid. A key application of this (general) method is to construct a spatial
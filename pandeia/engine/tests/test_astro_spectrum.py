@@ -0,0 +1,216 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import numpy as np
+
+import pytest
+
+from ..astro_spectrum import ConvolvedSceneCube, ModelSceneCube
+from ..coords import Grid
+from ..psf_library import PSFLibrary
+from .. import fft_utils
+from .test_psf_library import write_library
+
+
+class Namespace(object):
+
+    """
+    Plain object to hang the attributes that the code under test uses on
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+@pytest.fixture(scope='module')
+def psf_library(tmpdir_factory):
+    """
+    PSF library of Gaussian PSFs that widen with wavelength
+    """
+    path = tmpdir_factory.mktemp('psfs')
+    write_library(path)
+    return PSFLibrary(path=str(path), aperture='s200a1', store=False)
+
+
+def make_cube(psf_library, sources, convolution, nslice=1, aperture=(None, None), multishutter=None, nw=60,
+              seed=5, build_flux_plus_bg=True):
+    """
+    Build a ConvolvedSceneCube without reference data
+
+    Parameters
+    ----------
+    psf_library: PSFLibrary instance
+        Library to convolve with
+    sources: list of tuples (str, float, float)
+        Geometry and x and y offsets of each source
+    convolution: dict
+        Convolution settings as in CalculationConfig
+    nslice: int
+        Number of aperture slices
+    aperture: tuple
+        Aperture width and height
+    multishutter: list or None
+        Shutter offsets
+    nw: int
+        Number of wavelength planes
+    seed: int
+        Seed of the random source spectra and background
+    build_flux_plus_bg: bool
+        Build the flux cubes including background along with the flux cubes
+
+    Returns
+    -------
+    cube, background: ConvolvedSceneCube instance, Namespace
+    """
+    rng = np.random.RandomState(seed)
+    cube = object.__new__(ConvolvedSceneCube)
+    cube.psf_library = psf_library
+    cube.convolution = convolution
+    cube.build_flux_plus_bg = build_flux_plus_bg
+    cube.instrument = Namespace(get_name=lambda: 'nirspec', get_aperture=lambda: 's200a1')
+    cube.fov_size = 2.0
+    cube.nslice = nslice
+    cube.aper_width, cube.aper_height = aperture
+    cube.multishutter = multishutter
+    cube.wave = np.linspace(1.0, 3.0, nw)
+    cube.nw = nw
+    cube.source_spectra = []
+    for geometry, x_offset, y_offset in sources:
+        src = Namespace(position={'x_offset': x_offset, 'y_offset': y_offset, 'orientation': 20.},
+                        shape={'geometry': geometry, 'major': 0.1, 'minor': 0.05})
+        cube.source_spectra.append(Namespace(src=src, wave=cube.wave, flux=rng.uniform(size=nw) + 1))
+    cube.scene = Namespace(sources=[spectrum.src for spectrum in cube.source_spectra])
+    background = Namespace(mjy_pix=rng.uniform(size=nw))
+    return cube, background
+
+
+def assert_cubes_match(result, expected, rtol):
+    """
+    Compare the apertures and the flux cubes, with and without background, of two create_flux_cube() results
+    """
+    assert result[1] == expected[1]
+    for cube, expected_cube in zip(result[2] + result[3], expected[2] + expected[3]):
+        assert cube.shape == expected_cube.shape
+        assert cube.dtype == expected_cube.dtype
+        assert np.abs(cube - expected_cube).max() <= rtol * np.abs(expected_cube).max()
+
+
+def flux_cubes(psf_library, monkeypatch, method, **kwargs):
+    """
+    Calculate the flux cubes with the convolution option for the given method on, checking that it is used, and
+    with both options off
+    """
+    calls = []
+    original = getattr(ConvolvedSceneCube, method)
+
+    def spy(self, *args):
+        calls.append(method)
+        return original(self, *args)
+
+    monkeypatch.setattr(ConvolvedSceneCube, method, spy)
+    on = {'separable': method == '_create_separable_flux_cube',
+          'batched': method == '_create_batched_flux_cube', 'max_memory': 4}
+    cube, background = make_cube(psf_library, convolution=on, **kwargs)
+    result = cube.create_flux_cube(background=background)
+    assert calls == [method]
+    off = {'separable': False, 'batched': False, 'max_memory': 4}
+    cube, background = make_cube(psf_library, convolution=off, **kwargs)
+    expected = cube.create_flux_cube(background=background)
+    return result, expected
+
+
+@pytest.mark.parametrize('sources, nslice, aperture, multishutter', [
+    ([('point', 0., 0.)], 1, (None, None), None),
+    ([('point', 0.1, 0.05), ('gaussian2d', -0.2, 0.3)], 1, (None, None), None),
+    ([('point', 0.1, 0.05), ('gaussian2d', -0.2, 0.3)], 3, (0.2, 1.0), None),
+    ([('point', 0., 0.)], 1, (0.2, 0.4), [(0., 0.), (0., 0.5)]),
+])
+def test_separable_flux_cube(psf_library, monkeypatch, sources, nslice, aperture, multishutter):
+    """
+    Convolving each source with the library PSFs and interpolating afterwards has to give the same cubes as
+    convolving each plane with its interpolated PSF
+    """
+    result, expected = flux_cubes(psf_library, monkeypatch, '_create_separable_flux_cube', sources=sources,
+                                  nslice=nslice, aperture=aperture, multishutter=multishutter)
+    assert_cubes_match(result, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize('nslice, aperture, central', [
+    (1, (None, None), False),
+    (3, (0.2, 1.0), False),
+    (1, (None, None), True),
+])
+def test_batched_flux_cube(psf_library, monkeypatch, nslice, aperture, central):
+    """
+    Convolving batches of planes has to give the same cubes as convolving each plane on its own. There are
+    more pairs of source and library PSF than planes, so the cubes are not built per library PSF, and the
+    memory budget is small enough to need several batches.
+    """
+    rng = np.random.RandomState(7)
+    if central:
+        sources = [('point', 0., 0.)] * 20
+    else:
+        sources = [(['point', 'gaussian2d'][i % 2], ) + tuple(rng.uniform(-0.5, 0.5, 2)) for i in range(20)]
+    result, expected = flux_cubes(psf_library, monkeypatch, '_create_batched_flux_cube', sources=sources,
+                                  nslice=nslice, aperture=aperture)
+    assert_cubes_match(result, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_lazy_flux_plus_bg(psf_library, batched):
+    """
+    Without build_flux_plus_bg, no flux cubes including background are built with the flux cubes, and
+    flux_plus_bg_list builds them from the flux cubes and background masks
+    """
+    sources = [('point', 0.1, 0.05), ('gaussian2d', -0.2, 0.3)]
+    convolution = {'separable': batched, 'batched': batched, 'max_memory': 4}
+    cube, background = make_cube(psf_library, sources, convolution, nslice=3, aperture=(0.2, 1.0))
+    expected = cube.create_flux_cube(background=background)
+    cube, background = make_cube(psf_library, sources, convolution, nslice=3, aperture=(0.2, 1.0),
+                                 build_flux_plus_bg=False)
+    result = cube.create_flux_cube(background=background)
+    assert result[3] is None
+    for flux_cube, expected_cube in zip(result[2], expected[2]):
+        np.testing.assert_array_equal(flux_cube, expected_cube)
+
+    cube.flux_cube_list, cube._flux_plus_bg_list = result[2], result[3]
+    for flux_plus_bg, expected_cube in zip(cube.flux_plus_bg_list, expected[3]):
+        assert flux_plus_bg.dtype == expected_cube.dtype
+        np.testing.assert_allclose(flux_plus_bg, expected_cube, rtol=1e-6, atol=1e-6 * np.abs(expected_cube).max())
+
+
+def test_default_flux_cube_uses_fft_backend(psf_library, monkeypatch):
+    """
+    The default per-plane convolution has to go through fft_utils, so that the FFTW plans are reused and
+    the wisdom and thread settings apply
+    """
+    calls = []
+    for name in ('fftn', 'ifftn'):
+        original = getattr(fft_utils, name)
+
+        def spy(a, s=None, axes=None, original=original, name=name):
+            calls.append(name)
+            return original(a, s=s, axes=axes)
+
+        monkeypatch.setattr(fft_utils, name, spy)
+
+    cube, background = make_cube(psf_library, [('point', 0.1, 0.05)], {'separable': False, 'batched': False, 'max_memory': 4})
+    cube.create_flux_cube(background=background)
+    assert calls.count('fftn') > 0 and calls.count('ifftn') > 0
+    assert fft_utils._backend['initialized']
+
+
+def test_model_cube_chunks():
+    """
+    Cubes with more than 1000 planes are filled in chunks. Every plane, including plane 1000 where the chunks
+    meet, has to be the source's spatial profile times its flux.
+    """
+    nw = 1201
+    wave = np.linspace(1.0, 3.0, nw)
+    src = Namespace(position={'x_offset': 0.05, 'y_offset': -0.1, 'orientation': 20.},
+                    shape={'geometry': 'gaussian2d', 'major': 0.1, 'minor': 0.05})
+    spectrum = Namespace(src=src, wave=wave, flux=np.random.RandomState(5).uniform(size=nw) + 1)
+    cube = ModelSceneCube([spectrum], Grid(0.02, 0.02, 21, 21))
+    expected = cube.planes[0].reshape(cube.planes[0].shape + (1,)) * spectrum.flux
+    assert cube.int[:, :, 1000].max() > 0
+    np.testing.assert_allclose(cube.int, expected, rtol=1e-6)
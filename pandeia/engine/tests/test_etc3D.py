@@ -0,0 +1,598 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import pytest
+
+from ..etc3D import (DetectorSignal, CombinedSignal, DetectorNoise, ExposureTimeSolver, _set_exposure,
+                     _extract_products, calculate_exposure_time, calculate_sn)
+from ..calc_utils import build_default_calc
+from ..exposure import ExposureSpecification
+from ..instrument import Instrument
+from ..strategy import Strategy
+
+
+class Namespace(object):
+
+    """
+    Plain object to hang the attributes that the code under test uses on
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeInstrument(object):
+
+    """
+    The parts of an Instrument that the readout pattern code uses, without reference data
+    """
+
+    set_exposure_pars = Instrument.set_exposure_pars
+
+    def __init__(self, ngroup=10, nint=1, nexp=1):
+        self.instrument = {'instrument': 'fake'}
+        self.detector = {'ngroup': ngroup, 'nint': nint, 'nexp': nexp}
+        self.exposure_spec = self.get_exposure_pars()
+        self.projection_type = 'spec'
+        self.telescope = Namespace(tel_name='jwst', cr_rate=5., cr_npixels=4)
+
+    def dispersion_axis(self):
+        return 'x'
+
+    def get_exposure_pars(self):
+        return ExposureSpecification('fake', self.detector['ngroup'], self.detector['nint'], self.detector['nexp'],
+                                     10.7)
+
+
+def make_order_signal(instrument, observation, rate, pixels):
+    """
+    Build the DetectorSignal of one order of a multi-order observation from a rate image
+
+    Parameters
+    ----------
+    instrument: FakeInstrument instance
+        The order's own copy of the instrument
+    observation: Namespace
+        The observation the order belongs to
+    rate: 2D np.ndarray
+        Rate image including background
+    pixels: tuple
+        Position of the order on the detector
+
+    Returns
+    -------
+    signal: DetectorSignal instance
+    """
+    signal = object.__new__(DetectorSignal)
+    signal.current_instrument = instrument
+    signal.observation = observation
+    signal.warnings = {}
+    signal.calculation_config = Namespace(effects={'saturation': True})
+    signal.det_pars = {'fullwell': 60000., 'rn_correlation': False}
+    signal.dispersion_axis = 'x'
+    signal.detector_pixels = pixels
+    signal.projection_type = 'multiorder'
+    signal._saturation_cache = OrderedDict()
+    rates = {'fp_pix': rate, 'fp_pix_no_ipc': rate, 'fp_pix_variance': rate}
+    signal.rate_list = [rates]
+    signal.rate_plus_bg_list = [rates]
+    signal.rate = signal.rate_plus_bg = rate
+    signal.wave_pix = np.linspace(1., 2., rate.shape[1])
+    for name in ('wave', 'total_flux', 'fp_rate', 'bg_fp_rate', 'background', 'flux_cube_list',
+                 '_flux_plus_bg_list', 'aperture_list', 'grid'):
+        setattr(signal, name, None)
+    signal.saturation_list = [signal.get_saturation_mask(rate=rate)]
+    return signal
+
+
+def expected_saturation(exposure_spec, rate, fullwell=60000.):
+    """
+    Saturation map of a rate image computed directly from a readout pattern
+    """
+    unsat_ngroups = exposure_spec.get_unsaturated_groups(rate, fullwell)
+    saturation = np.zeros(rate.shape)
+    saturation[unsat_ngroups < exposure_spec.ngroup] = 1
+    saturation[unsat_ngroups < 2] = 2
+    return saturation
+
+
+def test_set_exposure_updates_every_order():
+    """
+    Sweeping the readout pattern of a multi-order observation has to update the exposure specification and
+    saturation map of every order, not just the first one
+    """
+    rng = np.random.RandomState(12)
+    observation = Namespace(instrument=FakeInstrument())
+    rates = []
+    orders = []
+    for i in range(3):
+        # rates spread over the range where saturation depends on ngroup
+        rate = 10 ** rng.uniform(1, 4, size=(6, 40 - 5 * i))
+        # each order has its own shallow copy of the instrument, as in _dither_signals()
+        instrument = FakeInstrument()
+        orders.append(make_order_signal(instrument, observation, rate, (3 * i, 0)))
+        rates.append(rate)
+    dithers = [CombinedSignal(orders)]
+
+    for ngroup, nint in ((2, 1), (7, 2), (30, 1), (100, 3), (5, 1)):
+        _set_exposure(observation, dithers, {'ngroup': ngroup, 'nint': nint})
+        for signal, rate in zip(orders, rates):
+            exposure_spec = signal.current_instrument.exposure_spec
+            assert exposure_spec.ngroup == ngroup
+            assert exposure_spec.nint == nint
+            np.testing.assert_array_equal(signal.saturation_list[0], expected_saturation(exposure_spec, rate))
+
+        combined = np.zeros_like(dithers[0].dist)
+        for signal, pad in zip(orders, dithers[0].pad_list):
+            combined = np.maximum(combined, np.pad(signal.saturation_list[0], pad, mode='constant'))
+        np.testing.assert_array_equal(dithers[0].saturation_list[0], combined)
+
+
+def make_noise_signal(instrument, rng, correlated, shape=(30, 200), excess=False):
+    """
+    Build a single slice DetectorSignal with everything DetectorNoise and the strategies use, from random rates
+
+    Parameters
+    ----------
+    instrument: FakeInstrument instance
+        The instrument of the observation
+    rng: np.random.RandomState instance
+        Random numbers for the rates and the read noise correlation
+    correlated: bool
+        Enable correlated read noise
+    shape: tuple
+        Shape of the detector plane
+    excess: bool
+        Use the excess read noise parameters rather than the read noise fudge factor
+
+    Returns
+    -------
+    signal: DetectorSignal instance
+    """
+    ny, nx = shape
+    signal = object.__new__(DetectorSignal)
+    signal.current_instrument = instrument
+    signal.observation = Namespace(instrument=instrument)
+    signal.warnings = {}
+    signal.calculation_config = Namespace(
+        noise={'crs': True, 'ffnoise': True, 'rn_correlation': correlated, 'readnoise': True, 'darkcurrent': True},
+        effects={'saturation': True}
+    )
+    signal.det_pars = {'fullwell': 60000., 'ff_electrons': 1e4, 'rn': 14., 'dark_current': 0.01, 'mingroups': 2,
+                       'rn_correlation': correlated, 'pix_size': 18., 'rn_fudge': 1.0}
+    if excess:
+        signal.det_pars.update({'excessp1': 1.5, 'excessp2': 4.0})
+    signal._saturation_cache = OrderedDict()
+    # a few bright pixels so that some saturate for the longer readout patterns
+    rate = rng.uniform(size=shape) ** 12 * 1500 + 1
+    rates = {'fp_pix': rate * 1.02, 'fp_pix_no_ipc': rate, 'fp_pix_variance': rate * 1.1}
+    signal.rate_plus_bg_list = [rates]
+    signal.rate_list = [rates]
+    signal.rate_plus_bg = rates['fp_pix']
+    signal.rate = rate * 0.9
+    signal.det_mask = np.ones(shape)
+    signal.det_mask[:, 5] = 0
+    signal.grid = signal.dist = None
+    correlation = rng.uniform(size=(2 * ny + 1, 2 * nx + 1)) * 0.05
+    correlation[ny, nx] = 1
+    signal.read_noise_correlation_matrix = correlation
+    signal.projection_type = 'spec'
+    signal.wave_pix = np.linspace(1., 2., nx)
+    signal.saturation_list = [signal.get_saturation_mask(rate=rates['fp_pix'])]
+    return signal
+
+
+class FakeStrategy(Strategy):
+
+    """
+    Strategy that extracts one product per detector column with fixed random weights, so that the extraction
+    code in Strategy can be run without reference data
+    """
+
+    def __init__(self, instrument, rng, shape, sizes, dither_weights):
+        self.instrument = instrument
+        self.background_subtraction = True
+        self.warnings = {}
+        self.extraction_area = self.background_area = 1.
+        self.dither_weights = dither_weights
+        self.on_target = [True] * len(dither_weights)
+        self.a_ij_list = []
+        for weight in dither_weights:
+            a_ij = rng.uniform(size=shape)
+            a_ij[rng.uniform(size=shape) < 0.3] *= -0.5
+            self.a_ij_list.append(np.matrix(a_ij))
+        self.product_subscripts = [(np.arange(size), self._fill_array(size, i)) for i, size in enumerate(sizes)]
+
+    def _create_weight_matrix(self, my_detector_signal_list, my_detector_noise_list):
+        if len(self.dither_weights) == 1:
+            return self.a_ij_list[0], self.product_subscripts
+        return self.a_ij_list, [self.product_subscripts] * len(self.dither_weights)
+
+    def reconstruct_cube(self, my_detector_signal, my_detector_noise):
+        saturation = my_detector_signal.get_saturation_mask()
+        return (my_detector_signal.rate_plus_bg[None], my_detector_noise.stdev_pix[None], saturation[None], None)
+
+    def get_plane_grid(self, my_detector_signal):
+        return None
+
+
+def forward_sn(solver, ngroup, nint, nexp):
+    """
+    S/N at the reference wavelength of a readout pattern calculated the way calculate_sn() does
+    """
+    _set_exposure(solver.obs, solver.signal_list, {'ngroup': ngroup, 'nint': nint, 'nexp': nexp})
+    noise_list, saturation_list, extracted = _extract_products(solver.obs.strategy, solver.signal_list)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sn = np.ma.fix_invalid(extracted['extracted_flux'] / extracted['extracted_noise'], fill_value=0.0).data
+    wave = solver.obs.strategy.get_wave_pix(solver.signal_list[0])
+    return sn[np.abs(wave - solver.input['strategy']['reference_wavelength']).argmin()]
+
+
+def make_solver(correlated, dither_weights, sizes, excess=False, seed=3):
+    """
+    Set up an ExposureTimeSolver on synthetic signals rather than on a calculation input
+    """
+    rng = np.random.RandomState(seed)
+    shape = (30, 200)
+    instrument = FakeInstrument(ngroup=10, nint=1, nexp=1)
+    strategy = FakeStrategy(instrument, rng, shape, [sizes(i) for i in range(shape[1])], dither_weights)
+    solver = object.__new__(ExposureTimeSolver)
+    solver.input = {'strategy': {'method': 'specapphot', 'reference_wavelength': 1.37}}
+    solver.obs = Namespace(instrument=instrument, strategy=strategy)
+    solver.signal_list = [make_noise_signal(instrument, rng, correlated, shape=shape, excess=excess)
+                          for weight in dither_weights]
+    solver.evaluated = {}
+    solver.warnings = {}
+    solver._setup_noise_model()
+    return solver
+
+
+@pytest.mark.parametrize('correlated', [False, True])
+@pytest.mark.parametrize('dither_weights', [[1.0], [1.0, -0.7]])
+@pytest.mark.parametrize('mixed_sizes', [False, True])
+def test_solver_matches_forward_sn(correlated, dither_weights, mixed_sizes):
+    """
+    The S/N the exposure time solver evaluates without a full calculation has to match that of a full
+    calculation for the same readout pattern
+    """
+    sizes = (lambda i: 30 if i % 4 else 12) if mixed_sizes else (lambda i: 30)
+    solver = make_solver(correlated, dither_weights, sizes)
+    ngroup = np.arange(2, 40, 3)
+    sn = solver.evaluate(ngroup, 2, 1)
+    expected = [forward_sn(solver, g, 2, 1) for g in ngroup]
+    np.testing.assert_allclose(sn, expected, rtol=1e-10)
+
+
+@pytest.mark.parametrize('correlated', [False, True])
+def test_solver_pattern_reaches_target(correlated):
+    """
+    The readout pattern the solver chooses has to reach the target S/N in a full calculation, while the same
+    pattern with one integration or group less does not
+    """
+    solver = make_solver(correlated, [1.0, -0.7], lambda i: 30, excess=True)
+    # more than a single integration can reach, so that the search over integrations is used as well
+    sn_one_int = solver.evaluate(np.arange(2, 101), 1, 1)
+    target_sn = 0.5 * (sn_one_int.max() + solver.evaluate(sn_one_int.argmax() + 2, 2, 1)[0])
+    (ngroup, nint, nexp), reached = solver.solve(target_sn)
+    assert reached
+    assert nint > 1
+    sn = forward_sn(solver, ngroup, nint, nexp)
+    assert sn == pytest.approx(solver.evaluated[(ngroup, nint, nexp)][0], rel=1e-10)
+    assert sn >= target_sn
+    assert forward_sn(solver, ngroup, nint - 1, nexp) < target_sn
+    if ngroup > 2:
+        assert forward_sn(solver, ngroup - 1, nint, nexp) < target_sn
+
+
+@pytest.mark.skipif(not os.environ.get('pandeia_refdata'), reason="requires the pandeia reference data")
+def test_calculate_exposure_time_matches_calculate_sn():
+    """
+    The S/N reported for the readout pattern a reverse calculation chooses has to be what calculate_sn()
+    gives for that pattern
+    """
+    calc = build_default_calc('jwst', 'nirspec', 'fixed_slit')
+    calc['reverse'] = {'sn': 30.0}
+    reverse = calculate_exposure_time(calc).as_dict()
+    forward = calculate_sn(reverse['input']).as_dict()
+    assert reverse['scalar']['sn'] >= 30.0
+    assert reverse['scalar']['sn'] == pytest.approx(forward['scalar']['sn'], rel=1e-10)
+
+
+def reference_cr_loss(noise, ngroups, saturation_time):
+    """
+    DetectorNoise.calc_cr_loss() as it was for a single number of groups, before it handled arrays
+    """
+    if ngroups < noise.mingroups:
+        ramp_frac = 1.0
+    else:
+        ramp_frac = 1.0 - 0.5 * (ngroups - noise.mingroups) / (ngroups - 1.0)
+    return (1.0 - ramp_frac * noise.pix_cr_rate * saturation_time) * ngroups
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('array_saturation_time', [False, True])
+def test_calc_cr_loss(masked, array_saturation_time):
+    """
+    The array calc_cr_loss() has to match applying the scalar formula to each element with np.vectorize, as the
+    noise used to be calculated, for numbers of groups on both sides of mingroups, and keep the mask of masked
+    input
+    """
+    rng = np.random.RandomState(8)
+    instrument = FakeInstrument(ngroup=20)
+    signal = make_noise_signal(instrument, rng, False, shape=(4, 6))
+    signal.det_pars['mingroups'] = 4
+    noise = DetectorNoise(signal, signal.observation)
+    # a much higher CR rate than the real one so that the loss is not lost in rounding
+    noise.pix_cr_rate = 1e-3
+
+    ngroups = rng.randint(0, 21, size=(4, 6)).astype(float)
+    ngroups[0, :5] = [0, 1, 3, 4, 5]
+    if masked:
+        ngroups = np.ma.masked_less(ngroups, 3)
+    if array_saturation_time:
+        # e.g. several readout patterns of an ExposureGrid along a leading axis
+        saturation_time = np.array([10., 50., 200.]).reshape(3, 1, 1)
+        result = noise.calc_cr_loss(ngroups, saturation_time=saturation_time)
+    else:
+        saturation_time = instrument.exposure_spec.saturation_time
+        result = noise.calc_cr_loss(ngroups)
+    expected = np.vectorize(lambda n, t: reference_cr_loss(noise, n, t))(np.ma.getdata(ngroups), saturation_time)
+    np.testing.assert_allclose(np.ma.getdata(result), expected, rtol=1e-14)
+    assert np.ma.isMaskedArray(result) == masked
+    if masked:
+        np.testing.assert_array_equal(np.ma.getmaskarray(result),
+                                      np.broadcast_to(np.ma.getmaskarray(ngroups), expected.shape))
+
+    # single numbers give single numbers
+    for n in (1., 4., 17.):
+        assert noise.calc_cr_loss(n) == pytest.approx(
+            reference_cr_loss(noise, n, instrument.exposure_spec.saturation_time), rel=1e-14)
+        assert isinstance(noise.calc_cr_loss(n), float)
+
+
+class FakeSlitlessInstrument(object):
+
+    """
+    The parts of an Instrument that DetectorSignal.slitless_rate() uses, with smooth made-up dispersion, trace
+    and quantum yield
+    """
+
+    def __init__(self, trace):
+        self.wave_pix = np.linspace(0.9, 3.1, 400)
+        self.trace = trace
+
+    def get_pixel_mapping(self, wmin, wmax):
+        wave_pix = self.wave_pix[(self.wave_pix >= wmin) & (self.wave_pix <= wmax)]
+        trace = 3 * np.sin(3 * wave_pix) if self.trace else np.zeros_like(wave_pix)
+        return {'wave_pix': wave_pix, 'dispersion': 100 + wave_pix, 'trace': trace}
+
+    def get_throughput_curves(self, wave):
+        return {'q_yield': 1 + 0.1 * wave, 'fano_factor': 0.05 * wave, 'var_fudge': 1 + 0.02 * wave}
+
+
+def reference_slitless_rate(signal, rate, add_extended_background=True):
+    """
+    DetectorSignal.slitless_rate() as it was before it was vectorized: each wavelength plane is shifted by the
+    trace and added to the detector image on its own. This is the original loop unchanged apart from reading
+    the pixel mapping and throughput curves from the cached instrument methods.
+    """
+    from scipy import interpolate as sci_int
+    from scipy.ndimage import shift
+
+    mapping = signal.current_instrument.get_pixel_mapping(signal.wave.min(), signal.wave.max())
+    wave_pix_trunc = mapping['wave_pix']
+    dispersion = mapping['dispersion']
+    trace = mapping['trace']
+    curves = signal.current_instrument.get_throughput_curves(wave_pix_trunc)
+    q_yield, fano_factor = curves['q_yield'], curves['fano_factor']
+
+    int_rate_pix = sci_int.interp1d(signal.wave, rate.astype(np.float32, casting='same_kind'),
+                                    kind='linear', axis=2, assume_sorted=True, copy=False)
+    rate_pix = int_rate_pix(wave_pix_trunc)
+    electron_rate_pix = rate_pix * q_yield
+    var_fudge = curves['var_fudge']
+    electron_variance_pix = rate_pix * q_yield * (q_yield + fano_factor) * var_fudge
+
+    int_bg_fp_rate = sci_int.interp1d(signal.wave, signal.bg_fp_rate.astype(np.float32, casting='same_kind'),
+                                      kind='linear', assume_sorted=True, copy=False)
+    bg_fp_rate_pix = int_bg_fp_rate(wave_pix_trunc)
+    bg_electron_rate = bg_fp_rate_pix * q_yield
+    bg_electron_variance = bg_fp_rate_pix * q_yield * (q_yield + fano_factor) * var_fudge
+
+    if signal.dispersion_axis == 'x':
+        spec_shape = (rate_pix.shape[0], rate_pix.shape[2] + rate_pix.shape[1])
+        spec_rate = np.zeros(spec_shape)
+        spec_variance = np.zeros(spec_shape)
+        for i in np.arange(dispersion.shape[0]):
+            if trace[i] != 0.0:
+                spec_rate[:, i:i + rate_pix.shape[1]] += shift(
+                    electron_rate_pix[:, :, i],
+                    shift=(trace[i], 0),
+                    mode='nearest',
+                    order=1
+                ) * dispersion[i]
+                spec_variance[:, i:i + rate_pix.shape[1]] += shift(
+                    electron_variance_pix[:, :, i],
+                    shift=(trace[i], 0),
+                    mode='nearest',
+                    order=1
+                ) * dispersion[i]
+            else:
+                spec_rate[:, i:i + rate_pix.shape[1]] += electron_rate_pix[:, :, i] * dispersion[i]
+                spec_variance[:, i:i + rate_pix.shape[1]] += electron_variance_pix[:, :, i] * dispersion[i]
+
+            if add_extended_background:
+                spec_rate[:, :i] += bg_electron_rate[i] * dispersion[i]
+                spec_rate[:, i + rate_pix.shape[1]:] += bg_electron_rate[i] * dispersion[i]
+                spec_variance[:, :i] += bg_electron_variance[i] * dispersion[i]
+                spec_variance[:, i + rate_pix.shape[1]:] += bg_electron_variance[i] * dispersion[i]
+    else:
+        spec_shape = (rate_pix.shape[2] + rate_pix.shape[0], rate_pix.shape[1])
+        spec_rate = np.zeros(spec_shape)
+        spec_variance = np.zeros(spec_shape)
+        for i in np.arange(dispersion.shape[0]):
+            if trace[i] != 0.0:
+                spec_rate[i:i + rate_pix.shape[1], :] += shift(
+                    electron_rate_pix[:, :, i],
+                    shift=(0, trace[i]),
+                    mode='nearest'
+                ) * dispersion[i]
+                spec_variance[i:i + rate_pix.shape[1], :] += shift(
+                    electron_variance_pix[:, :, i],
+                    shift=(0, trace[i]),
+                    mode='nearest'
+                ) * dispersion[i]
+            else:
+                spec_rate[i:i + rate_pix.shape[1], :] += electron_rate_pix[:, :, i] * dispersion[i]
+                spec_variance[i:i + rate_pix.shape[1], :] += electron_rate_pix[:, :, i] * dispersion[i]
+            if add_extended_background:
+                spec_rate[:i, :] += bg_electron_rate[i] * dispersion[i]
+                spec_rate[i + rate_pix.shape[1]:, :] += bg_electron_rate[i] * dispersion[i]
+                spec_variance[:i, :] += bg_electron_variance[i] * dispersion[i]
+                spec_variance[i + rate_pix.shape[1]:, :] += bg_electron_variance[i] * dispersion[i]
+
+    if signal.dispersion_axis == 'x' or signal.projection_type == 'multiorder':
+        products = wave_pix_trunc, spec_rate, spec_variance
+    else:
+        products = wave_pix_trunc, np.flipud(spec_rate), np.flipud(spec_variance)
+    return products
+
+
+@pytest.mark.parametrize('dispersion_axis', ['x', 'y'])
+@pytest.mark.parametrize('trace', [True, False])
+@pytest.mark.parametrize('add_extended_background', [True, False])
+def test_slitless_rate(dispersion_axis, trace, add_extended_background):
+    """
+    The vectorized slitless projection has to match shifting and adding each wavelength plane on its own
+    """
+    rng = np.random.RandomState(0)
+    signal = object.__new__(DetectorSignal)
+    signal.current_instrument = FakeSlitlessInstrument(trace)
+    signal.wave = np.linspace(1., 3., 300)
+    signal.bg_fp_rate = rng.uniform(size=300)
+    signal.dispersion_axis = dispersion_axis
+    signal.projection_type = 'slitless'
+    rate = rng.uniform(size=(48, 48, 300))
+
+    wave_pix, spec_rate, spec_variance = signal.slitless_rate(rate, add_extended_background)
+    expected = reference_slitless_rate(signal, rate, add_extended_background)
+    np.testing.assert_array_equal(wave_pix, expected[0])
+    # both interpolate the cube onto the pixel wavelengths in float32
+    for result, reference in ((spec_rate, expected[1]), (spec_variance, expected[2])):
+        assert result.shape == reference.shape
+        assert np.abs(result - reference).max() <= 1e-6 * np.abs(reference).max()
+
+
+class FakeSpecInstrument(FakeSlitlessInstrument):
+
+    """
+    The parts of an Instrument that DetectorSignal.spec_rate() uses, with a detector gap
+    """
+
+    def get_dispersion(self, wave):
+        return 100 + wave
+
+    def create_gap_mask(self, wave):
+        return np.where((wave > 2.0) & (wave < 2.1), 0.0, 1.0)
+
+
+@pytest.mark.parametrize('dispersion_axis', ['x', 'y'])
+def test_spec_rate(dispersion_axis):
+    """
+    Resampling the spectrum with the interpolation matrix has to match interp1d along the wavelength axis
+    """
+    from scipy.interpolate import interp1d
+
+    rng = np.random.RandomState(0)
+    signal = object.__new__(DetectorSignal)
+    signal.current_instrument = FakeSpecInstrument(trace=False)
+    signal.wave = np.linspace(1., 3., 300)
+    signal.dispersion_axis = dispersion_axis
+    # the spatial axes differ in size from each other and from the wavelength axis
+    rate = rng.uniform(size=(40, 56, 300))
+
+    wave_pix, spec_rate, spec_variance = signal.spec_rate(rate)
+    instrument = signal.current_instrument
+    expected_wave_pix = instrument.get_pixel_mapping(1., 3.)['wave_pix']
+    spec_rate_pix = rate.sum(axis=1 if dispersion_axis == 'x' else 0) * instrument.get_dispersion(signal.wave)
+    rate_pix = interp1d(signal.wave, spec_rate_pix, kind='linear', assume_sorted=True)(expected_wave_pix)
+    rate_pix *= instrument.create_gap_mask(expected_wave_pix)
+    curves = instrument.get_throughput_curves(expected_wave_pix)
+    q_yield = curves['q_yield']
+    np.testing.assert_array_equal(wave_pix, expected_wave_pix)
+    np.testing.assert_allclose(spec_rate, rate_pix * q_yield, rtol=1e-12)
+    np.testing.assert_allclose(spec_variance,
+                               rate_pix * q_yield * (q_yield + curves['fano_factor']) * curves['var_fudge'],
+                               rtol=1e-12)
+
+
+class FakeRateInstrument(FakeSpecInstrument):
+
+    """
+    The parts of an Instrument that DetectorSignal.all_rates() and background_rates() use
+    """
+
+    telescope = Namespace(coll_area=25e4)
+
+    def get_throughput_curves(self, wave):
+        curves = FakeSpecInstrument.get_throughput_curves(self, wave)
+        curves.update(ote=0.8 + 0.05 * np.cos(wave), instrument=0.5 + 0.1 * np.sin(wave))
+        return curves
+
+    def get_ipc_kernel(self):
+        return np.array([[0., 0.01, 0.], [0.01, 0.96, 0.01], [0., 0.01, 0.]])
+
+
+@pytest.mark.parametrize('projection_type, dispersion_axis', [
+    ('image', 'x'),
+    ('spec', 'x'),
+    ('spec', 'y'),
+    ('slitless', 'x'),
+    ('slitless', 'y'),
+    ('multiorder', 'y'),
+])
+@pytest.mark.parametrize('mask', ['full', 'slit', 'box'])
+def test_background_rates(projection_type, dispersion_axis, mask):
+    """
+    Propagating the background on its own and adding it to the source rates has to give the same detector rates
+    as running the source cube with the background added through all_rates()
+    """
+    rng = np.random.RandomState(2)
+    signal = object.__new__(DetectorSignal)
+    signal.current_instrument = FakeRateInstrument(trace=True)
+    signal.wave = np.linspace(1., 3., 400)
+    signal.projection_type = projection_type
+    signal.dispersion_axis = dispersion_axis
+    signal.det_pars = {'ipc': True}
+    signal.calculation_config = Namespace(effects={'ipc': True})
+    mjy_pix = rng.uniform(size=signal.wave.size)
+    signal.bg_fp_rate = signal.focal_plane_rate(signal.ote_rate(mjy_pix))
+
+    bg_mask = np.zeros((41, 41))
+    if mask == 'full':
+        bg_mask[:] = 1.
+    elif mask == 'slit':
+        # a slit along the dispersion direction, partially transmitting
+        bg_mask[:, 16:25] = 0.25
+        if dispersion_axis == 'x':
+            bg_mask = bg_mask.T
+    else:
+        bg_mask[15:26, 16:25] = 1.
+    flux = rng.uniform(size=(41, 41, signal.wave.size)).astype(np.float32)
+    flux_plus_bg = flux + (bg_mask[:, :, np.newaxis] * mjy_pix).astype(np.float32)
+
+    rate = signal.all_rates(flux, add_extended_background=False)
+    result = signal.add_rates(rate, signal.background_rates(bg_mask))
+    expected = signal.all_rates(flux_plus_bg, add_extended_background=True)
+    if projection_type != 'image':
+        # the effective wavelength of imaging modes is that of the source alone
+        np.testing.assert_array_equal(result['wave_pix'], expected['wave_pix'])
+    # the two-pass calculation adds the background to the float32 cube
+    for key in ('fp_pix', 'fp_pix_no_ipc', 'fp_pix_variance'):
+        assert result[key].shape == expected[key].shape
+        assert np.abs(result[key] - expected[key]).max() <= 1e-6 * np.abs(expected[key]).max()
@@ -0,0 +1,197 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import numpy as np
+import numpy.ma as ma
+
+import pytest
+
+from .. import exposure
+from ..custom_exceptions import EngineInputError
+from ..exposure import (ExposureSpecification, ExposureSpecificationTA, ExposureGrid, multiaccum_variance,
+                        _fill_saturated)
+
+readout_patterns = [
+    {},
+    {'det_type': 'sias', 'nsample': 4, 'nprerej': 1, 'npostrej': 1},
+    {'nframe': 4, 'nskip': 1},
+]
+
+noise_fudges = [
+    {},
+    {'rn_fudge': 1.3},
+    {'excessp1': 0.2, 'excessp2': 0.5},
+]
+
+
+def reference_rn_variance(exposure_spec, readnoise, unsat_ngroups, rn_fudge=1.0, excessp1=0.0, excessp2=0.0):
+    """
+    ExposureSpecification.rn_variance() for an array of unsaturated groups as it was with masked arrays
+    """
+    m = getattr(exposure_spec, 'nsample_total', exposure_spec.nframe)
+    n = unsat_ngroups
+    tgroup = exposure_spec.tgroup
+    var_rn = 12. * readnoise ** 2. / (m * n * (n ** 2. - 1.) * tgroup ** 2.)
+    if rn_fudge != 1:
+        var_rn *= rn_fudge
+    if excessp1 != 0.0 or excessp2 != 0.0:
+        excess_variance = (12.0 * (n - 1) / (n + 1) * excessp1 ** 2 - excessp2 / np.sqrt(m)) / ((1 - n) * tgroup) ** 2
+        var_rn += excess_variance
+    return var_rn
+
+
+def reference_slope_variance(exposure_spec, rate, dark_current, readnoise, unsat_ngroups, rn_fudge=1.0,
+                             excessp1=0.0, excessp2=0.0):
+    """
+    ExposureSpecification.slope_variance() as it was with masked arrays
+    """
+    variance_per_pix = rate['fp_pix_variance']
+    n = ma.copy(unsat_ngroups)
+    if (exposure_spec.nprerej != 0 or exposure_spec.npostrej != 0) and exposure_spec.ngroup >= 5:
+        unsat_pixels = (exposure_spec.ngroup - np.ceil(n)) < exposure_spec.npostrej
+        n[unsat_pixels] -= exposure_spec.nprerej
+        n -= exposure_spec.npostrej
+    if hasattr(exposure_spec, 'nsample_total') and hasattr(exposure_spec, 'tsample'):
+        m = exposure_spec.nsample_total
+        tframe = exposure_spec.tsample
+    else:
+        m = exposure_spec.nframe
+        tframe = exposure_spec.tframe
+    tgroup = exposure_spec.tgroup
+
+    slope_rn_var = reference_rn_variance(exposure_spec, readnoise, n, rn_fudge=rn_fudge, excessp1=excessp1,
+                                         excessp2=excessp2)
+    slope_var = (6. / 5.) * (n ** 2. + 1.) / (n * (n ** 2. - 1.)) * \
+        ((variance_per_pix + dark_current) / tgroup) * \
+        (1. - (5. / 3.) * (m ** 2. - 1.) / (m * (n ** 2. + 1.)) * (tframe / tgroup)) + \
+        slope_rn_var
+    return ma.filled(slope_var, fill_value=np.nan), ma.filled(slope_rn_var, fill_value=np.nan)
+
+
+def make_rate(dtype, seed=0, shape=(64, 64)):
+    """
+    Random rate whose first pixels sweep from no rate to very high rates, so that there are pixels with every
+    number of unsaturated groups
+    """
+    rng = np.random.RandomState(seed)
+    rate = (rng.uniform(size=shape) * 500).astype(dtype)
+    rate.flat[:50] = np.logspace(-1, 9, 50)
+    rate.flat[0] = 0.
+    return rate
+
+
+@pytest.mark.parametrize('pattern', readout_patterns)
+@pytest.mark.parametrize('ngroup', [3, 10])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('full_saturation', [1, 2])
+@pytest.mark.parametrize('fudges', noise_fudges)
+def test_slope_variance(pattern, ngroup, dtype, full_saturation, fudges):
+    """
+    The slope and read noise variances have to match the masked array calculation bit for bit, with NaN for
+    pixels that are saturated or whose variance is otherwise undefined
+    """
+    exposure_spec = ExposureSpecification('test', ngroup, 2, 1, 10.7, **pattern)
+    rate = make_rate(dtype)
+    rate_products = {'fp_pix_variance': (rate * 1.3).astype(dtype)}
+    unsat_ngroups = exposure_spec.get_unsaturated_groups(rate, 60000., full_saturation=full_saturation)
+
+    slope_var, slope_rn_var = exposure_spec.slope_variance(rate_products, 0.01, 14., unsat_ngroups, **fudges)
+    expected_var, expected_rn_var = reference_slope_variance(exposure_spec, rate_products, 0.01, 14.,
+                                                             unsat_ngroups, **fudges)
+    assert slope_var.dtype == expected_var.dtype
+    assert slope_rn_var.dtype == expected_rn_var.dtype
+    np.testing.assert_array_equal(slope_var, expected_var)
+    np.testing.assert_array_equal(slope_rn_var, expected_rn_var)
+    assert np.isnan(slope_var).any()
+
+    rn_var = exposure_spec.rn_variance(14., unsat_ngroups=unsat_ngroups, **fudges)
+    expected = ma.filled(reference_rn_variance(exposure_spec, 14., unsat_ngroups, **fudges), np.nan)
+    np.testing.assert_array_equal(rn_var, expected)
+
+
+def test_slope_variance_fudges_exclusive():
+    """
+    rn_fudge and the excess variance terms can not be combined
+    """
+    exposure_spec = ExposureSpecification('test', 10, 2, 1, 10.7)
+    rate = make_rate(np.float64)
+    unsat_ngroups = exposure_spec.get_unsaturated_groups(rate, 60000.)
+    with pytest.raises(ValueError):
+        exposure_spec.slope_variance({'fp_pix_variance': rate}, 0.01, 14., unsat_ngroups, rn_fudge=1.3,
+                                     excessp1=0.2)
+
+
+@pytest.mark.parametrize('pattern', [{}, {'det_type': 'sias', 'nsample': 4}, {'nframe': 4, 'nskip': 1}])
+def test_stacked_multiaccum_variance(pattern):
+    """
+    Evaluating several readout patterns stacked along a leading axis has to give the same variances as
+    slope_variance() for each pattern. Without rejected groups, the usable groups are the unsaturated groups.
+    """
+    rate = make_rate(np.float64, seed=1)
+    variance = rate * 1.1
+    exposure_specs = [ExposureSpecification('test', ngroup, 2, 1, 10.7, **pattern) for ngroup in (4, 8, 16)]
+    unsat_ngroups = [exposure_spec.get_unsaturated_groups(rate, 60000.) for exposure_spec in exposure_specs]
+    n = np.stack([_fill_saturated(unsat) for unsat in unsat_ngroups])
+    pars = np.array([exposure_spec.get_multiaccum_pars() for exposure_spec in exposure_specs], dtype=float)
+    m, tgroup, tframe = [p[:, np.newaxis, np.newaxis] for p in pars.T]
+
+    slope_var, slope_rn_var = multiaccum_variance(n, variance, 0.01, 14., m, tgroup, tframe)
+    for i, exposure_spec in enumerate(exposure_specs):
+        expected_var, expected_rn_var = exposure_spec.slope_variance({'fp_pix_variance': variance}, 0.01, 14.,
+                                                                     unsat_ngroups[i])
+        np.testing.assert_array_equal(slope_var[i], expected_var)
+        np.testing.assert_array_equal(slope_rn_var[i], expected_rn_var)
+
+
+@pytest.mark.parametrize('pattern', readout_patterns)
+@pytest.mark.parametrize('fudges', noise_fudges)
+@pytest.mark.parametrize('shape', [(40, 50), (300,)])
+@pytest.mark.parametrize('block_size', [2 ** 17, 1000])
+def test_exposure_grid(monkeypatch, pattern, fudges, shape, block_size):
+    """
+    The unsaturated groups and variances of every readout setting in a grid have to be the same as those of
+    its exposure specification on its own. The grid spans the very bright regime without rejected groups and
+    the block size is also set small enough to process the grid in several blocks.
+    """
+    monkeypatch.setattr(exposure, 'default_grid_block_size', block_size)
+    base = ExposureSpecification('test', 10, 2, 1, 10.7, **pattern)
+    grid = ExposureGrid.from_exposure_spec(base, ngroup=np.arange(2, 20)[:, np.newaxis], nint=[1, 3])
+    assert len(grid) == 36
+    rate = make_rate(np.float64, seed=2, shape=shape)
+    rate_products = {'fp_pix_variance': rate * 1.2}
+
+    unsat_ngroups = grid.get_unsaturated_groups(rate, 60000.)
+    slope_var, slope_rn_var = grid.slope_variance(rate_products, 0.01, 14., unsat_ngroups, **fudges)
+    rn_var = grid.rn_variance(14., unsat_ngroups=unsat_ngroups, **fudges)
+    assert unsat_ngroups.shape == slope_var.shape == slope_rn_var.shape == rn_var.shape == (len(grid),) + shape
+    for i, exposure_spec in enumerate(grid):
+        assert exposure_spec.ngroup == 2 + i // 2
+        assert exposure_spec.nint == [1, 3][i % 2]
+        for attr in ExposureGrid.stacked_attributes:
+            assert getattr(grid, attr)[i] == getattr(exposure_spec, attr)
+        expected_unsat = exposure_spec.get_unsaturated_groups(rate, 60000.)
+        np.testing.assert_array_equal(ma.getmaskarray(unsat_ngroups[i]), ma.getmaskarray(expected_unsat))
+        np.testing.assert_array_equal(ma.getdata(unsat_ngroups[i]), ma.getdata(expected_unsat))
+        expected_var, expected_rn_var = exposure_spec.slope_variance(rate_products, 0.01, 14., expected_unsat,
+                                                                     **fudges)
+        np.testing.assert_array_equal(slope_var[i], expected_var)
+        np.testing.assert_array_equal(slope_rn_var[i], expected_rn_var)
+        np.testing.assert_array_equal(rn_var[i],
+                                      exposure_spec.rn_variance(14., unsat_ngroups=expected_unsat, **fudges))
+
+    # the full ramps of the shortest readout settings have no groups left after rejection
+    long_grid = ExposureGrid(grid.exposure_specs[4:])
+    full_rn_var = long_grid.rn_variance(14., **fudges)
+    for i, exposure_spec in enumerate(long_grid):
+        assert full_rn_var[i] == exposure_spec.rn_variance(14., **fudges)
+
+
+def test_exposure_grid_specs():
+    """
+    Grids need at least one exposure specification and do not support target acquisition
+    """
+    with pytest.raises(EngineInputError):
+        ExposureGrid([])
+    ta_spec = ExposureSpecificationTA('test', 5, 3, 1, 1, 10.7)
+    with pytest.raises(EngineInputError):
+        ExposureGrid([ExposureSpecification('test', 5, 1, 1, 10.7), ta_spec])
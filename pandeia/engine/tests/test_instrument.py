@@ -0,0 +1,112 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import os
+
+import numpy as np
+
+import pytest
+
+from ..instrument import Instrument, ProductCache, product_cache
+from ..io_utils import refdata_cache
+from .test_io_utils import write_table
+
+
+class Namespace(object):
+
+    """
+    Plain object to hang the attributes that the code under test uses on
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_instrument(ref_dir):
+    """
+    Build an Instrument with just what get_wave_pix() and _cached_product() need
+    """
+    instrument = object.__new__(Instrument)
+    instrument.instrument = {'disperser': 'g140h'}
+    instrument.detector = {}
+    instrument.paths = {'g140h_disp': 'disp.fits'}
+    instrument.ref_dir = ref_dir
+    instrument.telescope = Namespace(ref_dir=ref_dir)
+    instrument.mode = 'fixed_slit'
+    instrument.order = None
+    return instrument
+
+
+def expected_wave_pix(wave, dlds):
+    """
+    Wavelength of each whole pixel, as Instrument._read_wave_pix() derives it from a dispersion table
+    """
+    pixel = np.cumsum(1.0 / dlds * np.gradient(wave))
+    return np.interp(np.arange(int(pixel[0]), int(pixel[-1])), pixel, wave)
+
+
+def test_cached_wave_pix(tmpdir, monkeypatch):
+    """
+    get_wave_pix() has to be computed once, handed out read-only, and computed again from a newly read table in
+    the first calculation after the dispersion file changes. A product computed from it depends on the same file.
+    """
+    product_cache.clear()
+    filename = str(tmpdir.join('disp.fits'))
+    wave = np.linspace(1., 2., 200)
+    write_table(filename, wave, np.full(200, 0.01), mtime=1e9)
+    instrument = make_instrument(str(tmpdir))
+
+    calls = []
+    read_wave_pix = Instrument._read_wave_pix
+
+    def spy(self):
+        calls.append(1)
+        return read_wave_pix(self)
+
+    monkeypatch.setattr(Instrument, '_read_wave_pix', spy)
+    refdata_cache.new_generation()
+    wave_pix = instrument.get_wave_pix()
+    np.testing.assert_allclose(wave_pix, expected_wave_pix(wave, np.full(200, 0.01)))
+    with pytest.raises(ValueError):
+        wave_pix[0] = 0.
+    doubled = instrument._cached_product('doubled', lambda: {'wave_pix': 2 * instrument.get_wave_pix()})
+    assert instrument.get_wave_pix() is wave_pix
+    assert instrument._cached_product('doubled', lambda: None) is doubled
+    assert len(calls) == 1
+
+    # the change is only checked for once per calculation
+    misses = refdata_cache.misses
+    write_table(filename, wave, np.full(200, 0.02), mtime=1e9 + 10)
+    assert instrument.get_wave_pix() is wave_pix
+    refdata_cache.new_generation()
+    changed = instrument._cached_product('doubled', lambda: {'wave_pix': 2 * instrument.get_wave_pix()})
+    assert len(calls) == 2
+    assert refdata_cache.misses == misses + 1
+    np.testing.assert_allclose(changed['wave_pix'], 2 * expected_wave_pix(wave, np.full(200, 0.02)))
+    assert instrument.get_wave_pix() is not wave_pix
+
+    # a removed file invalidates the product too
+    os.remove(filename)
+    refdata_cache.new_generation()
+    files, product = product_cache.get(instrument._product_key('wave_pix'))
+    assert product is None
+    product_cache.clear()
+
+
+def test_product_cache_evict():
+    """
+    The least recently used products have to be evicted beyond the limit, and configure() has to keep the limit
+    if it is not given
+    """
+    cache = ProductCache(max_entries=2)
+    for name in ('a', 'b'):
+        cache.put((name,), [], {'name': name})
+    assert cache.get(('a',))[1] == {'name': 'a'}
+    cache.put(('c',), [], {'name': 'c'})
+    assert cache.get(('b',)) == (None, None)
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+    cache.configure()
+    assert cache.max_entries == 2
+    cache.configure(max_entries=1)
+    assert cache.stats()['entries'] == 1
+    assert cache.get(('c',))[1] == {'name': 'c'}
@@ -0,0 +1,122 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import os
+
+import numpy as np
+import astropy.io.fits as fits
+
+import pytest
+
+from ..io_utils import RefDataCache
+
+
+def write_table(filename, wave, dlds, mtime=None):
+    """
+    Write a dispersion-like reference table with WAVELENGTH and DLDS columns
+
+    Parameters
+    ----------
+    filename: str
+        Path of the FITS file
+    wave, dlds: np.ndarray
+        Column values
+    mtime: float or None
+        Modification time to give the file, so that rewrites are seen as changes whatever the file system's
+        timestamp resolution
+    """
+    hdu = fits.BinTableHDU.from_columns([fits.Column(name='WAVELENGTH', format='D', array=wave),
+                                         fits.Column(name='DLDS', format='D', array=dlds)])
+    hdu.writeto(filename, overwrite=True)
+    if mtime is not None:
+        os.utime(filename, (mtime, mtime))
+
+
+def test_refdata_cache_get(tmpdir):
+    """
+    Tables have to be read once, into read-only native byte order columns, and read again once the file changes
+    """
+    filename = str(tmpdir.join('disp.fits'))
+    wave = np.linspace(1., 2., 50)
+    write_table(filename, wave, np.full(50, 0.01), mtime=1e9)
+    cache = RefDataCache()
+
+    table = cache.get(filename)
+    assert cache.get(filename) is table
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert sorted(table['columns']) == ['dlds', 'wavelength']
+    assert table['wave_error'] is None
+    column = table['columns']['wavelength']
+    assert column.dtype.isnative
+    np.testing.assert_array_equal(column, wave)
+    with pytest.raises(ValueError):
+        column[0] = 0.
+
+    write_table(filename, wave[::-1], np.full(50, 0.02), mtime=1e9 + 10)
+    changed = cache.get(filename)
+    assert changed is not table
+    assert (cache.hits, cache.misses) == (1, 2)
+    np.testing.assert_array_equal(changed['columns']['dlds'], 0.02)
+    assert 'Out-of-order' in changed['wave_error']
+    # the older version of the file is dropped
+    assert cache.stats()['entries'] == 1
+
+    with pytest.raises(IOError):
+        cache.get(str(tmpdir.join('missing.fits')))
+
+
+def test_refdata_cache_evict(tmpdir):
+    """
+    The least recently used tables have to be evicted beyond the limit, and configure() has to keep any
+    setting that is not given
+    """
+    filenames = [str(tmpdir.join('disp%d.fits' % i)) for i in range(3)]
+    for filename in filenames:
+        write_table(filename, np.linspace(1., 2., 10), np.ones(10))
+    cache = RefDataCache(max_entries=2)
+    tables = [cache.get(filename) for filename in filenames[:2]]
+    cache.get(filenames[0])
+    cache.get(filenames[2])
+    assert cache.evictions == 1
+    assert cache.get(filenames[0]) is tables[0]
+    assert cache.get(filenames[1]) is not tables[1]
+
+    cache.configure(memmap=True)
+    assert (cache.max_entries, cache.memmap) == (2, True)
+    cache.configure(max_entries=1)
+    assert (cache.max_entries, cache.memmap) == (1, True)
+    assert cache.stats()['entries'] == 1
+
+
+def test_refdata_cache_record(tmpdir):
+    """
+    record() has to collect the files used by this thread, in every record that is open, including files noted
+    by note_files(). unchanged() has to notice when any of them is changed or removed.
+    """
+    filenames = [str(tmpdir.join('disp%d.fits' % i)) for i in range(2)]
+    for filename in filenames:
+        write_table(filename, np.linspace(1., 2., 10), np.ones(10), mtime=1e9)
+    keys = [(os.path.abspath(filename), 1e9) for filename in filenames]
+    cache = RefDataCache()
+
+    cache.get(filenames[0])
+    with cache.record() as outer:
+        cache.get(filenames[0])
+        with cache.record() as inner:
+            cache.note_files([keys[1]])
+        assert inner == set([keys[1]])
+    assert outer == set(keys)
+    # outside of a record nothing is collected
+    cache.note_files([('other', 0.)])
+    assert outer == set(keys)
+
+    assert cache.unchanged(outer)
+    os.utime(filenames[1], (1e9 + 10, 1e9 + 10))
+    assert not cache.unchanged(outer)
+    assert cache.unchanged([keys[0]])
+    os.remove(filenames[0])
+    assert not cache.unchanged([keys[0]])
+
+    generation = cache.generation
+    assert cache.new_generation() == generation + 1
+    assert cache.generation == generation + 1
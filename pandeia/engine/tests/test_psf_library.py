@@ -0,0 +1,309 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import os
+import json
+import mmap
+
+import numpy as np
+import astropy.io.fits as fits
+
+import pytest
+
+from ..custom_exceptions import DataError
+from ..psf_library import (PSFLibrary, PSFLibraryCache, _LazyPSF, pack_psf_library, psf_store_data,
+                           psf_store_index)
+
+
+def write_library(path, apertures=('s200a1',), waves=(1.0, 1.5, 2.0, 3.0), size=32, offsets=((0., 0.),)):
+    """
+    Write a PSF library of Gaussian PSFs that widen with wavelength, a little differently for each aperture
+
+    Parameters
+    ----------
+    path: py.path.local instance
+        Directory to write the PSF FITS files to
+    apertures: tuple of str
+        Apertures to write PSFs for
+    waves: tuple of float
+        Wavelengths in microns of the PSFs of each aperture
+    size: int
+        The PSF images are 2 * size + 1 pixels square
+    offsets: tuple of tuples (float, float)
+        Source offsets (r, theta) of the PSFs of each aperture. PSFs at an offset are a little wider.
+
+    Returns
+    -------
+    psfs: dict
+        PSF images keyed by (aperture, wave) for no offset and (aperture, wave, offset) otherwise
+    """
+    y, x = np.mgrid[-size:size + 1, -size:size + 1]
+    psfs = {}
+    for i, aperture in enumerate(apertures):
+        for j, offset in enumerate(offsets):
+            for wave in waves:
+                psf = np.exp(-(x ** 2 + y ** 2) / (2 * ((2 + i + 0.5 * j) * wave) ** 2))
+                psf = (psf / psf.sum()).astype(np.float32)
+                hdu = fits.PrimaryHDU(psf)
+                hdu.header.update(INSTRUME='NIRSPEC', NWAVES=1, WAVE0=wave * 1e-6, PIXELSCL=0.02, DIFFLMT=0.1,
+                                  APERTURE=aperture.upper(), OFFSET_R=offset[0], OFFSET_T=offset[1], DET_SAMP=4)
+                if offset == (0., 0.):
+                    hdu.writeto(str(path.join('nirspec_%s_%.1f.fits' % (aperture, wave))))
+                    psfs[(aperture, wave)] = psf
+                else:
+                    hdu.writeto(str(path.join('nirspec_%s_%.1f_%g_%g.fits' % ((aperture, wave) + offset))))
+                    psfs[(aperture, wave, offset)] = psf
+    return psfs
+
+
+@pytest.mark.parametrize('aperture', ['s200a1', 's400a1'])
+def test_get_psf_exact_wave(tmpdir, aperture):
+    """
+    At a library wavelength get_psf() returns that library entry. The entry has to be looked up through the
+    group's ids, not its position in the group, which only agree for the first group in the library.
+    """
+    psfs = write_library(tmpdir, apertures=('s200a1', 's400a1'))
+    library = PSFLibrary(path=str(tmpdir), store=False)
+    for wave in (1.0, 1.5, 2.0, 3.0):
+        psf = library.get_psf(wave, 'nirspec', aperture)
+        assert psf['wave'] == wave
+        np.testing.assert_array_equal(psf['int'], psfs[(aperture, wave)])
+
+
+def assert_libraries_match(library, expected):
+    """
+    Check that two PSF libraries have the same entries, in any order
+    """
+    def entries(lib):
+        return sorted((psf['aperture_name'], psf['wave'], psf['pix_scl'], psf['diff_limit'], psf['upsamp'],
+                       psf['source_offset'], psf['int'].tobytes()) for psf in lib._psfs)
+    assert entries(library) == entries(expected)
+
+
+@pytest.mark.parametrize('aperture', ['all', 's400a1'])
+def test_pack_round_trip(tmpdir, monkeypatch, aperture):
+    """
+    A packed library has to read back from the store with the same PSFs as from the FITS files, restricted
+    to the aperture asked for
+    """
+    psfs = write_library(tmpdir, apertures=('s200a1', 's400a1'))
+    index = pack_psf_library(str(tmpdir))
+    assert len(index['groups']) == 2
+    expected = PSFLibrary(path=str(tmpdir), aperture=aperture, store=False)
+
+    def no_fits(*args, **kwargs):
+        raise AssertionError('PSF FITS files read instead of the store')
+
+    monkeypatch.setattr(PSFLibrary, 'read_library', no_fits)
+    library = PSFLibrary(path=str(tmpdir), aperture=aperture)
+    assert_libraries_match(library, expected)
+    assert len(library._psfs) == (8 if aperture == 'all' else 4)
+    psf = library.get_psf(2.0, 'nirspec', 's400a1')
+    np.testing.assert_array_equal(psf['int'], psfs[('s400a1', 2.0)])
+
+
+def test_stale_store_version(tmpdir):
+    """
+    A store packed by another version has to be ignored in favour of the FITS files
+    """
+    write_library(tmpdir)
+    index = pack_psf_library(str(tmpdir))
+    index['version'] -= 1
+    with open(str(tmpdir.join(psf_store_index)), 'w') as f:
+        json.dump(index, f)
+
+    with pytest.warns(UserWarning, match='version'):
+        library = PSFLibrary(path=str(tmpdir))
+    assert_libraries_match(library, PSFLibrary(path=str(tmpdir), store=False))
+
+
+def test_stale_store_mtime(tmpdir):
+    """
+    A PSF file that has changed since the store was packed has to be read instead of the store
+    """
+    write_library(tmpdir)
+    pack_psf_library(str(tmpdir))
+    filename = str(tmpdir.join('nirspec_s200a1_1.5.fits'))
+    with fits.open(filename, mode='update') as hdulist:
+        hdulist[0].data *= 2
+    os.utime(filename, (0, os.path.getmtime(filename) + 10))
+
+    with pytest.warns(UserWarning, match='has changed'):
+        library = PSFLibrary(path=str(tmpdir))
+    expected = PSFLibrary(path=str(tmpdir), store=False)
+    assert_libraries_match(library, expected)
+    np.testing.assert_array_equal(library.get_psf(1.5, 'nirspec', 's200a1')['int'],
+                                  fits.getdata(filename))
+
+
+def test_pack_mixed_shapes(tmpdir):
+    """
+    PSFs of one aperture that differ in shape can not be stacked, so packing them has to fail without
+    writing a store
+    """
+    write_library(tmpdir, waves=(1.0, 1.5))
+    write_library(tmpdir, waves=(2.0,), size=20)
+    with pytest.raises(DataError):
+        pack_psf_library(str(tmpdir))
+    assert not tmpdir.join(psf_store_index).check()
+    assert not tmpdir.join(psf_store_data).check()
+    assert tmpdir.listdir(lambda p: p.ext == '.tmp') == []
+
+
+def reference_get_values(library, key, instrument, aperture_name, source_offset=(0, 0)):
+    """
+    PSFLibrary.get_values() as it was before the library was indexed: a scan of the whole list
+    """
+    values = [psf[key] for psf in library._psfs
+              if (instrument == psf['instrument'] and
+                  aperture_name in psf['aperture_name']) and
+                  source_offset == psf['source_offset']]
+    ids = [i for i, psf in enumerate(library._psfs)
+           if (instrument == psf['instrument'] and
+               aperture_name in psf['aperture_name']) and
+               source_offset == psf['source_offset']]
+    return ids, values
+
+
+def reference_get_psf(library, wave, instrument, aperture_name, source_offset=(0, 0)):
+    """
+    PSFLibrary.get_psf() as it was before the library was indexed, for wavelengths between library entries
+    """
+    wids, psf_waves = reference_get_values(library, 'wave', instrument, aperture_name, source_offset=source_offset)
+    diff = np.array(psf_waves) - wave
+    smaller = np.max(diff[diff <= 0])
+    larger = np.min(diff[diff >= 0])
+    ids = [wids[i] for i, v in enumerate(diff) if v == smaller or v == larger]
+    psf0, psf1 = library._psfs[ids[0]], library._psfs[ids[1]]
+    frac = (wave - psf0['wave']) / (psf1['wave'] - psf0['wave'])
+    return {
+        'int': psf0['int'] + (psf1['int'] - psf0['int']) * frac,
+        'wave': wave,
+        'pix_scl': psf0['pix_scl'],
+        'diff_limit': psf0['diff_limit'] + (psf1['diff_limit'] - psf0['diff_limit']) * frac,
+        'upsamp': psf0['upsamp'],
+        'instrument': psf0['instrument'],
+        'aperture_name': psf0['aperture_name'],
+        'source_offset': psf0['source_offset']
+    }
+
+
+@pytest.fixture(scope='module')
+def mixed_library(tmpdir_factory):
+    """
+    PSF library with several apertures and source offsets, read from the FITS files
+    """
+    path = tmpdir_factory.mktemp('mixed_psfs')
+    write_library(path, apertures=('s200a1', 's200a2', 's400a1'), offsets=((0., 0.), (0.1, 45.)))
+    return PSFLibrary(path=str(path), store=False)
+
+
+@pytest.mark.parametrize('key', ['wave', 'pix_scl', 'int'])
+@pytest.mark.parametrize('instrument, aperture_name, source_offset', [
+    ('nirspec', 's200a1', (0., 0.)),
+    ('nirspec', 's200a', (0., 0.)),
+    ('nirspec', 's400a1', (0.1, 45.)),
+    ('nirspec', 's1600a1', (0., 0.)),
+    ('nircam', 's200a1', (0., 0.)),
+])
+def test_get_values_matches_list_scan(mixed_library, key, instrument, aperture_name, source_offset):
+    """
+    The indexed lookup has to find the same entries as scanning the list, including substring matches of the
+    aperture name across groups, sorted by wavelength rather than in list order
+    """
+    ids, values = mixed_library.get_values(key, instrument, aperture_name, source_offset=source_offset)
+    expected_ids, expected_values = reference_get_values(mixed_library, key, instrument, aperture_name,
+                                                         source_offset=source_offset)
+    assert sorted(ids) == sorted(expected_ids)
+    expected = dict(zip(expected_ids, expected_values))
+    for i, value in zip(ids, values):
+        np.testing.assert_array_equal(value, expected[i])
+    waves = [mixed_library._psfs[i]['wave'] for i in ids]
+    assert waves == sorted(waves)
+    # repeated lookups are served from the cached group
+    assert mixed_library.get_values(key, instrument, aperture_name, source_offset=source_offset)[0] == ids
+
+
+@pytest.mark.parametrize('aperture_name, source_offset', [('s200a1', (0., 0.)), ('s200a2', (0.1, 45.)),
+                                                          ('s400a1', (0., 0.))])
+def test_get_psf_matches_list_scan(mixed_library, aperture_name, source_offset):
+    """
+    Between library wavelengths the indexed lookup has to interpolate the same PSFs as scanning the list
+    """
+    for wave in (1.2, 1.75, 2.01, 2.9):
+        psf = mixed_library.get_psf(wave, 'nirspec', aperture_name, source_offset=source_offset)
+        expected = reference_get_psf(mixed_library, wave, 'nirspec', aperture_name, source_offset=source_offset)
+        assert sorted(psf) == sorted(expected)
+        for key in expected:
+            if key == 'int':
+                # the two PSFs may be interpolated in either order, which rounds differently in single precision
+                assert np.abs(psf[key] - expected[key]).max() <= 1e-6 * np.abs(expected[key]).max()
+            else:
+                assert psf[key] == pytest.approx(expected[key], rel=1e-12)
+
+
+def test_lazy_library(tmpdir):
+    """
+    A lazy library has to read only the headers up front and memory-map each image when it is first used
+    """
+    psfs = write_library(tmpdir, apertures=('s200a1', 's400a1'))
+    library = PSFLibrary(path=str(tmpdir), lazy=True, store=False)
+    assert all(isinstance(psf, _LazyPSF) and 'int' not in psf for psf in library._psfs)
+    assert library.nbytes == 8 * 65 * 65 * 4
+    assert all('int' not in group for group in library._index.values())
+
+    psf = library.get_psf(1.2, 'nirspec', 's400a1')
+    loaded = [entry for entry in library._psfs if 'int' in entry]
+    assert sorted((entry['aperture_name'], entry['wave']) for entry in loaded) == [('s400a1', 1.0),
+                                                                                  ('s400a1', 1.5)]
+    for entry in loaded:
+        base = entry['int']
+        while isinstance(base, np.ndarray):
+            base = base.base
+        assert isinstance(base, mmap.mmap)
+    expected = psfs[('s400a1', 1.0)] + (psfs[('s400a1', 1.5)] - psfs[('s400a1', 1.0)]) * 0.4
+    assert np.abs(psf['int'] - expected).max() <= 1e-6 * expected.max()
+    # the library is counted at its full size whether or not the images have been loaded
+    assert library.nbytes == 8 * 65 * 65 * 4
+
+
+def test_psf_library_cache(tmpdir):
+    """
+    The cache has to count hits and misses and evict the least recently used libraries by number and size,
+    always keeping the most recently used one
+    """
+    write_library(tmpdir, apertures=('s200a1', 's200a2', 's400a1'))
+    library_mb = 4 * 65 * 65 * 4 / 1024 ** 2
+    path = str(tmpdir)
+
+    cache = PSFLibraryCache(max_entries=2)
+    a = cache.get(path, aperture='s200a1')
+    b = cache.get(path, aperture='s200a2')
+    assert cache.get(path, aperture='s200a1') is a
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 2, 0)
+    # s200a2 is now the least recently used
+    c = cache.get(path, aperture='s400a1')
+    assert cache.get(path, aperture='s200a1') is a
+    assert cache.get(path, aperture='s400a1') is c
+    assert cache.get(path, aperture='s200a2') is not b
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 4, 2)
+
+    # configure() leaves the limits that are not given alone and evicts down to the new ones
+    cache.configure(max_size=2.5 * library_mb)
+    assert (cache.max_size, cache.max_entries) == (2.5 * library_mb, 2)
+    cache.configure(max_entries=None)
+    assert (cache.max_size, cache.max_entries) == (2.5 * library_mb, None)
+    cache.get(path, aperture='s200a1')
+    cache.get(path, aperture='s400a1')
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['size'] == pytest.approx(2 * library_mb)
+    cache.configure(max_size=1.5 * library_mb)
+    assert cache.stats()['entries'] == 1
+    assert cache.get(path, aperture='s400a1') is not None
+    assert cache.stats()['hits'] == stats['hits'] + 1
+    cache.configure(max_size=0.)
+    assert cache.stats()['entries'] == 1
+
+    cache.clear()
+    assert cache.stats()['entries'] == 0
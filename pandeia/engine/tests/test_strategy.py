@@ -0,0 +1,264 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import numpy as np
+
+import pytest
+
+from ..strategy import Strategy
+
+product_keys = ('extracted_flux', 'extracted_flux_plus_bg', 'extracted_bg_total', 'extracted_bg_only',
+                'extracted_noise')
+
+
+class Namespace(object):
+
+    """
+    Plain object to hang the attributes that the code under test uses on
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_strategy(background_subtraction):
+    """
+    Build a Strategy with just what _error_sum() needs
+    """
+    strategy = object.__new__(Strategy)
+    strategy.reconstruct_cube = lambda signal, noise: None
+    strategy.get_plane_grid = lambda signal: None
+    strategy.extraction_area = 1
+    strategy.background_area = 1
+    strategy.background_subtraction = background_subtraction
+    strategy.instrument = Namespace(dispersion_axis=lambda: 'x')
+    return strategy
+
+
+def make_detector(rng, correlated, shape):
+    """
+    Build random detector signal and noise with some saturated pixels
+
+    Returns
+    -------
+    signal, noise: Namespace, Namespace
+    """
+    ny, nx = shape
+    rate = rng.uniform(size=shape)
+    saturation = np.zeros(shape)
+    saturation[rng.uniform(size=shape) < 0.05] = 1
+    saturation[rng.uniform(size=shape) < 0.05] = 2
+    correlation = rng.uniform(size=(2 * ny + 1, 2 * nx + 1)) * 0.1
+    correlation[ny, nx] = 1.
+    signal = Namespace(
+        rate=rate,
+        rate_plus_bg=rate + rng.uniform(size=shape),
+        get_saturation_mask=lambda: saturation,
+        calculation_config=Namespace(noise={'rn_correlation': correlated}),
+        det_pars={'rn_correlation': correlated},
+        read_noise_correlation_matrix=correlation,
+        projection_type='spec',
+        wave_pix=np.arange(nx)
+    )
+    var_pix = rng.uniform(size=shape) + 0.5
+    noise = Namespace(var_pix=var_pix, var_rn_pix=var_pix * 0.3, stdev_pix=np.sqrt(var_pix))
+    return signal, noise
+
+
+def make_weights(rng, shape):
+    """
+    Random weight matrix with negative background weights
+    """
+    weights = rng.uniform(size=shape)
+    weights[rng.uniform(size=shape) < 0.4] = -0.3
+    return np.matrix(weights)
+
+
+def reference_covariance_matrix(signal, noise, subscripts):
+    """
+    The dense covariance matrix that Strategy._error_sum() built for each product before the products were
+    batched
+    """
+    diagonal = noise.var_pix[subscripts].ravel()
+    diagonal_rn = noise.var_rn_pix[subscripts].ravel()
+    nn = diagonal.shape[0]
+    if signal.calculation_config.noise['rn_correlation'] and signal.det_pars['rn_correlation']:
+        c_ij = np.zeros((nn, nn))
+        ncorr = int((signal.read_noise_correlation_matrix.shape[0] - 1) / 2)
+        for i in range(nn):
+            correlation_subscripts = (subscripts[0] - subscripts[0][i] + ncorr,
+                                      subscripts[1] - subscripts[1][i] + ncorr)
+            c_ij[i, :] = signal.read_noise_correlation_matrix[correlation_subscripts] * diagonal_rn[i]
+            c_ij[i, i] = diagonal[i]
+    else:
+        c_ij = np.diagflat(diagonal)
+    return c_ij
+
+
+def reference_error_sum(strategy, a_ij, product_subscripts, signal, noise):
+    """
+    The products of Strategy._error_sum() as they were calculated one product at a time with the dense
+    covariance matrix. The normalized covariance matrix was built from the first product only, which is
+    generalized here to the first product of each size.
+    """
+    products = dict((key, []) for key in product_keys + ('full', 'partial'))
+    saturation_mask = signal.get_saturation_mask()
+    c_ij_norms = {}
+    for product_subscript in product_subscripts:
+        nn = len(product_subscript[0])
+        if nn not in c_ij_norms:
+            init_var = noise.var_pix[product_subscript].ravel()
+            c_ij_init = reference_covariance_matrix(signal, noise, product_subscript)
+            c_ij_norms[nn] = c_ij_init / init_var.reshape(len(init_var), 1)
+
+        a_ij_raveled = a_ij[product_subscript]
+        a_ij_bg_raveled = a_ij[product_subscript]
+        a_ij_bg_raveled[a_ij_bg_raveled > 0] = 0
+        a_ij_bg_raveled *= -1.0
+
+        diagonal = noise.var_pix[product_subscript].ravel()
+        c_ij = c_ij_norms[nn] * diagonal.reshape(len(diagonal), 1)
+        var_product = np.dot(np.dot(a_ij_raveled, c_ij), a_ij_raveled.transpose())
+
+        flux_product = a_ij_raveled.dot(np.matrix(signal.rate[product_subscript]).transpose())
+        flux_plus_bg_product = a_ij_raveled.dot(np.matrix(signal.rate_plus_bg[product_subscript]).transpose())
+        bg_rate = np.matrix(signal.rate_plus_bg[product_subscript] - signal.rate[product_subscript])
+        if strategy.background_subtraction:
+            bg_only = a_ij_bg_raveled.dot(bg_rate.transpose())
+            bg_plus_contamination = a_ij_bg_raveled.dot(np.matrix(signal.rate_plus_bg[product_subscript]).transpose())
+        else:
+            bg_only = a_ij_raveled.dot(bg_rate.transpose())
+            bg_plus_contamination = bg_only
+
+        products['extracted_noise'].append(np.sqrt(var_product.item()))
+        products['extracted_flux'].append(flux_product.item())
+        products['extracted_flux_plus_bg'].append(flux_plus_bg_product.item())
+        products['extracted_bg_only'].append(bg_only.item())
+        products['extracted_bg_total'].append(bg_plus_contamination.item())
+        products['full'].append(np.sum(saturation_mask[product_subscript] == 2))
+        products['partial'].append(np.sum(saturation_mask[product_subscript] == 1))
+    return dict((key, np.array(value)) for key, value in products.items())
+
+
+def assert_products_match(result, expected):
+    """
+    Compare the extracted products of _error_sum() with those of reference_error_sum()
+    """
+    for key in product_keys:
+        assert result[key].shape == expected[key].shape
+        np.testing.assert_allclose(result[key], expected[key], rtol=1e-12, atol=0)
+    for key in ('full', 'partial'):
+        np.testing.assert_array_equal(result['saturation_products'][key], expected[key])
+
+
+@pytest.mark.parametrize('correlated', [False, True])
+@pytest.mark.parametrize('background_subtraction', [False, True])
+@pytest.mark.parametrize('mode', ['spec', 'image'])
+def test_error_sum(correlated, background_subtraction, mode):
+    """
+    Extracting all products in batches has to give the same products as extracting them one at a time.
+    Spectra have one product per column and images one product for the whole aperture.
+    """
+    rng = np.random.RandomState(1)
+    strategy = make_strategy(background_subtraction)
+    shape = (20, 150) if mode == 'spec' else (30, 30)
+    signal, noise = make_detector(rng, correlated, shape)
+    a_ij = make_weights(rng, shape)
+    if mode == 'spec':
+        product_subscripts = [(np.arange(shape[0]), strategy._fill_array(shape[0], i)) for i in range(shape[1])]
+    else:
+        rows, cols = a_ij.nonzero()
+        product_subscripts = [(np.asarray(rows).ravel(), np.asarray(cols).ravel())]
+
+    result = strategy._error_sum(a_ij, product_subscripts, signal, noise)
+    assert_products_match(result, reference_error_sum(strategy, a_ij, product_subscripts, signal, noise))
+
+
+@pytest.mark.parametrize('correlated', [False, True])
+def test_error_sum_mixed_sizes(correlated):
+    """
+    Products with different numbers of pixels are extracted in separate batches. With correlated noise each
+    batch scales the normalized covariance matrix of its own first product.
+    """
+    rng = np.random.RandomState(2)
+    strategy = make_strategy(True)
+    shape = (20, 90)
+    signal, noise = make_detector(rng, correlated, shape)
+    a_ij = make_weights(rng, shape)
+    # every third product is shorter, and the first product belongs to the larger batch
+    sizes = [12 if i % 3 == 1 else 20 for i in range(shape[1])]
+    product_subscripts = [(np.arange(size), strategy._fill_array(size, i)) for i, size in enumerate(sizes)]
+    assert len(strategy._stack_subscripts(product_subscripts)) == 2
+
+    result = strategy._error_sum(a_ij, product_subscripts, signal, noise)
+    assert_products_match(result, reference_error_sum(strategy, a_ij, product_subscripts, signal, noise))
+
+
+@pytest.mark.parametrize('correlated', [False, True])
+def test_reference_product(correlated):
+    """
+    The noise of the product that reference_product() describes has to be the one that _error_sum() extracts
+    """
+    rng = np.random.RandomState(5)
+    strategy = make_strategy(False)
+    shape = (20, 90)
+    signal, noise = make_detector(rng, correlated, shape)
+    a_ij = make_weights(rng, shape)
+    sizes = [12 if i % 3 == 1 else 20 for i in range(shape[1])]
+    product_subscripts = [(np.arange(size), strategy._fill_array(size, i)) for i, size in enumerate(sizes)]
+    strategy._create_weight_matrix = lambda signals, noises: (a_ij, product_subscripts)
+    expected = strategy._error_sum(a_ij, product_subscripts, signal, noise)['extracted_noise']
+
+    for index in (0, 1, 40):
+        product, = strategy.reference_product([signal], [noise], index)
+        a = product['weights']
+        np.testing.assert_array_equal(a, np.asarray(a_ij)[product_subscripts[index]])
+        diagonal = noise.var_pix[product['pixels']]
+        if correlated:
+            covariance_pixels = product['covariance_pixels']
+            c_ij_norm = strategy._normalized_covariance(product['correlation'], noise.var_pix[covariance_pixels],
+                                                        noise.var_rn_pix[covariance_pixels])
+            var = np.dot(np.dot(a * diagonal, c_ij_norm), a)
+        else:
+            assert product['correlation'] is None
+            var = np.sum(a ** 2 * diagonal)
+        np.testing.assert_allclose(np.sqrt(var), expected[index], rtol=1e-12)
+
+
+def test_normalized_covariance():
+    """
+    The normalized covariance matrix has to be the dense covariance matrix as it was, divided row-wise by the
+    variance
+    """
+    rng = np.random.RandomState(3)
+    strategy = make_strategy(False)
+    signal, noise = make_detector(rng, True, (15, 20))
+    subscripts = np.nonzero(rng.uniform(size=(15, 20)) < 0.3)
+    assert strategy._correlated_noise(signal)
+    correlation = strategy._read_noise_correlation(signal, subscripts)
+    c_ij_norm = strategy._normalized_covariance(correlation, noise.var_pix[subscripts], noise.var_rn_pix[subscripts])
+    expected = reference_covariance_matrix(signal, noise, subscripts) / noise.var_pix[subscripts].reshape(-1, 1)
+    np.testing.assert_allclose(c_ij_norm, expected, rtol=1e-15)
+
+
+def test_error_sum_uncorrelated(monkeypatch):
+    """
+    Without correlated read noise no covariance matrix is built, so large apertures are cheap, and the variance
+    of each product is the variance-weighted sum of its squared weights. A pixel without variance adds nothing.
+    """
+    def no_covariance(*args, **kwargs):
+        raise AssertionError('covariance matrix built for uncorrelated noise')
+
+    monkeypatch.setattr(Strategy, '_read_noise_correlation', no_covariance)
+    monkeypatch.setattr(Strategy, '_normalized_covariance', no_covariance)
+    rng = np.random.RandomState(4)
+    strategy = make_strategy(False)
+    shape = (300, 300)
+    signal, noise = make_detector(rng, False, shape)
+    noise.var_pix[0, 0] = 0.
+    a_ij = make_weights(rng, shape)
+    product_subscripts = [np.indices(shape).reshape(2, -1)]
+
+    result = strategy._error_sum(a_ij, product_subscripts, signal, noise)
+    expected = np.sqrt(np.sum(np.asarray(a_ij) ** 2 * noise.var_pix))
+    np.testing.assert_allclose(result['extracted_noise'], [expected], rtol=1e-12)
@@ -0,0 +1,52 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import division, absolute_import
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+import pytest
+
+from ..custom_exceptions import EngineInputError
+from ..utils import interpolation_matrix, interpolate_axis
+
+
+@pytest.mark.parametrize('axis', [0, 1, 2, -1])
+@pytest.mark.parametrize('dtype, rtol', [(np.float64, 1e-12), (np.float32, 1e-6)])
+def test_interpolate_axis(axis, dtype, rtol):
+    """
+    Interpolating with the sparse interpolation matrix has to match scipy's linear interp1d along any axis,
+    for irregular grids and wavelengths on the ends and on the input samples
+    """
+    rng = np.random.RandomState(1)
+    orig_wave = np.sort(rng.uniform(1., 3., 300))
+    new_wave = np.concatenate((rng.uniform(orig_wave[0], orig_wave[-1], 200), orig_wave[[0, 17, -1]]))
+    shape = [7, 9, 11]
+    shape[axis] = orig_wave.size
+    data = rng.uniform(size=shape)
+
+    result = interpolate_axis(data, orig_wave, new_wave, axis=axis, dtype=dtype)
+    expected = interp1d(orig_wave, data, kind='linear', axis=axis, assume_sorted=True)(new_wave)
+    assert result.dtype == dtype
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result, expected, rtol=rtol, atol=0)
+
+
+def test_interpolation_matrix_cache():
+    """
+    Matrices are reused for the same pair of grids, but not for different grids or data types
+    """
+    orig_wave = np.linspace(1., 2., 50)
+    new_wave = np.linspace(1.1, 1.9, 20)
+    matrix = interpolation_matrix(orig_wave, new_wave)
+    assert interpolation_matrix(orig_wave.copy(), new_wave.copy()) is matrix
+    assert interpolation_matrix(orig_wave, new_wave[:-1]) is not matrix
+    assert interpolation_matrix(orig_wave, new_wave, dtype=np.float64) is not matrix
+    np.testing.assert_allclose(np.asarray(matrix.sum(axis=1)).ravel(), 1., rtol=1e-6)
+
+
+def test_interpolation_matrix_range():
+    """
+    Wavelengths outside of the range of the data can not be interpolated onto
+    """
+    with pytest.raises(EngineInputError):
+        interpolation_matrix(np.linspace(1., 2., 50), np.array([0.5, 1.5]))
@@ -2,15 +2,25 @@
 from __future__ import division, absolute_import
 
 import six
+import hashlib
+import threading
+from collections import OrderedDict
 from functools import reduce
 
 import numpy as np
+import scipy.sparse as sparse
 import pysynphot as psyn
 
 from .custom_exceptions import EngineInputError, PysynphotError
 
 default_separator = "__"
 
+# number of wavelength interpolation matrices kept by interpolation_matrix()
+default_interpolation_cache_size = 16
+
+_interpolation_matrices = OrderedDict()
+_interpolation_lock = threading.Lock()
+
 
 def merge_wavelengths(waveset1, waveset2, threshold=1.0e-12):
     """
@@ -102,6 +112,103 @@ def spectrum_resample(flux, orig_wave, new_wave, mask_val=np.nan):
     return binned_flux
 
 
+def interpolation_matrix(orig_wave, new_wave, dtype=np.float32):
+    """
+    Build the sparse matrix that linearly interpolates data sampled at orig_wave onto new_wave. Each row has
+    at most two non-zero entries, the weights of the two bracketing input samples. This is the same interpolation
+    as scipy.interpolate.interp1d(kind='linear'), but it can be reused for any number of spectra sampled on the
+    same grid. Matrices are cached per pair of wavelength sets since the same grids are used over and over,
+    e.g. for each dither and for the passes with and without background.
+
+    Parameters
+    ----------
+    orig_wave: 1D np.ndarray
+        Sorted set of wavelengths the data are sampled at
+    new_wave: 1D np.ndarray
+        Set of wavelengths to interpolate onto. These must be within the range of orig_wave.
+    dtype: np.dtype
+        Data type of the matrix
+
+    Returns
+    -------
+    matrix: scipy.sparse.csr_matrix
+        Matrix of shape (len(new_wave), len(orig_wave)). This is shared so must not be modified.
+    """
+    orig_wave = np.ascontiguousarray(orig_wave, dtype=np.float64)
+    new_wave = np.ascontiguousarray(new_wave, dtype=np.float64)
+    dtype = np.dtype(dtype)
+
+    if orig_wave.size < 2:
+        raise EngineInputError(value="Need at least two wavelengths to interpolate from.")
+    if new_wave.size > 0 and (new_wave.min() < orig_wave[0] or new_wave.max() > orig_wave[-1]):
+        raise EngineInputError(value="Wavelengths to interpolate onto are outside of the range of the data.")
+
+    key = (
+        hashlib.sha1(orig_wave.view(np.uint8)).hexdigest(),
+        hashlib.sha1(new_wave.view(np.uint8)).hexdigest(),
+        orig_wave.size,
+        new_wave.size,
+        dtype.str
+    )
+    with _interpolation_lock:
+        matrix = _interpolation_matrices.pop(key, None)
+        if matrix is not None:
+            # re-insert to mark as most recently used
+            _interpolation_matrices[key] = matrix
+            return matrix
+
+    # index of the input sample at or below each output wavelength. the last interval is closed at the top.
+    lower = np.clip(np.searchsorted(orig_wave, new_wave, side='right') - 1, 0, orig_wave.size - 2)
+    frac = (new_wave - orig_wave[lower]) / (orig_wave[lower + 1] - orig_wave[lower])
+
+    rows = np.repeat(np.arange(new_wave.size), 2)
+    cols = np.column_stack((lower, lower + 1)).ravel()
+    weights = np.column_stack((1.0 - frac, frac)).ravel().astype(dtype)
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(new_wave.size, orig_wave.size))
+
+    with _interpolation_lock:
+        _interpolation_matrices[key] = matrix
+        while len(_interpolation_matrices) > default_interpolation_cache_size:
+            _interpolation_matrices.popitem(last=False)
+    return matrix
+
+
+def interpolate_axis(data, orig_wave, new_wave, axis=-1, dtype=None):
+    """
+    Linearly interpolate data along one axis from orig_wave onto new_wave using a cached interpolation_matrix().
+    The data are copied once into the working layout and type; no other temporaries of the size of the data
+    are made.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        Data sampled at orig_wave along axis
+    orig_wave: 1D np.ndarray
+        Sorted set of wavelengths the data are sampled at
+    new_wave: 1D np.ndarray
+        Set of wavelengths to interpolate onto. These must be within the range of orig_wave.
+    axis: int
+        Axis of data to interpolate along
+    dtype: np.dtype or None
+        Data type to do the interpolation in. None means use the data type of data.
+
+    Returns
+    -------
+    interp_data: np.ndarray
+        Data interpolated onto new_wave. Has the same shape as data except along axis.
+    """
+    data = np.asanyarray(data)
+    if dtype is None:
+        dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    matrix = interpolation_matrix(orig_wave, new_wave, dtype=dtype)
+
+    # put the interpolation axis first so that the matrix multiplies a contiguous (nwave, nspectra) array
+    work = np.ascontiguousarray(np.moveaxis(data, axis, 0), dtype=dtype)
+    interp_data = matrix.dot(work.reshape(work.shape[0], -1))
+    interp_data = interp_data.reshape((matrix.shape[0],) + work.shape[1:])
+    return np.moveaxis(interp_data, 0, axis)
+
+
 def recursive_subclasses(cls):
     """
     The __subclasses__() method only goes on level deep, but various classes that ultimately